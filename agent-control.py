@@ -1,16 +1,32 @@
 #!/bin/env python3.12
 # pylint: disable=line-too-long,invalid-name,too-many-branches,too-many-statements,too-many-arguments,too-many-instance-attributes
-# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring,too-many-lines,too-many-locals
 
 import argparse
+import asyncio
+import contextlib
+import copy
+import fcntl
+import functools
+import glob
+import html
+import json
 import logging
 import os
+import random
 import re
+import shlex
+import shutil
 import signal
 import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
 import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
 
 from duffy.client import DuffyClient
 from duffy.client.main import DuffyAPIErrorModel
@@ -19,6 +35,210 @@ from httpx import HTTPStatusError, TimeoutException
 API_BASE = "https://duffy.ci.centos.org/api/v1"
 GITHUB_BASE = "https://github.com/systemd/"
 GITHUB_CI_REPO = "systemd-centos-ci"
+# Local utility scripts (resolved relative to this script, not to the CWD)
+UTILS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils")
+# See utils/task-history.py
+REMOTE_TASK_HISTORY = "/var/cache/systemd-centos-ci/task-history.json"
+# See CI_CACHE_DIR in common/utils.sh
+REMOTE_NODE_CACHE = "/var/cache/systemd-centos-ci/cache"
+# See CCACHE_DIR in agent/bootstrap.sh
+REMOTE_BUILD_CACHE = "/var/cache/systemd-centos-ci/ccache"
+# See DEFAULT_CACHE_DIR in utils/vagrant-box-cache.py
+REMOTE_BOX_CACHE = "/var/cache/systemd-centos-ci/vagrant-boxes"
+# Package bundles with bootstrap dependencies (see agent/package-bundle-sync.sh)
+PACKAGE_BUNDLE_URL = "https://artifacts.ci.centos.org/systemd/package_bundles"
+# Timeout of a single connection attempt when probing the SSH port of a node
+SSH_PROBE_TIMEOUT = 3
+# Max delay between two SSH port probes
+SSH_PROBE_MAX_DELAY = 5
+# Give up on allocating a node after this many seconds
+ALLOCATION_TIMEOUT = 7200
+# Initial & max delay between allocation attempts (in seconds, with jitter)
+ALLOCATION_BASE_DELAY = 5
+ALLOCATION_MAX_DELAY = 60
+# Delay the allocation attempts from each subsequent pool in the list by this
+# many seconds, so the preferred pool wins if all of them have free capacity
+ALLOCATION_POOL_STAGGER = 2
+# Journal of active sessions, so sessions of jobs that got killed can be retired later (see --reap)
+SESSION_JOURNAL_DIR = os.path.expanduser(os.environ.get("AGENT_CONTROL_JOURNAL", "~/.cache/agent-control/sessions"))
+# How often to pull artifacts from the node while a remote command is running (in seconds)
+ARTIFACTS_SYNC_INTERVAL = 300
+# Bare mirrors of the git repositories used to stage the sources for --push-sources
+SOURCE_MIRROR_DIR = os.path.expanduser(os.environ.get("AGENT_CONTROL_MIRRORS", "~/.cache/agent-control/mirrors"))
+# Depth of the systemd history shipped to the nodes with --push-sources (the testsuite
+# needs at least the merge base of the checked out ref and the main branch)
+SOURCE_PUSH_DEPTH = 500
+
+
+class Tracer():
+    """Collect timing spans of individual operations
+
+    Spans are recorded from all threads and can be exported in the Chrome
+    trace event format (which can be loaded into chrome://tracing or Perfetto)
+    or summarized per span name.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = {}
+        self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Record the time spent in the wrapped block as a span
+
+        Params:
+        -------
+        name : str
+            Name of the span (spans with the same name are aggregated in the summary)
+        attrs : dict
+            Additional attributes stored with the span
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            thread = threading.current_thread()
+            with self._lock:
+                self._threads[thread.ident] = thread.name
+                self._events.append({
+                    "name" : name,
+                    "ph"   : "X",
+                    "ts"   : round((start - self._origin) * 1e6),
+                    "dur"  : round((end - start) * 1e6),
+                    "pid"  : os.getpid(),
+                    "tid"  : thread.ident,
+                    "args" : attrs,
+                })
+
+    def write(self, path):
+        """Write all recorded spans into a file (in the Chrome trace event format)"""
+        with self._lock:
+            events = list(self._events)
+            events += [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                       for tid, name in self._threads.items()]
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self):
+        """Get the total time spent in each span
+
+        Returns:
+        --------
+        List of (name, count, total, max) tuples (durations in seconds) sorted
+        by the total time
+        """
+        totals = {}
+        with self._lock:
+            for event in self._events:
+                count, total, longest = totals.get(event["name"], (0, 0, 0))
+                duration = event["dur"] / 1e6
+                totals[event["name"]] = (count + 1, total + duration, max(longest, duration))
+
+        return sorted(((name, *values) for name, values in totals.items()), key=lambda x: x[2], reverse=True)
+
+    def log_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+
+        width = max(len(name) for name, *_ in summary)
+        logging.info("Time spent per span:")
+        logging.info("%-*s %6s %11s %11s", width, "Span", "Count", "Total [s]", "Max [s]")
+        for name, count, total, longest in summary:
+            logging.info("%-*s %6d %11.1f %11.1f", width, name, count, total, longest)
+
+TRACER = Tracer()
+
+def traced(func):
+    """Record each call of an AgentControl method as a span (see Tracer)"""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with TRACER.span(func.__qualname__, node=self.node):
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+class SSHTransport():
+    """Multiplexed SSH transport to a single node
+
+    All ssh/scp invocations share one authenticated connection (using OpenSSH's
+    ControlMaster feature), so the TCP & key exchange handshake is paid only
+    by the first command. The master connection needs to be closed explicitly
+    when the node goes away (reboot, kexec), the next command then transparently
+    establishes a new one.
+
+    The user and port are configurable, so the transport can be pointed to
+    a local sshd as well.
+    """
+    def __init__(self, host, user="root", port=None):
+        self.host = host
+        self.user = user
+        self.port = port
+        self._control_dir = tempfile.mkdtemp(prefix="agent-control-ssh-")
+        # Keep the path short, as it needs to fit into sockaddr_un
+        self._control_path = os.path.join(self._control_dir, "master")
+
+    def __del__(self):
+        self.close()
+        shutil.rmtree(self._control_dir, ignore_errors=True)
+
+    def options(self):
+        return [
+            "-o", "UserKnownHostsFile=/dev/null",
+            "-o", "StrictHostKeyChecking=no",
+            "-o", "ConnectTimeout=180",
+            "-o", "TCPKeepAlive=yes",
+            "-o", "ServerAliveInterval=30",
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={self._control_path}",
+            # Tear down the master connection if it's not used for a while, so
+            # we don't leave stray ssh processes behind if we get killed
+            "-o", "ControlPersist=10m",
+            "-o", f"User={self.user}",
+            # Let ssh_config(5) decide if the port is not set explicitly, so
+            # it's possible to map the allocated hostnames to local SSH targets
+            *(["-o", f"Port={self.port}"] if self.port else []),
+        ]
+
+    def ssh_command(self, command, tty=True):
+        return ["/usr/bin/ssh", *(["-t"] if tty else []), *self.options(), self.host, command]
+
+    def scp_command(self, source, target):
+        return ["/usr/bin/scp", "-r", *self.options(), source, target]
+
+    def rsync_command(self, source, target, delete=False):
+        # --partial keeps partially transferred files around, so interrupted
+        # transfers can be resumed by the next sync
+        return ["/usr/bin/rsync", "-rlptz", "--partial", "--sparse", *(["--delete"] if delete else []),
+                "-e", shlex.join(["/usr/bin/ssh", *self.options()]), source, target]
+
+    def remote_path(self, path):
+        return f"{self.host}:{path}"
+
+    def endpoint(self):
+        """Get the host & port ssh actually connects to (see ssh_endpoint())"""
+        return ssh_endpoint(self.host, self.user, self.port)
+
+    def close(self):
+        """Close the master connection (if any)
+
+        This needs to be called every time the remote end goes away (i.e. when
+        rebooting the node), otherwise the subsequent commands would get stuck
+        on a stale connection.
+        """
+        if not os.path.exists(self._control_path):
+            return
+
+        logging.info("Closing the master SSH connection to %s", self.host)
+        subprocess.run(["/usr/bin/ssh", "-o", f"ControlPath={self._control_path}", "-O", "exit", self.host],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
 
 
 class AgentControl():
@@ -27,8 +247,18 @@ class AgentControl():
         self.interactive = False
         self.keep_node = False
         self._node_hostname = None
+        self._nodes = []
         self._session_id = None
         self._reboot_count = 0
+        self._transport = None
+        self.pool = None
+        # Time spent waiting for a node in each pool (see allocate_node())
+        self.allocation_waits = {}
+        # Local processes (ssh & co.) currently running on behalf of this
+        # instance (see terminate_processes())
+        self._processes = set()
+        self._processes_lock = threading.Lock()
+        self._terminated = False
 
         # Load Duffy key
         self.duffy_key = os.environ.get("CICO_API_KEY")
@@ -38,57 +268,179 @@ class AgentControl():
             logging.fatal("Invalid Duffy key")
             sys.exit(1)
 
-        self._client = DuffyClient(API_BASE, "systemd", self.duffy_key)
+        self._client = self._new_client()
 
     def __del__(self):
-        self.free_session()
+        if self._session_id:
+            self.free_session()
+
+    def _new_client(self):
+        return duffy_client(self.duffy_key)
 
     @property
     def node(self):
         return self._node_hostname
 
-    def allocate_node(self, pool):
-        result = None
-        payload = {
-            "pool"     : pool,
-            "quantity" : 1,
-        }
+    @property
+    def nodes(self):
+        return self._nodes
 
-        logging.info("Attempting to allocate a node from pool %s", pool)
+    def node_view(self, hostname, artifacts_storage=None):
+        """Get an AgentControl instance bound to another node from the current session
 
-        # Wait up to 2 hours with a try every 5 seconds
-        wait_delay = 5
-        attempts = int(7200 / wait_delay)
-        for i in range(1, attempts + 1):
-            error = None
+        The returned instance shares the Duffy client and configuration with
+        the current one, but has its own SSH transport and artifacts storage,
+        so it can be used concurrently with other views. It doesn't own the
+        session, i.e. it never retires it - that's still a responsibility
+        of the original instance.
 
-            try:
-                result = self._client.request_session([payload])
-            except HTTPStatusError as e:
-                error = f"Error response {e.response.status_code} while requesting {e.request.url!r}."
-            except TimeoutException as e:
-                error = f"Timeout while requesting {e.request.url!r}"
+        Params:
+        -------
+        hostname : str
+            Hostname of a node allocated in the current session
+        artifacts_storage : str (default: None)
+            Local directory to store artifacts fetched from the node in
 
-            if isinstance(result, DuffyAPIErrorModel):
-                error = result.error
+        Returns:
+        --------
+        A new AgentControl instance
+        """
+        assert hostname in self._nodes, f"Node {hostname} is not part of the current session"
 
-            if error is not None:
-                # Print the error only every minute to not unnecessarily spam the console
-                if i == 1 or i % 12 == 0:
-                    logging.error("[Try %d/%d] Received an API error from the server: %s", i, attempts, error)
+        view = copy.copy(self)
+        # pylint: disable=W0212
+        view._session_id = None
+        view._node_hostname = hostname
+        view._nodes = [hostname]
+        view._transport = SSHTransport(hostname)
+        view._processes = set()
+        view._processes_lock = threading.Lock()
+        view._terminated = False
+        view.artifacts_storage = artifacts_storage
 
-                time.sleep(wait_delay)
-            else:
-                self._session_id = result.session.id
-                self._node_hostname = result.session.nodes[0].hostname
-                break
+        return view
+
+    @traced
+    def allocate_node(self, pools, quantity=1):
+        """Allocate node(s) from the first pool with free capacity
+
+        Sessions are requested from all given pools concurrently (each pool with
+        its own jittered exponential backoff) and the first granted session
+        wins. Any other session granted in the meantime is retired right away.
+
+        Params:
+        -------
+        pools : list of str
+            Acceptable pools, in the order of preference
+        quantity : int (default: 1)
+            Number of nodes to allocate
+
+        Throws:
+        -------
+        RuntimeError if no node was allocated in ALLOCATION_TIMEOUT seconds
+        """
+        done = threading.Event()
+        lock = threading.Lock()
+        deadline = time.monotonic() + ALLOCATION_TIMEOUT
+
+        def request_session(index, pool):
+            client = self._new_client()
+            payload = {
+                "pool"     : pool,
+                "quantity" : quantity,
+            }
+            start = time.monotonic()
+            delay = ALLOCATION_BASE_DELAY
+            last_report = None
+
+            with TRACER.span(f"Allocation wait ({pool})", pool=pool):
+                done.wait(index * ALLOCATION_POOL_STAGGER)
+                attempt = 0
+                while not done.is_set() and time.monotonic() < deadline:
+                    attempt += 1
+                    result = None
+                    error = None
+
+                    try:
+                        result = client.request_session([payload])
+                    except HTTPStatusError as e:
+                        error = f"Error response {e.response.status_code} while requesting {e.request.url!r}."
+                    except TimeoutException as e:
+                        error = f"Timeout while requesting {e.request.url!r}"
+
+                    if isinstance(result, DuffyAPIErrorModel):
+                        error = result.error
+
+                    if error is None:
+                        with lock:
+                            self.allocation_waits[pool] = time.monotonic() - start
+                            if not self._session_id and not done.is_set():
+                                # Save the session right away, so it gets retired
+                                # even if we get interrupted
+                                self.pool = pool
+                                self._session_id = result.session.id
+                                self._nodes = [node.hostname for node in result.session.nodes]
+                                self._node_hostname = self._nodes[0]
+                                journal_add(self._session_id, pool=pool, nodes=self._nodes)
+                                done.set()
+                                return
+
+                        logging.info("Retiring extra session %s from pool %s", result.session.id, pool)
+                        journal_add(result.session.id, pool=pool, nodes=[node.hostname for node in result.session.nodes])
+                        if not retire_session_detached(result.session.id) and retire_session(client, result.session.id):
+                            journal_remove(result.session.id)
+                        return
+
+                    # Print the error only every minute to not unnecessarily spam the console
+                    if last_report is None or time.monotonic() - last_report >= 60:
+                        logging.error("[%s] [Try %d] Received an API error from the server: %s", pool, attempt, error)
+                        last_report = time.monotonic()
+
+                    # Equal jitter, so the clients waiting for the same pool don't
+                    # synchronize with each other
+                    done.wait(random.uniform(delay / 2, delay))
+                    delay = min(delay * 2, ALLOCATION_MAX_DELAY)
+
+                with lock:
+                    self.allocation_waits.setdefault(pool, time.monotonic() - start)
+
+        logging.info("Attempting to allocate %d node(s) from pool(s) %s", quantity, ", ".join(pools))
+
+        # Don't make the threads daemonic, so a session granted while we're
+        # bailing out still gets retired
+        threads = [threading.Thread(target=request_session, args=(i, pool), name=f"allocate-{pool}")
+                   for i, pool in enumerate(pools)]
+        try:
+            for thread in threads:
+                thread.start()
+
+            # Wait in short intervals, so we can still handle signals
+            while not done.wait(1) and any(t.is_alive() for t in threads):
+                pass
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+
+        for pool, wait_time in self.allocation_waits.items():
+            logging.info("Waited %.1f seconds for pool %s%s", wait_time, pool,
+                         " (granted)" if self.pool == pool else "")
 
         if not self._session_id:
             raise RuntimeError("Failed to allocate a node")
 
-        logging.info("Allocated node %s with session id %s", self.node, self._session_id)
-        self.wait_for_node(ping_attempts=5, ssh_attempts=10)
+        self._transport = SSHTransport(self._node_hostname)
 
+        logging.info("Allocated node(s) %s with session id %s", ", ".join(self._nodes), self._session_id)
+        # Probe all nodes at once, so we wait only for the slowest one (nodes
+        # with an unknown SSH endpoint are then handled by wait_for_node())
+        endpoints = [ssh_endpoint(hostname, self._transport.user, self._transport.port) for hostname in self._nodes]
+        wait_for_ssh_port([e for e in endpoints if e], timeout=300)
+        for hostname in self._nodes:
+            ac = self if hostname == self.node else self.node_view(hostname)
+            ac.wait_for_node(timeout=300)
+
+    @traced
     def execute_local_command(self, command):
         """Execute a command on the local machine
 
@@ -104,12 +456,47 @@ class AgentControl():
         """
         logging.info("Executing a LOCAL command: %s", " ".join(command))
 
-        # pylint: disable=R1732
-        proc = subprocess.Popen(command, stdout=None, stderr=None, shell=False)
+        with self._tracked_process(command, stdout=None, stderr=None) as proc:
+            return proc.wait()
+
+    @contextlib.contextmanager
+    def _tracked_process(self, command, **kwargs):
+        """Start a local process which can be terminated by terminate_processes()
+
+        Throws:
+        -------
+        RuntimeError if the processes of this instance were already terminated
+        """
+        with self._processes_lock:
+            if self._terminated:
+                raise RuntimeError(f"Not running '{' '.join(command)}', processes for node {self.node} were terminated")
+
+            # pylint: disable=R1732
+            proc = subprocess.Popen(command, shell=False, **kwargs)
+            self._processes.add(proc)
 
-        return proc.wait()
+        try:
+            yield proc
+        finally:
+            with self._processes_lock:
+                self._processes.discard(proc)
 
-    def execute_remote_command(self, command, expected_rcode=0, artifacts_dir=None, ignore_rc=False):
+    def terminate_processes(self):
+        """Terminate all local processes running on behalf of this instance
+
+        This unblocks threads waiting for remote commands (see run_sharded()),
+        no new commands can be started using this instance afterwards.
+        """
+        with self._processes_lock:
+            self._terminated = True
+            processes = list(self._processes)
+
+        for proc in processes:
+            logging.info("Terminating local process %d (node %s): %s", proc.pid, self.node, " ".join(proc.args))
+            proc.terminate()
+
+    @traced
+    def execute_remote_command(self, command, expected_rcode=0, artifacts_dir=None, ignore_rc=False, max_failures=0):
         """Execute a command on a remote host
 
         Technically the function wraps the command in an ssh command and executes
@@ -129,6 +516,9 @@ class AgentControl():
         ignore_rc : bool (default: False)
             If True, the `execute_remote_command` throws an exception if the
             remote command fails
+        max_failures : int (default: 0)
+            If not 0, abort the command once it reports this many failed tasks
+            (see common/task-control.sh), regardless of `ignore_rc`
 
         Returns:
         --------
@@ -137,6 +527,7 @@ class AgentControl():
         Throws:
         -------
         An exception if the `ignore_rc` is False and the return code != `expected_rcode`
+        FailFastException if the command was aborted because of `max_failures`
         """
         assert self.node, "Can't continue without a valid node"
 
@@ -147,28 +538,38 @@ class AgentControl():
         else:
             expected_rcodes = [expected_rcode]
 
-        command_wrapper = [
-            "/usr/bin/ssh", "-t",
-            "-o", "UserKnownHostsFile=/dev/null",
-            "-o", "StrictHostKeyChecking=no",
-            "-o", "ConnectTimeout=180",
-            "-o", "TCPKeepAlive=yes",
-            "-o", "ServerAliveInterval=30",
-            "-l", "root",
-            self.node, command
-        ]
+        command_wrapper = self._transport.ssh_command(command)
+        sync_artifacts = artifacts_dir is not None and self.artifacts_storage is not None
+
+        if sync_artifacts:
+            # Pull the artifacts periodically while the command is running, so
+            # we have at least partial results if we get killed and the final
+            # sync has less work to do
+            stop_sync = threading.Event()
+            sync_thread = threading.Thread(target=self._sync_artifacts_periodically,
+                                           args=(artifacts_dir, self.artifacts_storage, stop_sync),
+                                           name=f"artifacts-{self.node}", daemon=True)
+            sync_thread.start()
 
+        failed_tasks = []
         logging.info("Executing a REMOTE command on node '%s': %s", self.node, command)
         try:
-            rc = self.execute_local_command(command_wrapper)
+            if max_failures:
+                rc, failed_tasks = self._execute_and_watch(command_wrapper, max_failures)
+            else:
+                rc = self.execute_local_command(command_wrapper)
             logging.info(f"Remote command exited with {rc}")
         except AlarmException:
             logging.info("Remote command was interrupted by timeout")
             # Delay the timeout exception, so we can fetch artifacts first
             timeout = True
+        finally:
+            if sync_artifacts:
+                stop_sync.set()
+                sync_thread.join()
 
         # Fetch artifacts if both remote and local dirs are set
-        if artifacts_dir is not None and self.artifacts_storage is not None:
+        if sync_artifacts:
             arc = self.fetch_artifacts(artifacts_dir, self.artifacts_storage)
             if arc != 0:
                 logging.warning("Fetching artifacts failed")
@@ -176,11 +577,56 @@ class AgentControl():
         if timeout:
             raise AlarmException()
 
+        if max_failures and len(failed_tasks) >= max_failures:
+            raise FailFastException(f"Aborted after {len(failed_tasks)} failed task(s): {', '.join(failed_tasks)}")
+
         if not ignore_rc and rc not in expected_rcodes:
             raise RuntimeError("Remote command exited with an unexpected return code "
                                f"(got: {rc}, expected: {expected_rcode}), bailing out")
         return rc
 
+    def _execute_and_watch(self, command, max_failures):
+        """Execute a command while watching its output for failed tasks
+
+        The output is passed through to our stdout line by line, and the command
+        is terminated once it reports `max_failures` failed tasks (i.e. [RESULT]
+        lines with FAIL, which are emitted only when a task runs out of retries).
+
+        Returns:
+        --------
+        Tuple of the command's return code and a list of failed tasks
+        """
+        logging.info("Executing a LOCAL command (fail-fast after %d failure(s)): %s", max_failures, " ".join(command))
+
+        failed_tasks = []
+        with self._tracked_process(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as proc:
+            try:
+                for raw_line in proc.stdout:
+                    sys.stdout.buffer.write(raw_line)
+                    sys.stdout.flush()
+
+                    match = TASK_RESULT_RX.match(raw_line.decode(errors="replace").strip())
+                    if not match or match.group("ignored") or match.group("status") != "FAIL":
+                        continue
+
+                    failed_tasks.append(match.group("name"))
+                    logging.warning("[fail-fast] Task %s failed on node %s (%d/%d)",
+                                    match.group("name"), self.node, len(failed_tasks), max_failures)
+                    if len(failed_tasks) >= max_failures:
+                        logging.error("[fail-fast] Reached the limit of failed tasks, aborting the remote command")
+                        break
+            finally:
+                # Don't leave the ssh process behind if we bailed out early (or got
+                # interrupted); the node gets retired anyway, so there's no need to
+                # clean up the remote side
+                if proc.poll() is None:
+                    proc.terminate()
+                rc = proc.wait()
+                proc.stdout.close()
+
+        return rc, failed_tasks
+
+    @traced
     def fetch_artifacts(self, remote_dir, local_dir):
         """Fetch artifacts from remote host to a local directory
 
@@ -191,67 +637,71 @@ class AgentControl():
         local_dir : str
             Path of a local (target) directory
 
+        Artifacts are transferred using rsync (if available), which compresses
+        the data on the wire, transfers only the changes since the last fetch,
+        and resumes interrupted transfers.
+
         Returns:
         --------
-        Return code of the underlying `scp` command
+        Return code of the underlying `rsync` (or `scp`) command
         """
         assert self.node, "Can't continue without a valid node"
 
-        command = [
-            "/usr/bin/scp", "-r",
-            "-o UserKnownHostsFile=/dev/null",
-            "-o StrictHostKeyChecking=no",
-            f"root@{self.node}:{remote_dir}",
-            local_dir
-        ]
+        if shutil.which("rsync"):
+            command = self._transport.rsync_command(self._transport.remote_path(remote_dir), local_dir)
+        else:
+            command = self._transport.scp_command(self._transport.remote_path(remote_dir), local_dir)
 
         logging.info("Fetching artifacts from node %s: (remote: %s, local: %s)",
                      self.node, remote_dir, local_dir)
 
-        return self.execute_local_command(command)
+        rc = self.execute_local_command(command)
+        # rsync returns 24 if some files vanished during the transfer, which
+        # is expected when syncing logs of a running testsuite
+        return 0 if command[0].endswith("rsync") and rc == 24 else rc
 
+    def _sync_artifacts_periodically(self, remote_dir, local_dir, stop_event):
+        # Wait first, since there's usually nothing to fetch right after
+        # the remote command starts
+        while not stop_event.wait(ARTIFACTS_SYNC_INTERVAL):
+            # pylint: disable=W0703
+            try:
+                # The remote directory might not exist yet, so ignore any errors,
+                # the final sync will report them
+                self.fetch_artifacts(remote_dir, local_dir)
+            except Exception:
+                logging.warning("Periodic artifacts sync from %s failed", self.node, exc_info=True)
+
+    @traced
     def free_session(self):
         if not self._session_id:
             return
 
         if self.keep_node:
             logging.info("Not returning the node %s back to the pool", self.node)
+            # The session is kept intentionally, so don't let the reaper retire it
+            journal_remove(self._session_id)
             return
 
         # Make sure we don't get disturbed by any signal Jenkins might send us
         for s in [signal.SIGTERM, signal.SIGHUP, signal.SIGINT]:
             signal.signal(s, signal.SIG_IGN)
 
-        # Try a bit harder when retiring the session, since the API might return an error
-        # when attempting to do so, leaving orphaned sessions laying around taking
-        # precious resources
-        attempts = 10
-        for i in range(1, attempts + 1):
-            logging.info("[Try %d/%d] Freeing session %s (with node %s)", i, attempts, self._session_id, self.node)
-
-            # pylint: disable=W0703
-            try:
-                result = self._client.retire_session(self._session_id)
-                if isinstance(result, DuffyAPIErrorModel):
-                    # A particularly ugly workaround for an issue in Duffy where a session
-                    # might not get released even after a successful API call. Let's make
-                    # sure the session is released by making multiple calls until the API
-                    # returns an error that the session is already released.
-                    # See: https://github.com/CentOS/duffy/issues/558
-                    if re.search(r"session \d+ is retired", result.error.detail):
-                        logging.info("Session %s was successfully freed", self._session_id)
-                        break
+        logging.info("Freeing session %s (with node %s)", self._session_id, self.node)
+        # Retiring the session might take a while (see retire_session()), so
+        # do it in the background and don't block the Jenkins executor
+        if not retire_session_detached(self._session_id) and retire_session(self._client, self._session_id):
+            journal_remove(self._session_id)
 
-                    logging.info("Received an API error from the server: %s", result.error)
-
-            except Exception:
-                logging.info("Got an exception when trying to free a session, ignoring...", exc_info=True)
-
-            time.sleep(1)
+        if self._transport:
+            self._transport.close()
 
         self._session_id = None
         self._node_hostname = None
+        self._nodes = []
+        self._transport = None
 
+    @traced
     def reboot_node(self):
         """Reboot the node
 
@@ -266,10 +716,21 @@ class AgentControl():
                 "systemd-analyze set-log-level debug; systemd-analyze set-log-target console; systemctl reboot",
                 255,
                 ignore_rc=True)
-        time.sleep(30)
+        # The master connection died together with the node
+        self._transport.close()
+        # Make sure we don't catch the node before it actually goes down
+        endpoint = self._transport.endpoint()
+        try:
+            if endpoint:
+                wait_for_ssh_port([endpoint], timeout=120, up=False)
+            else:
+                self._wait_for_ssh_login(timeout=120, up=False)
+        except TimeoutError:
+            logging.warning("Node %s didn't go down in time, continuing anyway", self.node)
 
-        self.wait_for_node(ping_attempts=30, ssh_attempts=20)
+        self.wait_for_node(timeout=900)
 
+    @traced
     def kexec_to_latest(self, args=""):
         """Reboot the node using kexec
 
@@ -280,9 +741,11 @@ class AgentControl():
 
         logging.info("Rebooting node %s using kexec", self.node)
         self.execute_remote_command(f"{GITHUB_CI_REPO}/utils/kexec.sh {args}", [0, 255])
+        self._transport.close()
 
-        self.wait_for_node(ping_attempts=10, ssh_attempts=10)
+        self.wait_for_node(timeout=600)
 
+    @traced
     def show_session(self):
         assert self._session_id
 
@@ -310,23 +773,43 @@ class AgentControl():
             # any exceptions that happen here
             logging.exception("Exception occurred while getting session info, ignoring...")
 
-    def wait_for_node(self, ping_attempts, ssh_attempts):
-        assert self.node, "Can't continue without a valid node"
+    @traced
+    def wait_for_node(self, timeout, ssh_attempts=5):
+        """Wait until the node accepts SSH connections
 
-        ping_command = ["/usr/bin/ping", "-q", "-c", "1", "-W", "10", self.node]
-        attempts = clamp(1, 100, ping_attempts)
-        rc = -1
-        for i in range(1, attempts + 1):
-            logging.info("[Try %d/%d] Checking if node %s is alive", i, attempts, self.node)
-            rc = self.execute_local_command(ping_command)
-            if rc == 0:
-                logging.info("Node %s appears to be reachable", self.node)
-                break
+        The SSH port is probed directly (see wait_for_ssh_port()) and once it
+        responds with an SSH banner, we check if we can actually log in, since
+        sshd might start accepting connections a bit before the node is fully
+        up. If the SSH endpoint of the node is unknown (see ssh_endpoint()),
+        we keep trying to log in instead.
 
-            time.sleep(10)
+        Params:
+        -------
+        timeout : int
+            Max time (in seconds) to wait for the SSH port to come up
+        ssh_attempts : int (default: 5)
+            Number of login attempts once the SSH port is up
 
-        if rc != 0:
-            raise RuntimeError(f"Timeout reached when waiting for node {self.node} to become online")
+        Returns:
+        --------
+        Time (in seconds) it took the node to become ready
+
+        Throws:
+        -------
+        RuntimeError if the node is not ready in time
+        """
+        assert self.node, "Can't continue without a valid node"
+
+        start = time.monotonic()
+        logging.info("Waiting up to %d seconds for node %s to become ready", timeout, self.node)
+        endpoint = self._transport.endpoint()
+        try:
+            if endpoint:
+                wait_for_ssh_port([endpoint], timeout)
+            else:
+                self._wait_for_ssh_login(timeout)
+        except TimeoutError as e:
+            raise RuntimeError(f"Timeout reached when waiting for node {self.node} to become online") from e
 
         attempts = clamp(1, 100, ssh_attempts)
         rc = -1
@@ -334,7 +817,6 @@ class AgentControl():
             logging.info("[Try %d/%d] Checking if node %s is reachable over ssh", i, attempts, self.node)
             rc = self.execute_remote_command("true", ignore_rc=True)
             if rc == 0:
-                logging.info("Node %s appears to be reachable over ssh", self.node)
                 break
 
             time.sleep(5)
@@ -342,6 +824,40 @@ class AgentControl():
         if rc != 0:
             raise RuntimeError(f"Timeout reached when waiting for working ssh on node {self.node}")
 
+        elapsed = time.monotonic() - start
+        logging.info("Node %s is ready (time-to-ready: %.1f seconds)", self.node, elapsed)
+
+        return elapsed
+
+    def _wait_for_ssh_login(self, timeout, up=True):
+        """Wait until logging into the node over ssh starts (or stops) working
+
+        Fallback for wait_for_ssh_port() when we don't know which port to probe.
+
+        Params:
+        -------
+        timeout : float
+            Max time (in seconds) to wait
+        up : bool (default: True)
+            Wait for the login to start working (True) or to stop working (False)
+
+        Throws:
+        -------
+        TimeoutError if the node didn't reach the requested state in time
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            # Always start from scratch, the master connection might be stale
+            self._transport.close()
+            if (self.execute_remote_command("true", ignore_rc=True) == 0) == up:
+                return
+
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"SSH login to {self.node} didn't {'start' if up else 'stop'} working in time")
+
+            time.sleep(5)
+
+    @traced
     def upload_file(self, local_source, remote_target):
         """Upload a file (or a directory) to a remote host
 
@@ -358,25 +874,535 @@ class AgentControl():
         """
         assert self.node, "Can't continue without a valid node"
 
-        command = [
-            "/usr/bin/scp", "-r",
-            "-o UserKnownHostsFile=/dev/null",
-            "-o StrictHostKeyChecking=no",
-            local_source,
-            f"root@{self.node}:{remote_target}"
-        ]
+        command = self._transport.scp_command(local_source, self._transport.remote_path(remote_target))
 
         logging.info("Uploading file %s to node %s as %s", local_source, self.node, remote_target)
 
         if self.execute_local_command(command) != 0:
             raise RuntimeError(f"Failed to upload file {local_source} to {self.node}")
 
+    @traced
+    def upload_archive(self, archive, remote_dir="~"):
+        """Upload a gzipped tarball to a remote host and unpack it there
+
+        The archive is streamed over the SSH connection and unpacked on the fly,
+        top-level directories from the archive which already exist in the target
+        directory are replaced.
+
+        Params:
+        -------
+        archive : str
+            Path of a local gzipped tarball
+        remote_dir : str (default: ~)
+            Path of a remote directory to unpack the archive into
+        """
+        assert self.node, "Can't continue without a valid node"
+
+        with tarfile.open(archive, "r:gz") as tar:
+            top_dirs = sorted({member.name.split("/")[0] for member in tar.getmembers()})
+
+        command = f"cd {remote_dir} && rm -fr {shlex.join(top_dirs)} && tar -xzf -"
+        logging.info("Uploading archive %s (%s) to node %s", archive, ", ".join(top_dirs), self.node)
+
+        with open(archive, "rb") as stdin:
+            # Don't allocate a TTY, as that would mangle the binary data
+            rc = subprocess.run(self._transport.ssh_command(command, tty=False), stdin=stdin, check=False).returncode
+
+        if rc != 0:
+            raise RuntimeError(f"Failed to upload archive {archive} to {self.node}")
+
+    @traced
+    def sync_directory(self, local_dir, remote_dir, upload=True):
+        """Mirror a directory between the local machine and the remote host
+
+        The contents of the target directory are made identical to the source
+        one (i.e. files missing in the source directory are deleted), and only
+        the differences are transferred.
+
+        Params:
+        -------
+        local_dir : str
+            Path of a local directory
+        remote_dir : str
+            Path of a remote directory
+        upload : bool (default: True)
+            Mirror the local directory to the remote host if True, the other
+            way around otherwise
+
+        Returns:
+        --------
+        Return code of the underlying `rsync` command
+        """
+        assert self.node, "Can't continue without a valid node"
+
+        if upload:
+            self.execute_remote_command(f"mkdir -p {remote_dir}")
+            source, target = f"{local_dir}/", self._transport.remote_path(remote_dir)
+        else:
+            os.makedirs(local_dir, exist_ok=True)
+            source, target = self._transport.remote_path(f"{remote_dir}/"), local_dir
+
+        logging.info("Syncing directory %s node %s (local: %s, remote: %s)",
+                     "to" if upload else "from", self.node, local_dir, remote_dir)
+
+        return self.execute_local_command(self._transport.rsync_command(source, target, delete=True))
+
 class AlarmException(Exception):
     pass
 
+class FailFastException(RuntimeError):
+    pass
+
+def duffy_client(key):
+    # Allow overriding the API URL, i.e. to use a stand-in Duffy API instance
+    return DuffyClient(os.environ.get("CICO_API_URL", API_BASE), "systemd", key)
+
+def retire_session(client, session_id, attempts=10):
+    """Retire a Duffy session
+
+    Params:
+    -------
+    client : DuffyClient
+        Client to use for the API calls
+    session_id : int
+        ID of the session to retire
+    attempts : int (default: 10)
+        Max number of API calls
+
+    Returns:
+    --------
+    True if the session was confirmed to be retired, False otherwise
+    """
+    # Try a bit harder when retiring the session, since the API might return an error
+    # when attempting to do so, leaving orphaned sessions laying around taking
+    # precious resources
+    for i in range(1, attempts + 1):
+        logging.info("[Try %d/%d] Freeing session %s", i, attempts, session_id)
+
+        # pylint: disable=W0703
+        try:
+            result = client.retire_session(session_id)
+            if isinstance(result, DuffyAPIErrorModel):
+                # A particularly ugly workaround for an issue in Duffy where a session
+                # might not get released even after a successful API call. Let's make
+                # sure the session is released by making multiple calls until the API
+                # returns an error that the session is already released.
+                # See: https://github.com/CentOS/duffy/issues/558
+                if re.search(r"session \d+ is retired", result.error.detail):
+                    logging.info("Session %s was successfully freed", session_id)
+                    return True
+
+                logging.info("Received an API error from the server: %s", result.error)
+
+        except Exception:
+            logging.info("Got an exception when trying to free a session, ignoring...", exc_info=True)
+
+        time.sleep(1)
+
+    return False
+
+def journal_add(session_id, **data):
+    """Record an active session in the session journal
+
+    Each session has its own JSON file in SESSION_JOURNAL_DIR with the session
+    ID, PID of the process responsible for the session, and any additional data.
+    The entry is removed once the session is retired, so any entry whose process
+    is gone belongs to a leaked session (see reap_sessions()).
+
+    Params:
+    -------
+    session_id : int
+        ID of the session
+    data : dict
+        Additional data stored in the entry (the "pid" key overrides the PID
+        of the current process)
+    """
+    entry = {
+        "session_id" : session_id,
+        "pid"        : os.getpid(),
+        "created"    : datetime.now().astimezone().isoformat(timespec="seconds"),
+        **data,
+    }
+
+    # pylint: disable=W0703
+    try:
+        os.makedirs(SESSION_JOURNAL_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=SESSION_JOURNAL_DIR, prefix=".", delete=False, encoding="utf-8") as f:
+            json.dump(entry, f)
+
+        os.replace(f.name, os.path.join(SESSION_JOURNAL_DIR, f"{session_id}.json"))
+    except Exception:
+        # The journal is a safety net, not being able to write it shouldn't
+        # fail the whole job
+        logging.warning("Failed to add session %s to the session journal", session_id, exc_info=True)
+
+def journal_remove(session_id):
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(os.path.join(SESSION_JOURNAL_DIR, f"{session_id}.json"))
+
+def journal_entries():
+    for path in glob.glob(os.path.join(SESSION_JOURNAL_DIR, "*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                yield json.load(f)
+        except (OSError, ValueError):
+            logging.warning("Skipping invalid session journal entry %s", path)
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    # Make sure the PID wasn't reused by an unrelated process
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return b"agent-control" in f.read()
+    except OSError:
+        return True
+
+def retire_session_detached(session_id):
+    """Retire a session in a detached process
+
+    The process runs in a separate session (so it doesn't get killed together
+    with the job) and removes the session from the session journal once the
+    session is retired. Its output is saved into SESSION_JOURNAL_DIR/<ID>.log.
+
+    Returns:
+    --------
+    True if the process was started, False otherwise
+    """
+    # pylint: disable=W0703
+    try:
+        os.makedirs(SESSION_JOURNAL_DIR, exist_ok=True)
+        with open(os.path.join(SESSION_JOURNAL_DIR, f"{session_id}.log"), "ab") as log:
+            # pylint: disable=R1732
+            proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--retire-session", str(session_id)],
+                                    stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                    start_new_session=True)
+    except Exception:
+        logging.warning("Failed to retire session %s in the background", session_id, exc_info=True)
+        return False
+
+    logging.info("Retiring session %s in the background (PID %d)", session_id, proc.pid)
+    return True
+
+def retire_journaled_session(session_id):
+    """Retire a session from the session journal (see --retire-session)"""
+    entry = next((e for e in journal_entries() if e.get("session_id") == session_id), {})
+    # Take over the journal entry, so the reaper doesn't try to retire the same
+    # session concurrently
+    entry.pop("session_id", None)
+    journal_add(session_id, **{**entry, "pid": os.getpid()})
+
+    if not retire_session(duffy_client(os.environ.get("CICO_API_KEY")), session_id):
+        return 1
+
+    journal_remove(session_id)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(os.path.join(SESSION_JOURNAL_DIR, f"{session_id}.log"))
+
+    return 0
+
+def reap_sessions():
+    """Retire all sessions from the session journal whose owner process is gone
+
+    Returns:
+    --------
+    0 if all such sessions were retired, 1 otherwise
+    """
+    stale = [e for e in journal_entries() if not pid_alive(e.get("pid", 0))]
+    logging.info("Found %d stale session(s) in %s", len(stale), SESSION_JOURNAL_DIR)
+    if not stale:
+        return 0
+
+    client = duffy_client(os.environ.get("CICO_API_KEY"))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda e: retire_session(client, e["session_id"]), stale))
+
+    for entry, retired in zip(stale, results):
+        if retired:
+            journal_remove(entry["session_id"])
+        else:
+            logging.error("Failed to retire session %s (nodes: %s)", entry["session_id"], ", ".join(entry.get("nodes", [])))
+
+    return 0 if all(results) else 1
+
+def run_git(*args, cwd=None, check=True):
+    """Run a local git command and return its (stripped) stdout
+
+    Throws:
+    -------
+    subprocess.CalledProcessError if the command fails and check is True
+    """
+    command = ["git", *args]
+    logging.info("Executing a LOCAL command: %s", " ".join(command))
+
+    # Don't let the commands get stuck on a credentials prompt
+    env = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+    proc = subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.PIPE, check=check, text=True)
+
+    return proc.stdout.strip()
+
+def update_mirror(url, pr=None):
+    """Create or update a local bare mirror of a git repository
+
+    Only branches and tags are mirrored, refs of the pull request `pr` (if any)
+    are fetched on demand.
+
+    Params:
+    -------
+    url : str
+        URL of the upstream repository
+    pr : str (default: None)
+        ID of a pull request whose refs should be fetched as well
+
+    Returns:
+    --------
+    Path to the mirror
+    """
+    os.makedirs(SOURCE_MIRROR_DIR, exist_ok=True)
+    mirror = os.path.join(SOURCE_MIRROR_DIR, re.sub(r"[^\w.-]", "_", url.rstrip("/")))
+
+    # The mirrors are shared between all jobs running on this machine
+    with open(f"{mirror}.lock", "w", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if not os.path.isdir(mirror):
+            tmp_mirror = tempfile.mkdtemp(prefix="mirror-", dir=SOURCE_MIRROR_DIR)
+            run_git("clone", "--quiet", "--bare", url, tmp_mirror)
+            os.rename(tmp_mirror, mirror)
+
+        run_git("fetch", "--quiet", "--prune", "--force", "origin",
+                "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*", cwd=mirror)
+        # Follow the default branch of the upstream repository
+        head = re.search(r"^ref: (\S+)\s+HEAD$", run_git("ls-remote", "--symref", "origin", "HEAD", cwd=mirror), re.M)
+        if head:
+            run_git("symbolic-ref", "HEAD", head.group(1), cwd=mirror)
+
+        if pr:
+            # Draft and already merged pull requests don't have the 'merge' ref
+            # anymore (see git_checkout_pr() in common/utils.sh)
+            for ref in [f"refs/pull/{pr}/merge", f"refs/pull/{pr}/head"]:
+                run_git("fetch", "--quiet", "--force", "origin", f"+{ref}:{ref}", cwd=mirror, check=False)
+
+    return mirror
+
+def stage_repository(url, remote_ref, target, depth):
+    """Check out a git repository into a local directory
+
+    This is a local counterpart of the clone & git_checkout_pr() dance done by
+    the bootstrap scripts, so the result can be pushed to the nodes. The checkout
+    is a shallow clone of the local mirror, with the origin remote pointing back
+    to `url`, so it's (mostly) indistinguishable from a checkout made on the node.
+
+    Params:
+    -------
+    url : str
+        URL of the upstream repository
+    remote_ref : str
+        Ref to check out: pr:<ID>, a branch/tag/commit, or an empty string for
+        the main branch
+    target : str
+        Path of the resulting checkout
+    depth : int
+        Depth of the history of the resulting checkout
+    """
+    pr = remote_ref[3:] if remote_ref.startswith("pr:") else None
+    mirror = update_mirror(url, pr)
+
+    # Do the checkout in a full (but cheap, as it borrows the objects from the mirror)
+    # clone first, since the shallow history might not be enough for the rebase
+    with tempfile.TemporaryDirectory(prefix="stage-") as work_dir:
+        work = os.path.join(work_dir, "work")
+        run_git("clone", "--quiet", "--shared", mirror, work)
+        main_branch = run_git("rev-parse", "--abbrev-ref", "origin/HEAD", cwd=work)
+
+        if pr:
+            run_git("fetch", "--quiet", "-fu", "origin", f"refs/pull/{pr}/merge:pr", cwd=work, check=False)
+            if not run_git("rev-parse", "--verify", "--quiet", "pr", cwd=work, check=False):
+                run_git("fetch", "--quiet", "-fu", "origin", f"refs/pull/{pr}/head:pr", cwd=work)
+                run_git("-c", "user.name=systemd CentOS CI", "-c", "user.email=systemd-centos-ci@localhost",
+                        "rebase", "--quiet", main_branch, "pr", cwd=work)
+            run_git("checkout", "--quiet", "pr", cwd=work)
+        elif remote_ref:
+            run_git("checkout", "--quiet", remote_ref, cwd=work)
+        else:
+            run_git("checkout", "--quiet", main_branch.split("/", 1)[1], cwd=work)
+
+        run_git("-c", "advice.detachedHead=false", "clone", "--quiet", f"--depth={depth}", "--no-single-branch", f"file://{work}", target)
+
+    run_git("remote", "set-head", "origin", main_branch.split("/", 1)[1], cwd=target)
+    run_git("remote", "set-url", "origin", url, cwd=target)
+    logging.info("Staged %s (%s) in %s: %s", url, remote_ref or main_branch, target,
+                 run_git("log", "-1", "--format=%h %s", cwd=target))
+
+def stage_sources(args, remote_ref, staging_dir):
+    """Prepare the sources for the nodes, so they don't have to clone them
+
+    The CI repository (and the systemd repository, if the bootstrap script
+    supports pre-staged sources) are checked out locally and packed into a single
+    gzipped tarball, which is then uploaded to each node by prepare_node().
+
+    Returns:
+    --------
+    A tuple of the path to the tarball and a bool indicating if the tarball
+    contains the systemd repository as well
+    """
+    stage_repository(f"{GITHUB_BASE}{GITHUB_CI_REPO}", f"pr:{args.ci_pr}" if args.ci_pr else "",
+                     os.path.join(staging_dir, GITHUB_CI_REPO), depth=1)
+    entries = [GITHUB_CI_REPO]
+
+    # Only the upstream bootstrap scripts support pre-staged sources (-l)
+    with_systemd = not (args.vagrant_sync or args.package_bundle_sync) and (args.vagrant or args.bootstrap_script == "bootstrap.sh")
+    if with_systemd:
+        # Respect a custom repository URL passed to the bootstrap script (-s)
+        bootstrap_args = shlex.split(args.bootstrap_args)
+        repo_url = f"{GITHUB_BASE}systemd.git"
+        if "-s" in bootstrap_args[:-1]:
+            repo_url = bootstrap_args[bootstrap_args.index("-s") + 1]
+
+        stage_repository(repo_url, remote_ref, os.path.join(staging_dir, "systemd"), depth=SOURCE_PUSH_DEPTH)
+        entries.append("systemd")
+
+    archive = os.path.join(staging_dir, "sources.tar.gz")
+    with tarfile.open(archive, "w:gz", compresslevel=6) as tar:
+        for entry in entries:
+            tar.add(os.path.join(staging_dir, entry), arcname=entry)
+
+    logging.info("Staged sources in %s (%.1f MiB)", archive, os.path.getsize(archive) / 1024 / 1024)
+
+    return archive, with_systemd
+
 def clamp(_min, _max, value):
     return max(_min, min(_max, value))
 
+@functools.lru_cache(maxsize=None)
+def ssh_endpoint(host, user="root", port=None):
+    """Get the host & port ssh actually connects to for given host
+
+    Unless the port is set explicitly, both the hostname and the port may come
+    from ssh_config(5), so ask ssh itself (`ssh -G`) to resolve them. The result
+    is cached, so the config is resolved only once per host.
+
+    Params:
+    -------
+    host : str
+        Host as passed to ssh
+    user : str (default: root)
+        User to log in as (ssh_config(5) may match on it)
+    port : int (default: None)
+        Port to connect to, None to let ssh_config(5) decide
+
+    Returns:
+    --------
+    Tuple (hostname, port) or None if it couldn't be determined
+    """
+    if port:
+        return host, port
+
+    result = subprocess.run(["/usr/bin/ssh", "-G", "-o", f"User={user}", host], stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=False)
+    config = dict(line.split(" ", 1) for line in result.stdout.splitlines() if " " in line)
+    if result.returncode != 0 or not config.get("port", "").isdigit():
+        logging.warning("Failed to resolve the SSH endpoint of %s (rc %d)", host, result.returncode)
+        return None
+
+    return config.get("hostname", host), int(config["port"])
+
+async def probe_ssh_port(host, port, timeout=SSH_PROBE_TIMEOUT):
+    """Check if there's an SSH server listening on given host & port
+
+    Params:
+    -------
+    host : str
+        Host to probe
+    port : int
+        Port to probe
+    timeout : float (default: SSH_PROBE_TIMEOUT)
+        Timeout (in seconds) for the connection attempt and for the SSH banner
+
+    Returns:
+    --------
+    True if the server responded with an SSH banner, False otherwise
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+    try:
+        # The server may send other lines before the version string (see
+        # RFC 4253, section 4.2), but let's not wait for them indefinitely
+        for _ in range(5):
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if not line:
+                break
+            if line.startswith(b"SSH-"):
+                return True
+    except (OSError, asyncio.TimeoutError):
+        pass
+    finally:
+        writer.close()
+        with contextlib.suppress(OSError):
+            await writer.wait_closed()
+
+    return False
+
+async def _wait_for_ssh_port(host, port, deadline, up):
+    start = time.monotonic()
+    delay = 0.5
+
+    while True:
+        if await probe_ssh_port(host, port) == up:
+            return time.monotonic() - start
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"SSH port of {host} didn't go {'up' if up else 'down'} in time")
+
+        # Back off a bit to not hammer the node while it's booting, but keep
+        # the delay short, since every second counts here
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, SSH_PROBE_MAX_DELAY)
+
+def wait_for_ssh_port(endpoints, timeout, up=True):
+    """Wait until the SSH port of all given hosts is up (or down)
+
+    All hosts are probed concurrently by connecting directly to the SSH port
+    and checking for the SSH banner, which avoids the dead time of the ICMP
+    ping & ssh retry loops.
+
+    Params:
+    -------
+    endpoints : list of (str, int) tuples
+        Hosts & ports to probe (see ssh_endpoint())
+    timeout : float
+        Max time (in seconds) to wait for all hosts
+    up : bool (default: True)
+        Wait for the port to go up (True) or down (False)
+
+    Returns:
+    --------
+    Dict mapping each host to the time (in seconds) it took to reach
+    the requested state
+
+    Throws:
+    -------
+    TimeoutError if any of the hosts didn't reach the requested state in time
+    """
+    async def _wait_all():
+        deadline = time.monotonic() + timeout
+        return await asyncio.gather(*(_wait_for_ssh_port(host, port, deadline, up) for host, port in endpoints))
+
+    result = dict(zip((host for host, _ in endpoints), asyncio.run(_wait_all())))
+    for host, elapsed in result.items():
+        logging.info("SSH port of %s is %s after %.1f seconds", host, "up" if up else "down", elapsed)
+
+    return result
+
 def handle_signal(signum, _frame):
     print(f"handle_signal: got signal {signum}")
 
@@ -385,13 +1411,487 @@ def handle_signal(signum, _frame):
 
     sys.exit(signum)
 
+def prepare_node(ac, args):
+    """Install basic dependencies and set up the CI repository on the node"""
+    if not "centos-7-" in args.pool:
+        # Note: re-execute the user session, as the package update triggered by cloud-init
+        # might have pulled a newer systemd package with some incompatible changes
+        # for the user sessions.
+        # See: https://pagure.io/centos-infra/issue/865#comment-810347
+        logging.info("Wait until the machine is fully initialized")
+        dnf_wait = "bash -c 'while pgrep -a dnf; do sleep 1; done'"
+        with TRACER.span("PHASE 0: cloud-init", node=ac.node):
+            ac.execute_remote_command(f"systemd-run --wait -p Wants=cloud-init.target -p After=cloud-init.target -- {dnf_wait} && systemctl --user daemon-reexec")
+
+    # Let's differentiate between CentOS <= 7 (yum) and CentOS >= 8 (dnf)
+    pkg_man = "yum" if "centos-7-" in args.pool else "dnf"
+    # Clean dnf/yum caches to drop stale metadata and prevent unexpected
+    # installation fails before installing core dependencies
+    dep_cmd = f"{pkg_man} clean all && {pkg_man} makecache && {pkg_man} -y install bash git rsync"
+
+    # Actual testing process
+    logging.info("PHASE 1: Setting up basic dependencies to configure CI repository")
+    with TRACER.span("PHASE 1: dependencies", node=ac.node):
+        if args.sources_archive:
+            # The CI repository (and possibly other sources) are staged locally (see --push-sources)
+            ac.execute_remote_command(dep_cmd)
+            ac.upload_archive(args.sources_archive)
+        else:
+            command = f"{dep_cmd} && rm -fr {GITHUB_CI_REPO} && git clone {GITHUB_BASE}{GITHUB_CI_REPO}"
+            ac.execute_remote_command(command)
+
+    if args.ci_pr and not args.sources_archive:
+        logging.info("PHASE 1.5: Using a custom CI repository ref (PR#%s)", args.ci_pr)
+        with TRACER.span("PHASE 1.5: CI repository PR", node=ac.node):
+            command = f"cd {GITHUB_CI_REPO} && git fetch -fu origin 'refs/pull/{args.ci_pr}/merge:pr' && git checkout pr"
+            ac.execute_remote_command(command)
+
+def run_testsuite(ac, args, remote_ref, testsuite_args, update_node_cache=True):
+    """Bootstrap the node, reboot it, and run the testsuite on it
+
+    If --node-cache (or --build-cache) is used, the cache of build artifacts
+    (or compiled objects) is synced back from the node only if `update_node_cache`
+    is True.
+    """
+    # The compiler cache is specific to the pool (distro) and the build configuration
+    build_cache = os.path.join(args.build_cache, args.pool, args.bootstrap_script) if args.build_cache else None
+
+    logging.info("PHASE 2: Bootstrap (ref: %s)", remote_ref)
+    with TRACER.span("PHASE 2: bootstrap", node=ac.node):
+        command = f"{GITHUB_CI_REPO}/agent/{args.bootstrap_script} -r '{remote_ref}' {args.bootstrap_args}"
+        if args.sources_with_systemd:
+            command += " -l"
+        if args.package_bundle:
+            command += f" -S '{args.package_bundle}'"
+        if build_cache:
+            push_build_cache(ac, build_cache)
+            command += " -c"
+
+        try:
+            ac.execute_remote_command(command, artifacts_dir="~/bootstrap-logs*")
+        finally:
+            # Even a partial cache from a failed build is useful for the next run
+            if build_cache and update_node_cache:
+                pull_build_cache(ac, build_cache)
+
+    with TRACER.span("PHASE 2: reboot", node=ac.node, kexec=bool(args.kexec)):
+        if args.kexec:
+            ac.kexec_to_latest()
+        else:
+            ac.reboot_node()
+
+    if args.task_history and os.path.isfile(args.task_history):
+        logging.info("Uploading task history from %s", args.task_history)
+        ac.execute_remote_command(f"mkdir -p {os.path.dirname(REMOTE_TASK_HISTORY)}")
+        ac.upload_file(args.task_history, REMOTE_TASK_HISTORY)
+
+    # Cache entries are specific to the pool (kernel, architecture, etc.), so
+    # keep a separate cache for each of them
+    node_cache = os.path.join(args.node_cache, args.pool) if args.node_cache else None
+    if node_cache and os.path.isdir(node_cache):
+        if ac.sync_directory(node_cache, REMOTE_NODE_CACHE) != 0:
+            logging.warning("Failed to upload the node cache from %s", node_cache)
+
+    logging.info("PHASE 3: Upstream testsuite")
+    try:
+        with TRACER.span("PHASE 3: testsuite", node=ac.node):
+            command = f"{GITHUB_CI_REPO}/agent/{args.testsuite_script} {testsuite_args}"
+            ac.execute_remote_command(command, artifacts_dir="~/testsuite-logs*", max_failures=args.fail_fast)
+    finally:
+        # The cached artifacts don't depend on the test results, so update
+        # the cache even if the testsuite failed
+        if node_cache and update_node_cache:
+            if ac.sync_directory(node_cache, REMOTE_NODE_CACHE, upload=False) != 0:
+                logging.warning("Failed to update the node cache in %s", node_cache)
+
+def upload_duffy_key(ac):
+    """Upload the Duffy SSH key to the node
+
+    The key is needed to be able to upload files to the CentOS CI artifact server
+    """
+    if os.path.isfile("/duffy-ssh-key/ssh-privatekey"):
+        ac.upload_file("/duffy-ssh-key/ssh-privatekey", "/root/.ssh/duffy.key")
+    else:
+        ac.upload_file(os.path.expanduser("~/.ssh/id_rsa"), "/root/.ssh/duffy.key")
+
+    ac.execute_remote_command("chmod 0600 /root/.ssh/duffy.key")
+
+def push_build_cache(ac, build_cache):
+    """Upload the compiler cache (see --build-cache) to the node, if there's any"""
+    if not os.path.isdir(build_cache):
+        logging.info("Build cache %s doesn't exist yet, starting with an empty one", build_cache)
+        return
+
+    with TRACER.span("Build cache upload", node=ac.node):
+        if ac.sync_directory(build_cache, REMOTE_BUILD_CACHE) != 0:
+            logging.warning("Failed to upload the build cache from %s", build_cache)
+
+def pull_build_cache(ac, build_cache):
+    """Sync the compiler cache (see --build-cache) back from the node"""
+    with TRACER.span("Build cache download", node=ac.node):
+        if ac.sync_directory(build_cache, REMOTE_BUILD_CACHE, upload=False) != 0:
+            logging.warning("Failed to update the build cache in %s", build_cache)
+
+def run_sharded(ac, args, remote_ref):
+    """Run the testsuite split across all nodes from the current session
+
+    Each node is bootstrapped independently (and concurrently) and runs only
+    its own part (shard) of the integration tests. Artifacts from each node
+    are stored in a separate shard-N subdirectory of the artifacts storage
+    and the results are then merged together.
+
+    Throws:
+    -------
+    An exception if any of the shards failed
+    """
+    shards = []
+    for i, hostname in enumerate(ac.nodes, start=1):
+        storage = os.path.join(ac.artifacts_storage, f"shard-{i}")
+        os.makedirs(storage)
+        shards.append(ac.node_view(hostname, storage))
+
+    def run_shard(index, view):
+        logging.info("Running shard %d/%d on node %s", index, len(shards), view.node)
+        with TRACER.span("Shard", node=view.node, shard=f"{index}/{len(shards)}"):
+            prepare_node(view, args)
+            # All shards build the same cache entries, so let only the first
+            # one update the node cache
+            run_testsuite(view, args, remote_ref, f"-k {index}/{len(shards)} {args.testsuite_args}",
+                          update_node_cache=index == 1)
+
+    executor = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard")
+    futures = {executor.submit(run_shard, i, view): i for i, view in enumerate(shards, start=1)}
+
+    try:
+        # Don't use the executor as a context manager, since that would block
+        # until all shards finish even if we get interrupted by a timeout
+        wait(futures)
+    except AlarmException:
+        # The shard threads are blocked on their remote commands and we can't
+        # exit until they finish (see concurrent.futures), so stop them first
+        for view in shards:
+            view.terminate_processes()
+        # Collect at least partial results from all nodes before bailing out
+        # (using new views, since the terminated ones can't run commands anymore)
+        for view in shards:
+            ac.node_view(view.node, view.artifacts_storage).fetch_artifacts("~/testsuite-logs*", view.artifacts_storage)
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    failed = []
+    for future, index in futures.items():
+        if not future.done() or future.exception():
+            logging.error("Shard %d/%d (node %s) failed: %s", index, len(shards), shards[index - 1].node,
+                          future.exception() if future.done() else "cancelled")
+            failed.append(index)
+
+    merge_shard_results(ac.artifacts_storage)
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} out of {len(shards)} shard(s) failed")
+
+def merge_shard_results(artifacts_dir):
+    """Merge the task-control state files from all shards into one
+
+    The merged .passed_tasks and .failed_tasks files are stored in the root
+    of the artifacts directory.
+
+    Returns:
+    --------
+    Number of failed tasks across all shards
+    """
+    results = {}
+    for state in [".passed_tasks", ".failed_tasks"]:
+        results[state] = []
+        for path in sorted(glob.glob(os.path.join(artifacts_dir, "shard-*", "testsuite-logs*", state))):
+            shard = path.split(os.sep)[-3]
+            with open(path, encoding="utf-8") as f:
+                results[state] += [f"{shard}/{line.strip()}" for line in f if line.strip()]
+
+        with open(os.path.join(artifacts_dir, state), "w", encoding="utf-8") as f:
+            f.writelines(f"{task}\n" for task in results[state])
+
+    passed = len(results[".passed_tasks"])
+    failed = len(results[".failed_tasks"])
+    logging.info("Merged results: %d passed, %d failed, %d total", passed, failed, passed + failed)
+    for task in sorted(results[".failed_tasks"]):
+        logging.info("Failed task: %s", task)
+
+    return failed
+
+# [RESULT] TEST-01-BASIC - PASS (log file: /root/testsuite-logs.abc/TEST-01-BASIC_PASS.log)
+# [RESULT] TEST-02-UNITTESTS - FAIL (EC: 1) (log file: /root/testsuite-logs.abc/TEST-02-UNITTESTS_FAIL.log)
+# [IGNORED RESULT] TEST-03-JOBS - EC: 1 (log file: /root/testsuite-logs.abc/TEST-03-JOBS_1_FAIL.log)
+TASK_RESULT_RX = re.compile(r"^\[(?P<ignored>IGNORED )?RESULT\] (?P<name>.+?) - (?:(?P<status>PASS|FAIL)(?: \(EC: (?P<ec1>-?[0-9]+)\))?|EC: (?P<ec2>-?[0-9]+)) \(log file: (?P<log>.+)\)$")
+INDEX_CSS = """
+body { font-family: monospace; }
+ul.tree, ul.tree ul { list-style-type: none; padding-left: 1.5em; }
+a { text-decoration: none; }
+a.dir { color: #0000ff; font-weight: bold; }
+a.file { color: #000000; }
+a.pass { color: #008000; }
+a.fail { color: #ff0000; font-weight: bold; }
+a.ignored { color: #ff8c00; }
+span.meta { color: #808080; }
+"""
+# As we can't expect to have 'cowsay' installed, let's make our own oversimplified
+# version of it for absolutely no apparent reason. The picture below is, of course,
+# borrowed from the cowsay package.
+INDEX_BANNER = r"""
+                       \                    ^    /^
+                        \                  / \  // \
+                         \   |\___/|      /   \//  .\
+                          \  /O  O  \__  /    //  | \ \           *----*
+                            /     /  \/_/    //   |  \  \          \   |
+                            @___@`    \/_   //    |   \   \         \/\ \
+                           0/0/|       \/_ //     |    \    \         \  \
+                       0/0/0/0/|        \///      |     \     \       |  |
+                    0/0/0/0/0/_|_ /   (  //       |      \     _\     |  /
+                 0/0/0/0/0/0/`/,_ _ _/  ) ; -.    |    _ _\.-~       /   /
+                             ,-}        _      *-.|.-~-.           .~    ~
+            \     \__/        `/\      /                 ~-. _ .-~      /
+             \____(oo)           *.   }            {                   /
+             (    (--)          .----~-.\        \-`                 .~
+             //__\\  \__ Ack!   ///.----..<        \             _ -~
+            //    \\               ///-._ _ _ _ _ _ _{^ - - - - ~
+"""
+
+def _read_task_results(directory):
+    """Get results of tasks from a task-control log directory
+
+    Use the [RESULT] lines saved by common/task-control.sh (.task_results) if
+    available and fall back to the .passed_tasks and .failed_tasks state files
+    otherwise. Durations are taken from the .task_durations file (see
+    utils/task-history.py).
+
+    Returns:
+    --------
+    Dict mapping log file names to task results and list of task results
+    without a log file
+    """
+    durations = {}
+    with contextlib.suppress(OSError):
+        with open(os.path.join(directory, ".task_durations"), encoding="utf-8") as f:
+            for line in f:
+                with contextlib.suppress(ValueError):
+                    name, duration = line.rstrip("\n").split("\t")
+                    durations[name] = float(duration)
+
+    results = []
+    with contextlib.suppress(OSError):
+        with open(os.path.join(directory, ".task_results"), encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = TASK_RESULT_RX.match(line.strip())
+                if not match:
+                    continue
+
+                if match.group("ignored"):
+                    status = "ignored"
+                else:
+                    status = "passed" if match.group("status") == "PASS" else "failed"
+
+                ec = match.group("ec1") or match.group("ec2")
+                results.append({
+                    "name"     : match.group("name"),
+                    "status"   : status,
+                    "ec"       : int(ec) if ec else 0,
+                    "log"      : os.path.basename(match.group("log")),
+                })
+
+    if not results:
+        for state, status in [(".passed_tasks", "passed"), (".failed_tasks", "failed")]:
+            with contextlib.suppress(OSError):
+                with open(os.path.join(directory, state), encoding="utf-8") as f:
+                    # Skip the merged results from shards (see merge_shard_results()),
+                    # each shard is indexed separately
+                    results += [{"name": line.strip(), "status": status, "ec": None,
+                                 "log": f"{line.strip()}_{'PASS' if status == 'passed' else 'FAIL'}.log"}
+                                for line in f if line.strip() and "/" not in line]
+
+    by_log = {}
+    for result in results:
+        result["duration"] = durations.get(result["name"])
+        by_log[result["log"]] = result
+
+    return by_log
+
+def _write_index_tree(out, directory, base_dir, manifest):
+    """Write an HTML list of all files in given directory (recursively)
+
+    Returns:
+    --------
+    Tuple with the number of directories, files, and their total size
+    """
+    with os.scandir(directory) as it:
+        entries = sorted(it, key=lambda e: e.name)
+
+    results = _read_task_results(directory)
+    dirs, files, size = 0, 0, 0
+
+    out.write("<ul>\n")
+    for entry in entries:
+        if entry.name.startswith("."):
+            continue
+
+        path = os.path.join(directory, entry.name)
+        href = urllib.parse.quote(os.path.relpath(path, base_dir))
+        name = html.escape(entry.name)
+
+        if entry.is_dir(follow_symlinks=False):
+            out.write(f"<li><a class='dir' href='{href}/'>{name}/</a>\n")
+            sub_dirs, sub_files, sub_size = _write_index_tree(out, path, base_dir, manifest)
+            out.write("</li>\n")
+            dirs += sub_dirs + 1
+            files += sub_files
+            size += sub_size
+            continue
+
+        entry_size = entry.stat(follow_symlinks=False).st_size
+        files += 1
+        size += entry_size
+        meta = [f"{entry_size / 1024:.1f} KiB"]
+
+        result = results.pop(entry.name, None)
+        if result is None and entry.name.endswith("_FAIL.log"):
+            # Logs from scripts that don't use task-control's state files
+            result = {"name": entry.name[:-len("_FAIL.log")], "status": "failed", "ec": None, "duration": None}
+
+        if result:
+            result = dict(result, log=os.path.relpath(path, base_dir), size=entry_size)
+            manifest["tasks"].append(result)
+            manifest["summary"][result["status"]] += 1
+            css_class, mark = {
+                "passed"  : ("pass", "&#x2705;"),
+                "failed"  : ("fail", "&#x274C;"),
+                "ignored" : ("ignored", "&#x26A0;"),
+            }[result["status"]]
+            if result["duration"] is not None:
+                meta.append(f"{result['duration']:.1f} s")
+            out.write(f"<li><a class='{css_class}' href='{href}'>{name}</a> {mark} ")
+        else:
+            out.write(f"<li><a class='file' href='{href}'>{name}</a> ")
+
+        out.write(f"<span class='meta'>({', '.join(meta)})</span></li>\n")
+
+    # Results without a matching log file (i.e. the log didn't make it to
+    # the artifacts)
+    for result in results.values():
+        result = dict(result, log=None, size=None)
+        manifest["tasks"].append(result)
+        manifest["summary"][result["status"]] += 1
+
+    out.write("</ul>\n")
+
+    return dirs, files, size
+
+def generate_index(artifacts_dir, index_file):
+    """Generate an HTML index page and a JSON manifest for given artifacts directory
+
+    The artifacts directory is walked only once and the HTML page is streamed
+    directly to the index file. Alongside the HTML page (and its CSS file,
+    since the Jenkins CSP disallows inline CSS) a JSON manifest (with the
+    .json suffix) with results, durations, and sizes of all tasks is written.
+
+    Params:
+    -------
+    artifacts_dir : str
+        Directory with artifacts
+    index_file : str
+        Path to the generated HTML file (links in it are relative to its location)
+    """
+    if not os.path.isdir(artifacts_dir):
+        raise RuntimeError(f"'{artifacts_dir}' is not a directory")
+
+    base_dir = os.path.dirname(os.path.abspath(index_file))
+    css_file = f"{index_file}.css"
+    manifest_file = f"{os.path.splitext(index_file)[0]}.json"
+    pr = os.environ.get("ghprbPullId", "N/A")
+    pr_url = os.environ.get("ghprbPullLink", "#")
+    build_url = os.environ.get("BUILD_URL", "")
+    manifest = {
+        "pr"        : pr,
+        "build_url" : build_url,
+        "date"      : datetime.now().astimezone().isoformat(timespec="seconds"),
+        "summary"   : {"passed": 0, "failed": 0, "ignored": 0},
+        "tasks"     : [],
+    }
+
+    with open(css_file, "w", encoding="utf-8") as f:
+        f.write(INDEX_CSS)
+
+    title = f"systemd CentOS CI (PR#<a href='{html.escape(pr_url)}'>{html.escape(pr)}</a>)"
+    with open(index_file, "w", encoding="utf-8") as out:
+        out.write("<!DOCTYPE html>\n<html>\n<head>\n<meta charset='utf-8'>\n")
+        out.write(f"<link rel='stylesheet' href='{urllib.parse.quote(os.path.basename(css_file))}' type='text/css'>\n")
+        out.write(f"<title>systemd CentOS CI (PR#{html.escape(pr)})</title>\n</head>\n<body>\n<h1>{title}</h1>\n")
+        out.write("<div>\n<table>\n")
+        for label, value in [
+                ("Build URL", f"<a href='{html.escape(build_url)}'>{html.escape(build_url)}</a>"),
+                ("Console log", f"<a href='{html.escape(build_url)}/console'>{html.escape(build_url)}/console</a>"),
+                ("PR title", html.escape(os.environ.get("ghprbPullTitle", "N/A"))),
+                ("Date", manifest["date"]),
+                ("Results", f"<a href='{urllib.parse.quote(os.path.basename(manifest_file))}'>"
+                            f"{os.path.basename(manifest_file)}</a>"),
+            ]:
+            out.write(f"<tr><td><strong>{label}:</strong></td><td>{value}</td></tr>\n")
+        out.write("</table>\n</br>\n</div>\n")
+
+        href = urllib.parse.quote(os.path.relpath(artifacts_dir, base_dir))
+        out.write(f"<ul class='tree'>\n<li><a class='dir' href='{href}/'>{html.escape(artifacts_dir)}</a>\n")
+        dirs, files, size = _write_index_tree(out, artifacts_dir, base_dir, manifest)
+        out.write("</li>\n</ul>\n")
+
+        summary = manifest["summary"]
+        out.write(f"<p>{dirs} directories, {files} files ({size / 1024 / 1024:.1f} MiB)</br>\n")
+        out.write(f"{summary['passed']} passed, {summary['failed']} failed, {summary['ignored']} ignored</p>\n")
+        out.write("</body>\n</html>\n")
+
+    manifest["files"] = {"directories": dirs, "files": files, "size": size}
+    with open(manifest_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    if build_url:
+        workspace = os.environ.get("WORKSPACE", "")
+        cwd = os.getcwd()
+        landing_url = f"{build_url}artifact/{cwd.removeprefix(workspace)}/{os.path.relpath(index_file)}"
+        print(f" {'_' * (len(landing_url) + 2)}\n< {landing_url} >\n {'-' * (len(landing_url) + 2)}{INDEX_BANNER}")
+
+def run_utility(ac, script, arguments):
+    """Run a script from the utils/ directory on the local machine
+
+    The utilities do only best-effort bookkeeping, so failures are logged and
+    otherwise ignored, as they must not affect the result of the run
+
+    Params:
+    -------
+    ac : AgentControl
+        AgentControl instance used to run the script
+    script : str
+        File name of the script (in the utils/ directory)
+    arguments : list of strings
+        Arguments for the script
+    """
+    path = os.path.join(UTILS_DIR, script)
+    if not os.path.isfile(path):
+        logging.warning("Utility %s not found, skipping", path)
+        return
+
+    # pylint: disable=W0703
+    try:
+        rc = ac.execute_local_command([sys.executable, path, *arguments])
+    except Exception:
+        logging.warning("Failed to run %s", path, exc_info=True)
+        return
+
+    if rc != 0:
+        logging.warning("%s failed with return code %d", script, rc)
+
 def main():
     # Setup logging
     logging.basicConfig(level=logging.INFO,
             format="%(asctime)-14s [%(module)s/%(funcName)s] %(levelname)s: %(message)s")
 
-    ac = AgentControl()
-
     # Parse command line arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("--bootstrap-args", metavar="ARGUMENTS", type=str, default="",
@@ -400,20 +1900,44 @@ def main():
             help="Script which prepares the baremetal machine")
     parser.add_argument("--branch",
             help="Commit/tag/branch to checkout")
+    parser.add_argument("--box-cache", metavar="DIR", type=str,
+            help="Persistent store of Vagrant box chunks shared with the nodes, so only changed parts of the boxes are downloaded (supported only by --vagrant)")
+    parser.add_argument("--build-cache", metavar="DIR", type=str,
+            help="Persistent compiler cache (ccache) shared with the nodes (supported only by agent/bootstrap.sh and --vagrant)")
     parser.add_argument("--ci-pr", metavar="PR",
             help="Pull request ID to check out (systemd-centos-ci repository)")
+    parser.add_argument("--fail-fast", metavar="N", type=int, default=0,
+            help="Abort the testsuite after N failed tasks (retried tasks count only once they run out of retries)")
+    parser.add_argument("--generate-index", metavar="ARTIFACTS_DIR", type=str,
+            help="Only generate the artifact HTML page (index.html) for given directory and exit")
     parser.add_argument("--kdump-collect", action="store_const", const=True,
             help="Attempt to collect kernel dumps generated by kdump")
     parser.add_argument("--keep", type=str, choices=["no", "always", "on-fail"], default="no",
             help="Do not release the provisioned node")
     parser.add_argument("--kexec", action="store_const", const=True,
             help="Use kexec to switch to the latest kernel")
+    parser.add_argument("--node-cache", metavar="DIR", type=str,
+            help="Persistent cache of build artifacts (initrd, base test image) shared with the nodes (updated after each run)")
     parser.add_argument("--no-index", action="store_const", const=True,
             help="Don't generate the artifact HTML page")
+    parser.add_argument("--package-bundle", metavar="URL", type=str, nargs="?", const=PACKAGE_BUNDLE_URL,
+            help="Install bootstrap dependencies from a package bundle (URL of the bundle or of a directory with bundles, default: %(const)s; supported only by agent/bootstrap.sh)")
+    parser.add_argument("--package-bundle-sync", action="store_const", const=True,
+            help="Run a script which rebuilds the package bundle with bootstrap dependencies for the allocated pool")
     parser.add_argument("--pr",
             help="Pull request ID to check out (systemd repository)")
-    parser.add_argument("--pool", metavar="POOL_NAME",
-            help="Name of the machine pool to allocate a machine from")
+    parser.add_argument("--pool", metavar="POOL_NAME[,POOL_NAME...]",
+            help="Name of the machine pool to allocate a machine from (or a comma-separated list of acceptable pools in the order of preference)")
+    parser.add_argument("--push-sources", action="store_const", const=True,
+            help="Check out the CI and systemd repositories locally (using a cache of bare mirrors) and push them to the node(s) instead of cloning them there")
+    parser.add_argument("--reap", action="store_const", const=True,
+            help="Retire all sessions from the session journal left behind by jobs that got killed and exit")
+    parser.add_argument("--retire-session", metavar="SESSION_ID", type=int,
+            help=argparse.SUPPRESS)
+    parser.add_argument("--shards", metavar="N", type=int, default=1,
+            help="Split the testsuite across N nodes allocated in a single session (supported only by agent/testsuite.sh)")
+    parser.add_argument("--task-history", metavar="FILE", type=str,
+            help="Persistent store with test durations and failure history used to schedule the testsuite (updated after each run)")
     parser.add_argument("--testsuite-script", metavar="SCRIPT", type=str, default="testsuite.sh",
             help="Script which runs tests on the bootstrapped machine")
     parser.add_argument("--testsuite-args", metavar="ARGUMENTS", type=str, default="",
@@ -427,9 +1951,41 @@ def main():
     args = parser.parse_args()
     logging.info("%s", args)
 
+    if args.generate_index:
+        generate_index(args.generate_index, "index.html")
+        return 0
+
+    if args.retire_session:
+        return retire_journaled_session(args.retire_session)
+
+    if args.reap:
+        return reap_sessions()
+
+    if not args.pool:
+        parser.error("--pool is required")
+
+    ac = AgentControl()
     ac.keep_node = args.keep != "no"
 
+    if args.build_cache and not args.vagrant and args.bootstrap_script != "bootstrap.sh":
+        parser.error("--build-cache is supported only by agent/bootstrap.sh and --vagrant")
+    if args.box_cache and not args.vagrant:
+        parser.error("--box-cache is supported only by --vagrant")
+    if args.fail_fast < 0:
+        parser.error("--fail-fast must not be negative")
+    if args.shards < 1:
+        parser.error("--shards must be a positive number")
+    if args.package_bundle and (args.vagrant or args.bootstrap_script != "bootstrap.sh"):
+        parser.error("--package-bundle is supported only by agent/bootstrap.sh")
+    if args.package_bundle_sync and (args.vagrant or args.vagrant_sync or args.shards > 1):
+        parser.error("--package-bundle-sync can't be used together with --vagrant, --vagrant-sync, or --shards")
+    if args.shards > 1 and (args.vagrant or args.vagrant_sync):
+        parser.error("--shards can't be used together with --vagrant or --vagrant-sync")
+
     artifacts_dir = None
+    staging_dir = None
+    args.sources_archive = None
+    args.sources_with_systemd = False
     rc = 0
 
     # pylint: disable=W0703
@@ -438,12 +1994,6 @@ def main():
         for s in [signal.SIGTERM, signal.SIGHUP, signal.SIGINT, signal.SIGALRM]:
             signal.signal(s, handle_signal)
 
-        ac.allocate_node(args.pool)
-
-        if args.timeout > 0:
-            logging.info("Setting timeout to %d minutes", args.timeout)
-            signal.alarm(args.timeout * 60)
-
         # Figure out a systemd branch to compile
         if args.pr:
             remote_ref = f"pr:{args.pr}"
@@ -452,48 +2002,46 @@ def main():
         else:
             remote_ref = ""
 
-        # Setup artifacts storage
-        artifacts_dir = os.path.relpath(tempfile.mkdtemp(prefix="artifacts_", dir="."))
-        ac.artifacts_storage = artifacts_dir
+        if args.push_sources:
+            # Do this before allocating the node(s), so they don't sit idle in the meantime
+            logging.info("Staging sources for the node(s)")
+            with TRACER.span("Stage sources"):
+                staging_dir = tempfile.mkdtemp(prefix="agent-control-sources-")
+                args.sources_archive, args.sources_with_systemd = stage_sources(args, remote_ref, staging_dir)
 
-        if not "centos-7-" in args.pool:
-            # Note: re-execute the user session, as the package update triggered by cloud-init
-            # might have pulled a newer systemd package with some incompatible changes
-            # for the user sessions.
-            # See: https://pagure.io/centos-infra/issue/865#comment-810347
-            logging.info("Wait until the machine is fully initialized")
-            dnf_wait = "bash -c 'while pgrep -a dnf; do sleep 1; done'"
-            ac.execute_remote_command(f"systemd-run --wait -p Wants=cloud-init.target -p After=cloud-init.target -- {dnf_wait} && systemctl --user daemon-reexec")
+        ac.allocate_node(args.pool.split(","), args.shards)
+        # Use the pool we actually got the node(s) from from now on
+        args.pool = ac.pool
 
-        # Let's differentiate between CentOS <= 7 (yum) and CentOS >= 8 (dnf)
-        pkg_man = "yum" if "centos-7-" in args.pool else "dnf"
-        # Clean dnf/yum caches to drop stale metadata and prevent unexpected
-        # installation fails before installing core dependencies
-        dep_cmd = f"{pkg_man} clean all && {pkg_man} makecache && {pkg_man} -y install bash git rsync"
+        if args.timeout > 0:
+            logging.info("Setting timeout to %d minutes", args.timeout)
+            signal.alarm(args.timeout * 60)
 
-        # Actual testing process
-        logging.info("PHASE 1: Setting up basic dependencies to configure CI repository")
-        command = f"{dep_cmd} && rm -fr {GITHUB_CI_REPO} && git clone {GITHUB_BASE}{GITHUB_CI_REPO}"
-        ac.execute_remote_command(command)
+        # Setup artifacts storage
+        artifacts_dir = os.path.relpath(tempfile.mkdtemp(prefix="artifacts_", dir="."))
+        ac.artifacts_storage = artifacts_dir
 
-        if args.ci_pr:
-            logging.info("PHASE 1.5: Using a custom CI repository ref (PR#%s)", args.ci_pr)
-            command = f"cd {GITHUB_CI_REPO} && git fetch -fu origin 'refs/pull/{args.ci_pr}/merge:pr' && git checkout pr"
-            ac.execute_remote_command(command)
+        if args.shards > 1:
+            run_sharded(ac, args, remote_ref)
+        elif args.vagrant_sync:
+            prepare_node(ac, args)
 
-        if args.vagrant_sync:
             logging.info("PHASE 2: update & rebuild Vagrant images used by systemd CentOS CI")
-            # We need the Duffy SSH key to be able to upload to the CentOS CI artifact server
-            if os.path.isfile("/duffy-ssh-key/ssh-privatekey"):
-                ac.upload_file("/duffy-ssh-key/ssh-privatekey", "/root/.ssh/duffy.key")
-            else:
-                ac.upload_file(os.path.expanduser("~/.ssh/id_rsa"), "/root/.ssh/duffy.key")
-
-            ac.execute_remote_command("chmod 0600 /root/.ssh/duffy.key")
-
-            command = f"{GITHUB_CI_REPO}/vagrant/vagrant-make-cache.sh '{args.vagrant_sync}'"
-            ac.execute_remote_command(command)
+            with TRACER.span("PHASE 2: Vagrant sync", node=ac.node):
+                upload_duffy_key(ac)
+                command = f"{GITHUB_CI_REPO}/vagrant/vagrant-make-cache.sh '{args.vagrant_sync}'"
+                ac.execute_remote_command(command)
+        elif args.package_bundle_sync:
+            prepare_node(ac, args)
+
+            logging.info("PHASE 2: rebuild the package bundle used by systemd CentOS CI")
+            with TRACER.span("PHASE 2: package bundle sync", node=ac.node):
+                upload_duffy_key(ac)
+                command = f"{GITHUB_CI_REPO}/agent/package-bundle-sync.sh -r '{remote_ref}' {args.bootstrap_args}"
+                ac.execute_remote_command(command, artifacts_dir="~/bootstrap-logs*")
         elif args.vagrant:
+            prepare_node(ac, args)
+
             # If the Coveralls token is set, upload it to the node, so it can
             # be consumed by relevant tools
             if ac.coveralls_token:
@@ -504,30 +2052,44 @@ def main():
 
             # Upgrade the hypervisor, so we get the latest QEMU & kernel
             logging.info("PHASE 1.5: Upgrading the hypervisor")
-            # FIXME: drop the custom kernel once RHEL-32384 is resolved
-            kernel_repo = "https://jenkins-systemd.apps.ocp.cloud.ci.centos.org/job/reposync/lastSuccessfulBuild/artifact/repos/mrc0mmand-c9s-kernel-debug-stream9/mrc0mmand-c9s-kernel-debug-stream9.repo"
-            ac.execute_remote_command(f"dnf -y config-manager --add-repo {kernel_repo}")
-            ac.execute_remote_command("dnf -y --refresh upgrade")
-            ac.kexec_to_latest()
+            with TRACER.span("PHASE 1.5: hypervisor upgrade", node=ac.node):
+                # FIXME: drop the custom kernel once RHEL-32384 is resolved
+                kernel_repo = "https://jenkins-systemd.apps.ocp.cloud.ci.centos.org/job/reposync/lastSuccessfulBuild/artifact/repos/mrc0mmand-c9s-kernel-debug-stream9/mrc0mmand-c9s-kernel-debug-stream9.repo"
+                ac.execute_remote_command(f"dnf -y config-manager --add-repo {kernel_repo}")
+                ac.execute_remote_command("dnf -y --refresh upgrade")
+                ac.kexec_to_latest()
 
             # Setup Vagrant and run the tests inside VM
             logging.info("PHASE 2: Run tests in Vagrant VMs")
-            command = f"{GITHUB_CI_REPO}/vagrant/vagrant-ci-wrapper.sh -d '{args.vagrant}' -r '{remote_ref}' {args.bootstrap_args}"
-            ac.execute_remote_command(command, artifacts_dir="~/vagrant-logs*")
+            build_cache = os.path.join(args.build_cache, args.pool, f"vagrant-{args.vagrant}") if args.build_cache else None
+            with TRACER.span("PHASE 2: Vagrant tests", node=ac.node):
+                if args.box_cache and os.path.isdir(args.box_cache):
+                    with TRACER.span("Box cache upload", node=ac.node):
+                        if ac.sync_directory(args.box_cache, REMOTE_BOX_CACHE) != 0:
+                            logging.warning("Failed to upload the box cache from %s", args.box_cache)
+
+                command = f"{GITHUB_CI_REPO}/vagrant/vagrant-ci-wrapper.sh -d '{args.vagrant}' -r '{remote_ref}' {args.bootstrap_args}"
+                if args.sources_with_systemd:
+                    command += " -l"
+                if build_cache:
+                    push_build_cache(ac, build_cache)
+                    command += " -c"
+
+                try:
+                    ac.execute_remote_command(command, artifacts_dir="~/vagrant-logs*", max_failures=args.fail_fast)
+                finally:
+                    if build_cache:
+                        pull_build_cache(ac, build_cache)
+                    # The box is fetched before the tests start, so the store is
+                    # worth keeping even if the tests failed
+                    if args.box_cache:
+                        with TRACER.span("Box cache download", node=ac.node):
+                            if ac.sync_directory(args.box_cache, REMOTE_BOX_CACHE, upload=False) != 0:
+                                logging.warning("Failed to update the box cache in %s", args.box_cache)
         else:
             # Run tests directly on the provisioned machine
-            logging.info("PHASE 2: Bootstrap (ref: %s)", remote_ref)
-            command = f"{GITHUB_CI_REPO}/agent/{args.bootstrap_script} -r '{remote_ref}' {args.bootstrap_args}"
-            ac.execute_remote_command(command, artifacts_dir="~/bootstrap-logs*")
-
-            if args.kexec:
-                ac.kexec_to_latest()
-            else:
-                ac.reboot_node()
-
-            logging.info("PHASE 3: Upstream testsuite")
-            command = f"{GITHUB_CI_REPO}/agent/{args.testsuite_script} {args.testsuite_args}"
-            ac.execute_remote_command(command, artifacts_dir="~/testsuite-logs*")
+            prepare_node(ac, args)
+            run_testsuite(ac, args, remote_ref, args.testsuite_args)
 
     except Exception as e:
         if ac.node and args.kdump_collect:
@@ -536,9 +2098,9 @@ def main():
             time.sleep(10)
 
             try:
-                ac.wait_for_node(ping_attempts=20, ssh_attempts=10)
+                ac.wait_for_node(timeout=600)
 
-                if ac.fetch_artifacts("/var/crash", os.path.join(artifacts_dir, "kdumps")) != 0:
+                if ac.fetch_artifacts("/var/crash/", os.path.join(artifacts_dir, "kdumps")) != 0:
                     logging.warning("Failed to collect kernel dumps from %s", ac.node)
             except Exception:
                 # Fetching the kdumps is a best-effort thing, there's not much
@@ -556,11 +2118,39 @@ def main():
         if rc == 0 and args.keep == "on-fail":
             ac.keep_node = False
 
-        if os.path.isfile("utils/generate-index.sh") and artifacts_dir and not args.no_index:
+        # Retire the session right away (instead of leaving it to the destructor),
+        # so it's part of the trace
+        ac.free_session()
+
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        if artifacts_dir:
+            trace_file = os.path.join(artifacts_dir, "trace.json")
+            logging.info("Saving the execution trace into %s", trace_file)
+            TRACER.write(trace_file)
+        TRACER.log_summary()
+
+        if args.task_history and artifacts_dir:
+            durations = glob.glob(os.path.join(artifacts_dir, "**", ".task_durations"), recursive=True)
+            if durations:
+                logging.info("Updating task history in %s", args.task_history)
+                flaky = [f"--flaky={f}" for f in glob.glob(os.path.join(artifacts_dir, "**", ".flaky_tasks"), recursive=True)]
+                run_utility(ac, "task-history.py", ["update", *flaky, args.task_history, *durations])
+
+            # Correlate the test failures with the tested changes (see utils/test-impact.py)
+            logdirs = [os.path.dirname(f) for f in glob.glob(os.path.join(artifacts_dir, "**", ".changed_files"), recursive=True)]
+            if logdirs:
+                run_utility(ac, "test-impact.py", ["record", args.task_history, *logdirs])
+
+        if artifacts_dir and not args.no_index:
             # Try to generate a simple HTML index with results
             logging.info("Attempting to create an HTML index page")
-            command = ["utils/generate-index.sh", artifacts_dir, "index.html"]
-            ac.execute_local_command(command)
+            # pylint: disable=W0703
+            try:
+                generate_index(artifacts_dir, "index.html")
+            except Exception:
+                logging.warning("Failed to generate the HTML index page", exc_info=True)
 
     return rc
 
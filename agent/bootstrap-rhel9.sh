@@ -390,6 +390,10 @@ GRUBBY_ARGS=(
     "systemd.clock_usec=$(($(date +%s%N) / 1000 + 1))"
     # Reboot the machine on kernel panic
     "panic=3"
+    # Enable pressure stall information (disabled by default on RHEL kernels),
+    # which is used by common/task-control.sh to decide how many tasks to run
+    # in parallel
+    "psi=1"
 )
 # For some reason the C9S AMIs have BLS in grub switched off. If that's the case
 # let's re-enable it before tweaking the grub configuration further.
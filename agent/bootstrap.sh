@@ -10,6 +10,18 @@ LIB_ROOT="$(dirname "$0")/../common"
 export BUILD_DIR="${BUILD_DIR:-/systemd-meson-build}"
 REPO_URL="${REPO_URL:-https://github.com/systemd/systemd.git}"
 REMOTE_REF=""
+# Use the systemd checkout in ./systemd instead of cloning $REPO_URL
+# (see --push-sources in agent-control.py)
+LOCAL_SOURCES=0
+# Cache compiled objects in $CCACHE_DIR (see --build-cache in agent-control.py)
+USE_CCACHE=0
+CCACHE_DIR="${CCACHE_DIR:-/var/cache/systemd-centos-ci/ccache}"
+# Install dependencies from a package bundle (see package_bundle_restore() in
+# common/utils.sh and --package-bundle in agent-control.py)
+PACKAGE_BUNDLE_URL=""
+# Create a package bundle with all installed dependencies in this directory
+# (see agent/package-bundle-sync.sh)
+PACKAGE_BUNDLE_OUTPUT=""
 
 # EXIT signal handler
 at_exit() {
@@ -25,19 +37,31 @@ set -o pipefail
 trap at_exit EXIT
 
 # Parse optional script arguments
-while getopts "r:s:" opt; do
+while getopts "clP:r:s:S:" opt; do
     case "$opt" in
+        c)
+            USE_CCACHE=1
+            ;;
+        l)
+            LOCAL_SOURCES=1
+            ;;
+        P)
+            PACKAGE_BUNDLE_OUTPUT="$OPTARG"
+            ;;
         r)
             REMOTE_REF="$OPTARG"
             ;;
         s)
             REPO_URL="$OPTARG"
             ;;
+        S)
+            PACKAGE_BUNDLE_URL="$OPTARG"
+            ;;
         ?)
             exit 1
             ;;
         *)
-            echo "Usage: $0 [-r REMOTE_REF] [-s SOURCE_REPO_URL]"
+            echo "Usage: $0 [-c] [-l] [-P BUNDLE_OUTPUT_DIR] [-r REMOTE_REF] [-s SOURCE_REPO_URL] [-S BUNDLE_URL]"
             exit 1
     esac
 done
@@ -126,30 +150,67 @@ if [[ "$(uname -m)" != ppc64le ]]; then
     ADDITIONAL_DEPS+=(qemu-kvm swtpm)
 fi
 
-cmd_retry dnf -y install epel-release epel-next-release dnf-plugins-core gdb
+if [[ $USE_CCACHE -ne 0 ]]; then
+    ADDITIONAL_DEPS+=(ccache) # EPEL
+fi
+
+DNF_OPTS=()
+if [[ -n "$PACKAGE_BUNDLE_OUTPUT" ]]; then
+    # Keep all downloaded packages, so we can put them into the bundle
+    DNF_OPTS+=(--setopt=keepcache=1)
+fi
+
+PACKAGE_BUNDLE_RESTORED=0
+if [[ -n "$PACKAGE_BUNDLE_URL" ]]; then
+    if package_bundle_restore "$PACKAGE_BUNDLE_URL"; then
+        PACKAGE_BUNDLE_RESTORED=1
+    else
+        echo >&2 "Failed to restore the package bundle, falling back to the regular installation"
+    fi
+fi
+
+# Note: if the package bundle was restored, the following installation steps are
+#       mostly no-ops, except for dependencies added since the bundle was created
+cmd_retry dnf -y ${DNF_OPTS[@]+"${DNF_OPTS[@]}"} install epel-release epel-next-release dnf-plugins-core gdb
 cmd_retry dnf -y config-manager --enable epel --enable epel-next --enable crb
 # Local mirror of https://copr.fedorainfracloud.org/coprs/mrc0mmand/systemd-centos-ci-centos9/
 cmd_retry dnf -y config-manager --add-repo "https://jenkins-systemd.apps.ocp.cloud.ci.centos.org/job/reposync/lastSuccessfulBuild/artifact/repos/mrc0mmand-systemd-centos-ci-centos9-stream9/mrc0mmand-systemd-centos-ci-centos9-stream9.repo"
-cmd_retry dnf -y update
+# Stick with the package versions from the bundle, if it was restored
+if [[ $PACKAGE_BUNDLE_RESTORED -eq 0 ]]; then
+    cmd_retry dnf -y ${DNF_OPTS[@]+"${DNF_OPTS[@]}"} update
+fi
 # FIXME: temporarily skip the crb-source repo, since it currently has borked signatures
 #        (and we don't need it in this particular case)
 dnf config-manager --save --setopt crb-source.skip_if_unavailable=1
 # --skip-unavailable is necessary for archs without gnu-efi (like ppc64le)
-cmd_retry dnf -y --skip-unavailable builddep systemd
-cmd_retry dnf -y install "${ADDITIONAL_DEPS[@]}"
+cmd_retry dnf -y ${DNF_OPTS[@]+"${DNF_OPTS[@]}"} --skip-unavailable builddep systemd
+cmd_retry dnf -y ${DNF_OPTS[@]+"${DNF_OPTS[@]}"} install "${ADDITIONAL_DEPS[@]}"
+
 # Remove setroubleshoot-server if it's installed, since we don't use it anyway
 # and it's causing some weird performance issues
 if rpm -q setroubleshoot-server; then
     dnf -y remove setroubleshoot-server
 fi
 
-# Fetch the upstream systemd repo
-test -e systemd && rm -rf systemd
-echo "Cloning repo: $REPO_URL"
-git clone "$REPO_URL" systemd
-pushd systemd || { echo >&2 "Can't pushd to systemd"; exit 1; }
+if [[ -n "$PACKAGE_BUNDLE_OUTPUT" ]]; then
+    cmd_retry dnf -y "${DNF_OPTS[@]}" install createrepo_c
+    package_bundle_create "$PACKAGE_BUNDLE_OUTPUT"
+fi
 
-git_checkout_pr "$REMOTE_REF"
+if [[ $LOCAL_SOURCES -ne 0 ]]; then
+    # The repo is already checked out at the requested ref
+    echo "Using local repo: $PWD/systemd"
+    pushd systemd || { echo >&2 "Can't pushd to systemd"; exit 1; }
+    git log -1
+else
+    # Fetch the upstream systemd repo
+    test -e systemd && rm -rf systemd
+    echo "Cloning repo: $REPO_URL"
+    git clone "$REPO_URL" systemd
+    pushd systemd || { echo >&2 "Can't pushd to systemd"; exit 1; }
+
+    git_checkout_pr "$REMOTE_REF"
+fi
 
 # It's impossible to keep the local SELinux policy database up-to-date with
 # arbitrary pull request branches we're testing against.
@@ -175,6 +236,11 @@ if ! coredumpctl_init; then
     exit 1
 fi
 
+if [[ $USE_CCACHE -ne 0 ]] && ! ccache_setup "$CCACHE_DIR"; then
+    echo >&2 "Failed to set up ccache, continuing without it"
+    USE_CCACHE=0
+fi
+
 # Compile systemd
 #   - slow-tests=true: enables slow tests
 #   - fuzz-tests=true: enables fuzzy tests using libasan installed above
@@ -205,6 +271,10 @@ fi
     ninja -C "$BUILD_DIR"
 ) 2>&1 | tee "$LOGDIR/build.log"
 
+if [[ $USE_CCACHE -ne 0 ]]; then
+    ccache --show-stats | tee "$LOGDIR/ccache-stats.log"
+fi
+
 # shellcheck disable=SC2119
 coredumpctl_set_ts
 
@@ -301,6 +371,10 @@ GRUBBY_ARGS=(
     "systemd.clock_usec=$(($(date +%s%N) / 1000 + 1))"
     # Reboot the machine on kernel panic
     "panic=3"
+    # Enable pressure stall information (disabled by default on RHEL kernels),
+    # which is used by common/task-control.sh to decide how many tasks to run
+    # in parallel
+    "psi=1"
 )
 # Make sure the latest kernel is the one we're going to boot into
 grubby --set-default "/boot/vmlinuz-$LATEST_KERNEL"
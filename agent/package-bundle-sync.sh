@@ -0,0 +1,42 @@
+#!/bin/bash
+# Script which bootstraps the node the usual way (see agent/bootstrap.sh) and
+# creates a bundle of all installed build/test dependencies. The bundle is then
+# stored on the CentOS CI artifact server, so other CI jobs can install all
+# dependencies from it in one go instead of resolving and fetching hundreds of
+# packages from the mirrors (see the -S option of agent/bootstrap.sh).
+# This script is intended to run in CentOS CI Jenkins periodically, to keep
+# the bundles up-to-date.
+#
+# The bundle is uploaded with a '-new' suffix, so it can be tested before it
+# gets promoted to "production" (see jenkins/runners/package-bundle-make-cache.sh).
+#
+# All arguments are passed to agent/bootstrap.sh.
+
+set -eux
+set -o pipefail
+
+DUFFY_SSH_KEY="/root/.ssh/duffy.key"
+AGENT_ROOT="$(dirname "$(readlink -f "$0")")"
+BUNDLE_DIR="$PWD/package_bundles"
+
+if [[ ! -e "$DUFFY_SSH_KEY" ]]; then
+    echo >&2 "Missing Duffy SSH key, can't continue"
+    exit 1
+fi
+
+# shellcheck source=common/utils.sh
+. "$AGENT_ROOT/../common/utils.sh" || exit 1
+
+BUNDLE_NAME="$(package_bundle_name)"
+
+# Do a full bootstrap (including the build & the sanity boot check), so we know
+# the bundled dependencies are actually usable
+"$AGENT_ROOT/bootstrap.sh" -P "$BUNDLE_DIR" "$@"
+
+# Upload the bundle to the CentOS CI artifact storage
+mv "$BUNDLE_DIR/$BUNDLE_NAME" "$BUNDLE_DIR/${BUNDLE_NAME%.tar}-new.tar"
+RSYNC_SSH="ssh -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no -i $DUFFY_SSH_KEY"
+# Crucial line, otherwise we won't be able to access the web directory listing
+chmod -R o+rx "$BUNDLE_DIR"
+rsync -e "$RSYNC_SSH" -av "$BUNDLE_DIR" systemd@artifacts.ci.centos.org:/srv/artifacts/systemd/
+echo "Bundle URL: https://artifacts.ci.centos.org/systemd/package_bundles/${BUNDLE_NAME%.tar}-new.tar"
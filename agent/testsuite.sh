@@ -6,13 +6,27 @@ LIB_ROOT="$(dirname "$0")/../common"
 . "$LIB_ROOT/task-control.sh" "testsuite-logs-$(uname -m)" || exit 1
 # shellcheck source=common/utils.sh
 . "$LIB_ROOT/utils.sh" || exit 1
+# Resolve the path now, since we change the working directory later on
+UTILS_ROOT="$(readlink -f "$(dirname "$0")/../utils")"
 
 export BUILD_DIR="${BUILD_DIR:-/systemd-meson-build}"
+# Persistent store with durations of previous test runs (see utils/task-history.py)
+TASK_HISTORY_FILE="${TASK_HISTORY_FILE:-/var/cache/systemd-centos-ci/task-history.json}"
+# Run only a part of the testsuite (see the -k option below)
+SHARD_INDEX=1
+SHARD_COUNT=1
+# Skip integration tests unrelated to the tested changes (see the -i option below)
+SKIP_UNRELATED=0
 
 # EXIT signal handler
 at_exit() {
     set +e
     exectask "journalctl-testsuite" "journalctl -b -o short-monotonic --no-hostname --no-pager"
+
+    if [[ -v TELEMETRY_PID ]]; then
+        kill "$TELEMETRY_PID" && wait "$TELEMETRY_PID"
+        "$UTILS_ROOT/node-telemetry.py" report "$LOGDIR"
+    fi
 }
 
 set -eu
@@ -20,8 +34,26 @@ set -o pipefail
 
 trap at_exit EXIT
 
-while getopts "ns" opt; do
+# Record resource usage of the node during the testsuite, so it can be correlated
+# with the task timeline (see utils/node-telemetry.py)
+"$UTILS_ROOT/node-telemetry.py" sample "$LOGDIR/telemetry.csv" &>/dev/null &
+TELEMETRY_PID=$!
+
+while getopts "ik:ns" opt; do
     case "$opt" in
+        i)
+            echo "[NOTICE] Skipping integration tests unrelated to the tested changes"
+            SKIP_UNRELATED=1
+            ;;
+        k)
+            if [[ ! "$OPTARG" =~ ^([0-9]+)/([0-9]+)$ ]] || [[ ${BASH_REMATCH[1]} -lt 1 || ${BASH_REMATCH[1]} -gt ${BASH_REMATCH[2]} ]]; then
+                echo >&2 "Invalid shard specification '$OPTARG' (expected INDEX/COUNT)"
+                exit 1
+            fi
+            SHARD_INDEX="${BASH_REMATCH[1]}"
+            SHARD_COUNT="${BASH_REMATCH[2]}"
+            echo "[NOTICE] Running only shard $SHARD_INDEX/$SHARD_COUNT of the testsuite"
+            ;;
         n)
             echo "[NOTICE] Running only nspawn-based tests"
             export TEST_NO_QEMU=1
@@ -33,7 +65,7 @@ while getopts "ns" opt; do
             exit 1
             ;;
         *)
-            echo "Usage: $0 [-n] [-s]"
+            echo "Usage: $0 [-i] [-k INDEX/COUNT] [-n] [-s]"
             exit 1
     esac
 done
@@ -59,15 +91,23 @@ set +e
 pushd systemd || { echo >&2 "Can't pushd to systemd"; exit 1; }
 
 # Run the internal unit tests (make check)
-exectask "ninja-test" "meson test -C $BUILD_DIR --print-errorlogs --timeout-multiplier=3"
-# Copy over meson test artifacts
-[[ -d "$BUILD_DIR/meson-logs" ]] && rsync -amq --include '*.txt' --include '*/' --exclude '*' "$BUILD_DIR/meson-logs" "$LOGDIR"
+# When sharding, run them only as part of the first shard
+if [[ $SHARD_INDEX -eq 1 ]]; then
+    exectask "ninja-test" "meson test -C $BUILD_DIR --print-errorlogs --timeout-multiplier=3"
+    # Copy over meson test artifacts
+    [[ -d "$BUILD_DIR/meson-logs" ]] && rsync -amq --include '*.txt' --include '*/' --exclude '*' "$BUILD_DIR/meson-logs" "$LOGDIR"
+fi
+
+# Save the list of files changed by the tested branch (empty when testing the
+# main branch itself), which is used to prioritize the integration tests below
+# (and by agent-control.py to update the test impact history)
+MAIN_BRANCH="$(git rev-parse --abbrev-ref origin/HEAD)"
+git diff --name-only "$(git merge-base "$MAIN_BRANCH" HEAD)" >"$LOGDIR/.changed_files"
 
 if [[ "${SKIP_MAN_CHECK:-0}" -eq 0 ]]; then
     # If we're not testing the main branch (the first diff) check if the tested
     # branch doesn't contain only man-related changes. If so, skip the integration
     # tests
-    MAIN_BRANCH="$(git rev-parse --abbrev-ref origin/HEAD)"
     if ! git diff --quiet "$MAIN_BRANCH" HEAD && ! git diff "$(git merge-base "$MAIN_BRANCH" HEAD)" --name-only | grep -vE "^man/" >/dev/null; then
         echo "Detected man-only PR, skipping integration tests"
         finish_and_exit
@@ -98,29 +138,52 @@ SKIP_LIST=(
 export INITRD="/var/tmp/ci-initramfs-$(uname -r).img"
 DRACUT_OPTS=()
 [[ -x /usr/lib/systemd/systemd-executor ]] && DRACUT_OPTS+=(--install /usr/lib/systemd/systemd-executor)
-# Copy over the original initrd, as we want to keep the custom installed
-# files we installed during the bootstrap phase (i.e. we want to keep the
-# command line arguments the original initrd was built with)
-cp -fv "/boot/initramfs-$(uname -r).img" "$INITRD"
-# Rebuild the original initrd with the dm-crypt modules and without the multipath module
-dracut "${DRACUT_OPTS[@]}" -a crypt -o "multipath rngd nfs" --filesystems ext4 --rebuild "$INITRD"
+DRACUT_OPTS+=(-a crypt -o "multipath rngd nfs" --filesystems ext4)
+# The rebuilt initrd depends only on the original initrd (which already contains
+# the systemd build installed during the bootstrap phase), dracut options, and
+# the kernel, so we can reuse it from previous runs if none of these changed
+INITRD_CACHE_KEY="$(ci_cache_key "$(uname -r)" "$(dracut --version)" "${DRACUT_OPTS[*]}" "$(sha256sum <"/boot/initramfs-$(uname -r).img")")"
+if ! ci_cache_get initrd "$INITRD_CACHE_KEY" "$INITRD"; then
+    # Copy over the original initrd, as we want to keep the custom installed
+    # files we installed during the bootstrap phase (i.e. we want to keep the
+    # command line arguments the original initrd was built with)
+    cp -fv "/boot/initramfs-$(uname -r).img" "$INITRD"
+    # Rebuild the original initrd with the dm-crypt modules and without the multipath module
+    dracut "${DRACUT_OPTS[@]}" --rebuild "$INITRD" && ci_cache_put initrd "$INITRD_CACHE_KEY" "$INITRD"
+fi
 # Don't strip systemd binaries installed into test images, so we can get nice
 # stack traces when something crashes
 export STRIP_BINARIES=no
 
 # Initialize the 'base' image (default.img) on which the other images are based
-exectask "setup-the-base-image" "make -C test/TEST-01-BASIC clean setup TESTDIR=/var/tmp/systemd-test-TEST-01-BASIC"
+#
+# The image contains the systemd build and the test data, so use both the source
+# tree and the built binaries as the cache key (together with the initrd key, as
+# the image depends on the kernel as well)
+BASE_IMAGE="$BUILD_DIR/test/default.img"
+BASE_IMAGE_CACHE_KEY="$(ci_cache_key "$INITRD_CACHE_KEY" "$STRIP_BINARIES" \
+                                     "$(git rev-parse "HEAD^{tree}")" "$(git status --porcelain=v1 | sha256sum)" \
+                                     "$(find "$BUILD_DIR" -maxdepth 3 -type f \( -name systemd -o -name "libsystemd-shared-*.so" \) -exec sha256sum {} + | sort)")"
+if ci_cache_get base-image "$BASE_IMAGE_CACHE_KEY" "$BASE_IMAGE"; then
+    # Keep the task around, so the task list is the same with and without cache
+    exectask "setup-the-base-image" "echo 'Reusing cached base image $BASE_IMAGE ($BASE_IMAGE_CACHE_KEY)'"
+elif exectask "setup-the-base-image" "make -C test/TEST-01-BASIC clean setup TESTDIR=/var/tmp/systemd-test-TEST-01-BASIC"; then
+    [[ -f "$BASE_IMAGE" ]] && ci_cache_put base-image "$BASE_IMAGE_CACHE_KEY" "$BASE_IMAGE"
+fi
 
 ## Other integration tests ##
 # Enqueue the "other" tests first. The networkd testsuite has quite a long
 # runtime without requiring too much resources, hence it can run in parallel
 # with the "standard" integration tests, saving ~30 minutes ATTOW (this excludes
 # dusty nodes, where any kind of parallelism leads to unstable tests)
-TEST_LIST=(
-    "test/test-network/systemd-networkd-tests.py"
-)
+TEST_LIST=()
+# When sharding, run the "other" tests as part of the last shard, since the
+# first one already runs the unit tests
+if [[ $SHARD_INDEX -eq $SHARD_COUNT ]]; then
+    TEST_LIST+=("test/test-network/systemd-networkd-tests.py")
+fi
 
-for t in "${TEST_LIST[@]}"; do
+for t in ${TEST_LIST[@]+"${TEST_LIST[@]}"}; do
     exectask_p "${t##*/}" "/bin/time -v -- timeout -k 60s 60m ./$t"
 done
 
@@ -141,8 +204,28 @@ readarray -t INTEGRATION_TESTS < <(
     [[ -d test/TEST-64-UDEV-STORAGE ]] && echo test/TEST-64-UDEV-STORAGE
     find test/ -maxdepth 1 -type d -name "TEST-??-*" ! -name "TEST-64-UDEV-STORAGE" | sort
 )
+# If we have durations from previous runs, use them to order the tests from
+# the longest one to the shortest one. Tests we haven't seen yet stay at the
+# front in the original order
+if ORDERED_TESTS="$("$UTILS_ROOT/task-history.py" order "$TASK_HISTORY_FILE" "${INTEGRATION_TESTS[@]}")"; then
+    readarray -t INTEGRATION_TESTS <<<"$ORDERED_TESTS"
+fi
+# Move the tests likely affected by the tested changes to the front of the queue
+# (and drop the unrelated ones with -i), see utils/test-impact.py. The order of
+# the tests with the same score is preserved
+IMPACT_ARGS=(--report "$LOGDIR/test-impact.txt")
+[[ $SKIP_UNRELATED -ne 0 ]] && IMPACT_ARGS+=(--skip-unrelated)
+if ORDERED_TESTS="$("$UTILS_ROOT/test-impact.py" order "${IMPACT_ARGS[@]}" "$TASK_HISTORY_FILE" "$LOGDIR/.changed_files" "${INTEGRATION_TESTS[@]}")"; then
+    # All tests might've been skipped
+    readarray -t INTEGRATION_TESTS < <([[ -n "$ORDERED_TESTS" ]] && echo "$ORDERED_TESTS")
+    cat "$LOGDIR/test-impact.txt"
+fi
+# Distribute the tests among shards in a round-robin fashion, so each shard
+# gets a fair share of the expensive tests from the front of the list
+readarray -t INTEGRATION_TESTS < <(shard_filter "$SHARD_INDEX" "$SHARD_COUNT" ${INTEGRATION_TESTS[@]+"${INTEGRATION_TESTS[@]}"})
+readarray -t FLAKE_LIST < <(shard_filter "$SHARD_INDEX" "$SHARD_COUNT" "${FLAKE_LIST[@]}")
 
-for t in "${INTEGRATION_TESTS[@]}"; do
+for t in ${INTEGRATION_TESTS[@]+"${INTEGRATION_TESTS[@]}"}; do
     if [[ ${#SKIP_LIST[@]} -ne 0 ]] && in_set "$t" "${SKIP_LIST[@]}"; then
         echo -e "[SKIP] Skipping test $t\n"
         continue
@@ -158,12 +241,16 @@ for t in "${INTEGRATION_TESTS[@]}"; do
     # OPTIMAL_QEMU_SMP is part of the common/task-control.sh file
     export QEMU_SMP=$OPTIMAL_QEMU_SMP
 
-    # FIXME: retry each task again if it fails (i.e. run each task twice at most)
-    #        to work around intermittent QEMU soft lockups/ACPI timer errors
+    # FIXME: retry each task again if it fails with a known flaky signature (i.e.
+    #        run each task twice at most) to work around intermittent QEMU soft
+    #        lockups/ACPI timer errors (see common/flaky-signatures.txt)
     #
     # Suffix the $TESTDIR of each retry with an index to tell them apart
     export MANGLE_TESTDIR=1
-    exectask_retry_p "${t##*/}" "/bin/time -v -- make -C $t setup run && touch \$TESTDIR/pass; rm -fv \$TESTDIR/*.img; test -e \$TESTDIR/pass"
+    # Collect coredumps from the test journals as soon as the test finishes
+    # (see crash_harvest_hook() in common/utils.sh)
+    TASK_EXIT_HOOK=crash_harvest_hook \
+        exectask_retry_p "${t##*/}" "/bin/time -v -- make -C $t setup run && touch \$TESTDIR/pass; rm -fv \$TESTDIR/*.img; test -e \$TESTDIR/pass"
     # Retried tasks are suffixed with an index, so update the $CHECK_LIST
     # array with all possible task names correctly find the respective journals
     # shellcheck disable=SC2207
@@ -173,7 +260,7 @@ done
 # Wait for remaining running tasks
 exectask_p_finish
 
-for t in "${FLAKE_LIST[@]}"; do
+for t in ${FLAKE_LIST[@]+"${FLAKE_LIST[@]}"}; do
     # For older stable branches
     if [[ ! -d "$t" ]]; then
         echo "Test '$t' is not available, skipping..."
@@ -189,7 +276,8 @@ for t in "${FLAKE_LIST[@]}"; do
 
     # Suffix the $TESTDIR of each retry with an index to tell them apart
     export MANGLE_TESTDIR=1
-    exectask_retry "${t##*/}" "/bin/time -v -- make -C $t setup run && touch \$TESTDIR/pass; rm -fv \$TESTDIR/*.img; test -e \$TESTDIR/pass"
+    TASK_EXIT_HOOK=crash_harvest_hook \
+        exectask_retry "${t##*/}" "/bin/time -v -- make -C $t setup run && touch \$TESTDIR/pass; rm -fv \$TESTDIR/*.img; test -e \$TESTDIR/pass"
 
     # Retried tasks are suffixed with an index, so update the $CHECK_LIST
     # array accordingly to correctly find the respective journals
@@ -198,19 +286,12 @@ for t in "${FLAKE_LIST[@]}"; do
     done
 done
 
-for t in "${CHECK_LIST[@]}"; do
+for t in ${CHECK_LIST[@]+"${CHECK_LIST[@]}"}; do
     testdir="/var/tmp/systemd-test-${t##*/}"
     if [[ -f "$testdir/system.journal" ]]; then
-        # Filter out test-specific coredumps which are usually intentional
-        # Note: $COREDUMPCTL_EXCLUDE_MAP resides in common/utils.sh
-        # Note2: strip the "_X" suffix added by exectask_retry*()
-        if [[ -v "COREDUMPCTL_EXCLUDE_MAP[${t%_[0-9]}]" ]]; then
-            export COREDUMPCTL_EXCLUDE_RX="${COREDUMPCTL_EXCLUDE_MAP[${t%_[0-9]}]}"
-        fi
-        # Attempt to collect coredumps from test-specific journals as well
-        exectask "${t##*/}_coredumpctl_collect" "coredumpctl_collect '$testdir/'"
-        # Make sure to not propagate the custom coredumpctl filter override
-        [[ -v COREDUMPCTL_EXCLUDE_RX ]] && unset -v COREDUMPCTL_EXCLUDE_RX
+        # Most of the journals were already processed by the exit hook, this
+        # picks up only those which were missed or changed since then
+        crash_harvest "${t##*/}" "$testdir"
 
         # Keep the journal files only if the associated test case failed
         if [[ ! -f "$testdir/pass" ]]; then
@@ -224,6 +305,14 @@ done
 
 # Collect coredumps using the coredumpctl utility, if any
 exectask "coredumpctl_collect" "coredumpctl_collect"
+# Write a consolidated report of all crashes found in the test journals
+crash_report_write "$LOGDIR/crash-report.json"
+
+# Record durations of all tasks, so we can use them to schedule the next run
+# (the .task_durations file is also consumed by agent-control.py)
+if "$UTILS_ROOT/task-history.py" durations "$LOGDIR" >"$LOGDIR/.task_durations"; then
+    "$UTILS_ROOT/task-history.py" update --flaky "$LOGDIR/.flaky_tasks" "$TASK_HISTORY_FILE" "$LOGDIR/.task_durations"
+fi
 
 # Summary
 show_task_summary
@@ -20,13 +20,37 @@ declare -r LOGDIR
 # we use subprocesses which can't modify variables in the parent process
 declare -r PASSED_TASKS_STATE="$LOGDIR/.passed_tasks"
 declare -r FAILED_TASKS_STATE="$LOGDIR/.failed_tasks"
+# All [RESULT] lines (including the ignored ones), used by the artifacts indexer
+# (see generate_index() in agent-control.py)
+declare -r TASK_RESULTS_STATE="$LOGDIR/.task_results"
 # Initialize the state files
 : >"$PASSED_TASKS_STATE"
 : >"$FAILED_TASKS_STATE"
+: >"$TASK_RESULTS_STATE"
 # Variables for parallel tasks
 declare -A TASK_QUEUE=()
+# Max time (in seconds) to block waiting for a running task to free a slot
+# before checking the queue again (see _task_queue_wait_for_slot())
+TASK_QUEUE_POLL_INTERVAL=${TASK_QUEUE_POLL_INTERVAL:-1}
 # Default number of retries for exectask_retry()
 declare -ri TASK_RETRY_DEFAULT=2
+# Signatures of known flaky failures, failed tasks are retried only if their log
+# matches one of them (if the file is missing, failed tasks are not retried at all).
+# Resolve the path now, since the callers may change the working directory later
+TASK_FLAKY_SIGNATURES="${TASK_FLAKY_SIGNATURES:-$(readlink -f "$(dirname "${BASH_SOURCE[0]}")")/flaky-signatures.txt}"
+if [[ ! -r "$TASK_FLAKY_SIGNATURES" ]]; then
+    echo >&2 "[TASK-CONTROL] Can't read flaky signatures from '$TASK_FLAKY_SIGNATURES', failed tasks won't be retried"
+fi
+# Tasks retried because of a matching signature ("task<TAB>signature" lines),
+# used to keep per-task flake statistics (see utils/task-history.py)
+declare -r FLAKY_TASKS_STATE="$LOGDIR/.flaky_tasks"
+: >"$FLAKY_TASKS_STATE"
+# Optional function/command called once a task (or each try of a retried task)
+# finishes, with the task name (suffixed with the try index for retried tasks)
+# and its EC as arguments. The hook runs in the same process as the task itself,
+# i.e. in the background for parallel tasks, so it doesn't block the task queue
+# (see crash_harvest_hook() in common/utils.sh)
+TASK_EXIT_HOOK="${TASK_EXIT_HOOK:-}"
 # Try to determine the optimal values for parallel execution using the nproc
 # utility. If that fails, fall back to using default values for necessary
 # variables.
@@ -50,31 +74,86 @@ else
     OPTIMAL_QEMU_SMP=${OPTIMAL_QEMU_SMP:-1}
 fi
 
+# Adaptive admission control
+#
+# If the kernel provides pressure stall information (PSI), check the CPU, I/O,
+# and memory pressure (together with the load average) before starting each
+# parallel task and hold the task back if the system is already under pressure.
+# With this in place we can also let the number of parallel tasks grow over
+# the static cap above (up to $TASK_QUEUE_CEILING) on big machines, since the
+# extra slots are used only if the system can handle them.
+#
+# All decisions are logged into $TASK_ADMISSION_LOG, so the thresholds can be
+# tuned. Each threshold can be overridden from the outside, same as the
+# admission control itself can be disabled by setting TASK_ADMISSION=0.
+#
+# Note: RHEL kernels have PSI disabled by default, it needs to be enabled using
+#       the psi=1 kernel command line option.
+if [[ -r /proc/pressure/cpu && -r /proc/pressure/io && -r /proc/pressure/memory ]]; then
+    TASK_ADMISSION=${TASK_ADMISSION:-1}
+else
+    TASK_ADMISSION=0
+fi
+# Thresholds for the "some" avg10 PSI values (in %)
+TASK_PSI_CPU_MAX=${TASK_PSI_CPU_MAX:-50}
+TASK_PSI_IO_MAX=${TASK_PSI_IO_MAX:-20}
+TASK_PSI_MEMORY_MAX=${TASK_PSI_MEMORY_MAX:-10}
+# Threshold for the 1-minute load average
+TASK_LOAD_MAX=${TASK_LOAD_MAX:-${NPROC:-$MAX_QUEUE_SIZE}}
+# How long to hold a task back before re-checking the pressure (in seconds).
+# This is also the minimal delay between starting tasks in slots over the
+# static cap, so the pressure caused by the previous task can show up in the
+# (10 second) PSI averages.
+TASK_ADMISSION_INTERVAL=${TASK_ADMISSION_INTERVAL:-10}
+declare -r TASK_ADMISSION_LOG="$LOGDIR/task-admission.log"
+# Number of slots we fill without any delay (i.e. the static cap from above)
+TASK_QUEUE_BASE=$MAX_QUEUE_SIZE
+_TASK_LAST_ADMISSION=0
+
+if [[ $TASK_ADMISSION -ne 0 ]]; then
+    TASK_QUEUE_CEILING=${TASK_QUEUE_CEILING:-8}
+    # Allow up to one task per two CPUs (which is the default QEMU_SMP value),
+    # but keep QEMU_SMP as is, since the extra slots are used only if there
+    # are enough free resources
+    if [[ -n "${NPROC:-}" && $((NPROC / 2)) -gt $MAX_QUEUE_SIZE ]]; then
+        MAX_QUEUE_SIZE=$((NPROC / 2))
+        if [[ $MAX_QUEUE_SIZE -gt $TASK_QUEUE_CEILING ]]; then
+            MAX_QUEUE_SIZE=$TASK_QUEUE_CEILING
+        fi
+    fi
+fi
+
 echo "[TASK-CONTROL] OPTIMAL_QEMU_SMP = $OPTIMAL_QEMU_SMP"
 echo "[TASK-CONTROL] MAX_QUEUE_SIZE = $MAX_QUEUE_SIZE"
+echo "[TASK-CONTROL] TASK_ADMISSION = $TASK_ADMISSION"
 
-# Active wait for PID to finish
+# Wait for PID to finish
 #   - print '.' every 10 seconds
 #   - return the exit code of the waited for process
 # Arguments
 #   - PID (must be a child of current shell)
 waitforpid() {
     local pid="${1:?Missing PID}"
-    local counter=0
+    local ticker=""
     local ec
     SECONDS=0
 
     _echo "Waiting for PID $pid to finish"
-    while kill -0 "$pid" 2>/dev/null; do
-        if ((counter++ % 100 == 0)); then
-            _echo -n "."
-        fi
-        sleep .1
-    done
+    # Block in wait instead of polling the PID and let a separate process
+    # take care of the progress "bar"
+    if [[ "${TASK_LOG_LEVEL:-1}" -ne 0 ]]; then
+        (while echo -n "." && sleep 10; do :; done) &
+        ticker=$!
+    fi
 
     wait "$pid"
     ec=$?
 
+    if [[ -n "$ticker" ]]; then
+        kill "$ticker" 2>/dev/null
+        wait "$ticker" 2>/dev/null
+    fi
+
     _echo
     _echo "PID $pid finished with EC $ec in ${SECONDS}s"
 
@@ -120,17 +199,32 @@ printresult() {
     if [[ $ignore_ec -eq 0 ]]; then
         if [[ $task_ec -eq 0 ]]; then
             echo "$task_name" >>"$PASSED_TASKS_STATE"
-            echo "[RESULT] $task_name - PASS (log file: $task_logfile)"
+            echo "[RESULT] $task_name - PASS (log file: $task_logfile)" | tee -a "$TASK_RESULTS_STATE"
         else
             cat "$task_logfile"
             echo "$task_name" >>"$FAILED_TASKS_STATE"
-            echo "[RESULT] $task_name - FAIL (EC: $task_ec) (log file: $task_logfile)"
+            echo "[RESULT] $task_name - FAIL (EC: $task_ec) (log file: $task_logfile)" | tee -a "$TASK_RESULTS_STATE"
         fi
     else
-        echo "[IGNORED RESULT] $task_name - EC: $task_ec (log file: $task_logfile)"
+        echo "[IGNORED RESULT] $task_name - EC: $task_ec (log file: $task_logfile)" | tee -a "$TASK_RESULTS_STATE"
     fi
 }
 
+# Call the $TASK_EXIT_HOOK (if set) for a finished task
+#
+# Arguments
+#   $1 - task name
+#   $2 - task EC
+_task_exit_hook() {
+    local hook="${TASK_EXIT_HOOK:-}"
+
+    [[ -z "$hook" ]] && return 0
+    # Unset the hook for the hook itself, so tasks executed from it don't
+    # call it recursively. Also, the hook must never affect the result of
+    # the original task.
+    TASK_EXIT_HOOK="" $hook "$@" || :
+}
+
 # Execute given task "silently":
 #   - redirect stdout/stderr to a given log file
 #   - show a simple progress "bar"
@@ -148,26 +242,64 @@ exectask() {
     touch "$logfile"
 
     echo "[TASK] $task_name ($task_command)"
-    echo "[TASK START] $(date)" >>"$logfile"
+    echo "[TASK START] $(date --iso-8601=seconds)" >>"$logfile"
 
     # shellcheck disable=SC2086
     eval $task_command &>>"$logfile" &
     local pid=$!
     waitforpid $pid
     local ec=$?
-    echo "[TASK END] $(date)" >>"$logfile"
+    echo "[TASK END] $(date --iso-8601=seconds)" >>"$logfile"
 
     printresult $ec "$logfile" "$task_name" "$ignore_ec"
     echo
 
+    _task_exit_hook "$task_name" $ec
+
     return $ec
 }
 
+# Check if a log of a failed task matches any of the known flaky signatures
+# (see $TASK_FLAKY_SIGNATURES)
+#
+# Arguments
+#   $1 - task name
+#   $2 - task log file
+# Returns
+#   0 (and prints the name of the matching signature) if the failure is worth
+#   retrying, 1 otherwise
+_task_flaky_signature() {
+    local task_name="${1:?Missing task name}"
+    local logfile="${2:?Missing log file}"
+    local name glob rx
+
+    # No signature database => we can't tell flaky failures from real ones, so
+    # don't retry anything (see the check when sourcing this file)
+    if [[ ! -r "$TASK_FLAKY_SIGNATURES" ]]; then
+        _err "Can't read flaky signatures from '$TASK_FLAKY_SIGNATURES', not retrying $task_name"
+        return 1
+    fi
+
+    while read -r name glob rx; do
+        [[ -z "$name" || "$name" == \#* || -z "$rx" ]] && continue
+        # shellcheck disable=SC2053
+        [[ "$task_name" == $glob ]] || continue
+
+        if grep -qE -- "$rx" "$logfile"; then
+            echo "$name"
+            return 0
+        fi
+    done <"$TASK_FLAKY_SIGNATURES"
+
+    return 1
+}
+
 # Execute given task "silently" and retry it n-times in case the task fails:
 #   - redirect stdout/stderr to a given log file
 #   - show a simple progress "bar"
 #   - dump the log on error
-#   - retry the task up to n times in case it fails
+#   - retry the task up to n times in case it fails with a known flaky
+#     signature (see $TASK_FLAKY_SIGNATURES)
 # Essentially the same function as exectask(), but for flaky tests.
 #
 # Arguments
@@ -179,7 +311,7 @@ exectask_retry() {
     local task_command="${2:?Missing task command}"
     local retries="${3:-$TASK_RETRY_DEFAULT}"
     local ec=0
-    local orig_testdir orig_nspawn_arguments
+    local orig_testdir orig_nspawn_arguments signature
 
     for ((i = 1; i <= retries; i++)); do
         local logfile="$LOGDIR/${task_name}_${i}.log"
@@ -188,7 +320,7 @@ exectask_retry() {
         touch "$logfile"
 
         echo "[TASK] $task_name ($task_command) [try $i/$retries]"
-        echo "[TASK START] $(date)" >>"$logfile"
+        echo "[TASK START] $(date --iso-8601=seconds)" >>"$logfile"
 
         # Make sure each retry has a unique state dir ($TESTDIR) and container
         # name (passed in $NSPAWN_ARGUMENTS), so we don't overwrite results
@@ -211,53 +343,192 @@ exectask_retry() {
         pid=$!
         waitforpid $pid
         ec=$?
-        echo "[TASK END] $(date)" >>"$logfile"
+        echo "[TASK END] $(date --iso-8601=seconds)" >>"$logfile"
+
+        _task_exit_hook "${task_name}_${i}" $ec
 
         if [[ $ec -eq 0 ]]; then
             # Task passed => report the result & bail out early
             printresult $ec "$logfile" "$task_name" 0
             echo
             break
+        elif [[ $i -lt retries ]] && signature="$(_task_flaky_signature "$task_name" "$logfile")"; then
+            # Task failed with a known flaky signature and we still have retries
+            # left => report the result as "ignored" and continue to the next retry
+            echo "[FLAKY] $task_name - matched signature '$signature', retrying"
+            printf "%s\t%s\n" "$task_name" "$signature" >>"$FLAKY_TASKS_STATE"
+            printresult $ec "$logfile" "$task_name" 1
+            echo
         else
-            # Task failed => check if we still have retries left. If so, report
-            # the result as "ignored" and continue to the next retry. Otherwise,
-            # report the result as failed.
-            printresult $ec "$logfile" "$task_name" $((i < retries))
+            # Task failed deterministically (or ran out of retries) => report
+            # the result as failed
+            [[ $i -lt retries ]] && echo "[NOT FLAKY] $task_name - no known flaky signature matched, not retrying"
+            printresult $ec "$logfile" "$task_name" 0
             echo
+            break
         fi
     done
 
     return $ec
 }
 
-# Execute given task in parallel fashion:
-#   - redirect stdout/stderr to a given log file
-#   - return after inserting the task into the queue (or wait until there's
-#     a free spot)
-#   - dump the log on error
+# Print the "some" avg10 value of given PSI resource (as an integer)
+# Arguments
+#   $1 - PSI resource (cpu, io, memory)
+_psi_avg10() {
+    local line
+
+    # some avg10=1.23 avg60=0.00 avg300=0.00 total=12345
+    read -r line <"/proc/pressure/${1:?Missing PSI resource}" || return 1
+    line="${line#*avg10=}"
+    echo "${line%%.*}"
+}
+
+# Check if there are enough resources to start another parallel task
+#
+# Logs the decision into $TASK_ADMISSION_LOG
 # Arguments
 #   $1 - task name
-#   $2 - task command
-exectask_p() {
+# Returns
+#   0 if the task can be started, 1 otherwise
+_task_admission_check() {
+    local task_name="${1:?Missing task name}"
+    local running="${#TASK_QUEUE[@]}"
+    local cpu io memory load reason=""
+    local ec=1
+
+    cpu="$(_psi_avg10 cpu)" || cpu=0
+    io="$(_psi_avg10 io)" || io=0
+    memory="$(_psi_avg10 memory)" || memory=0
+    read -r load _ </proc/loadavg || load=0
+    load="${load%%.*}"
+
+    if [[ $running -eq 0 ]]; then
+        # Always start at least one task, otherwise we'd wait indefinitely
+        reason="queue is empty"
+        ec=0
+    elif [[ $cpu -ge $TASK_PSI_CPU_MAX ]]; then
+        reason="CPU pressure $cpu% >= $TASK_PSI_CPU_MAX%"
+    elif [[ $io -ge $TASK_PSI_IO_MAX ]]; then
+        reason="I/O pressure $io% >= $TASK_PSI_IO_MAX%"
+    elif [[ $memory -ge $TASK_PSI_MEMORY_MAX ]]; then
+        reason="memory pressure $memory% >= $TASK_PSI_MEMORY_MAX%"
+    elif [[ $load -ge $TASK_LOAD_MAX ]]; then
+        reason="load $load >= $TASK_LOAD_MAX"
+    elif [[ $running -ge $TASK_QUEUE_BASE && $((SECONDS - _TASK_LAST_ADMISSION)) -lt $TASK_ADMISSION_INTERVAL ]]; then
+        reason="last task started less than ${TASK_ADMISSION_INTERVAL}s ago"
+    else
+        reason="pressure is OK"
+        ec=0
+    fi
+
+    printf "%s %-5s %s running=%d/%d cpu=%d io=%d memory=%d load=%d (%s)\n" \
+           "$(date --iso-8601=seconds)" "$([[ $ec -eq 0 ]] && echo ADMIT || echo HOLD)" "$task_name" \
+           "$running" "$MAX_QUEUE_SIZE" "$cpu" "$io" "$memory" "$load" "$reason" >>"$TASK_ADMISSION_LOG"
+
+    if [[ $ec -eq 0 ]]; then
+        _TASK_LAST_ADMISSION=$SECONDS
+    fi
+
+    return $ec
+}
+
+# Wait until one of given PIDs exits
+#
+# Note: `wait -n` doesn't consider tasks which exited before it was called, so
+#       the caller has to check the PIDs on its own after this function returns
+# Arguments
+#   $@ - PIDs to wait for
+_wait_for_any() {
+    if ((BASH_VERSINFO[0] > 5 || (BASH_VERSINFO[0] == 5 && BASH_VERSINFO[1] >= 1))); then
+        # bash 5.1+ can wait for a specific set of PIDs
+        wait -n "$@" 2>/dev/null
+    elif ((BASH_VERSINFO[0] == 5 || (BASH_VERSINFO[0] == 4 && BASH_VERSINFO[1] >= 3))); then
+        wait -n 2>/dev/null
+    else
+        # bash < 4.3 (i.e. CentOS 7) doesn't support `wait -n` at all, so
+        # fall back to polling
+        sleep 0.01
+    fi
+}
+
+# Wait until one of given PIDs exits, but at most given number of seconds
+#
+# A task which exits right before `wait -n` is called is reported as "no such
+# job" and `wait -n` keeps waiting for the other ones, so add a sleep process
+# to the set of PIDs to make sure we don't block for too long
+# Arguments
+#   $1 - max time to wait (in seconds)
+#   $@ - PIDs to wait for
+_wait_for_any_timeout() {
+    local timeout="${1:?Missing timeout}"
+    local sleeper
+    shift
+
+    sleep "$timeout" &
+    sleeper=$!
+    if ((BASH_VERSINFO[0] == 4 && BASH_VERSINFO[1] < 3)); then
+        wait "$sleeper"
+    else
+        _wait_for_any "$@" "$sleeper"
+    fi
+    kill "$sleeper" 2>/dev/null
+    wait "$sleeper" 2>/dev/null
+}
+
+# Wait until there's a free slot in the parallel task queue
+#
+# Finished tasks are dropped from the queue and if there's still no free slot
+# we block until one of the queued tasks exits (using `wait -n`, but at most
+# $TASK_QUEUE_POLL_INTERVAL seconds), so we don't burn CPU while waiting and
+# the slot can be refilled (almost) immediately. If the
+# admission control is enabled, the task is also held back until the system
+# is not under pressure (or until the queue is empty).
+# Arguments
+#   $1 - task name
+_task_queue_wait_for_slot() {
     local task_name="${1:?Missing task name}"
-    local task_command="${2:?Missing task command}"
     local key
 
-    while [[ ${#TASK_QUEUE[@]} -ge $MAX_QUEUE_SIZE ]]; do
+    while :; do
         for key in "${!TASK_QUEUE[@]}"; do
             if ! kill -0 "${TASK_QUEUE[$key]}" &>/dev/null; then
                 # Task has finished, drop it from the queue
                 wait "${TASK_QUEUE[$key]}"
                 unset "TASK_QUEUE[$key]"
-                # Break from inner for loop and outer while loop to skip
-                # the sleep below when we find a free slot in the queue
-                break 2
             fi
         done
 
-        # Precisely* calculated constant to keep the spinlock from burning the CPU(s)
-        sleep 0.01
+        if [[ ${#TASK_QUEUE[@]} -ge $MAX_QUEUE_SIZE ]]; then
+            # Bound the wait, since a task which exited after the check above
+            # wouldn't wake us up
+            _wait_for_any_timeout "$TASK_QUEUE_POLL_INTERVAL" "${TASK_QUEUE[@]}"
+            continue
+        fi
+
+        if [[ $TASK_ADMISSION -eq 0 ]] || _task_admission_check "$task_name"; then
+            return 0
+        fi
+
+        # Wait until one of the running tasks exits or until it's time to
+        # check the pressure again
+        _wait_for_any_timeout "$TASK_ADMISSION_INTERVAL" "${TASK_QUEUE[@]}"
     done
+}
+
+# Execute given task in parallel fashion:
+#   - redirect stdout/stderr to a given log file
+#   - return after inserting the task into the queue (or wait until there's
+#     a free spot)
+#   - dump the log on error
+# Arguments
+#   $1 - task name
+#   $2 - task command
+exectask_p() {
+    local task_name="${1:?Missing task name}"
+    local task_command="${2:?Missing task command}"
+
+    _task_queue_wait_for_slot "$task_name"
 
     TASK_LOG_LEVEL=0 exectask "$task_name" "$task_command" &
     TASK_QUEUE[$task_name]=$!
@@ -278,23 +549,8 @@ exectask_retry_p() {
     local task_name="${1:?Missing task name}"
     local task_command="${2:?Missing task command}"
     local retries="${3:-$TASK_RETRY_DEFAULT}"
-    local key
 
-    while [[ ${#TASK_QUEUE[@]} -ge $MAX_QUEUE_SIZE ]]; do
-        for key in "${!TASK_QUEUE[@]}"; do
-            if ! kill -0 "${TASK_QUEUE[$key]}" &>/dev/null; then
-                # Task has finished, drop it from the queue
-                wait "${TASK_QUEUE[$key]}"
-                unset "TASK_QUEUE[$key]"
-                # Break from inner for loop and outer while loop to skip
-                # the sleep below when we find a free slot in the queue
-                break 2
-            fi
-        done
-
-        # Precisely* calculated constant to keep the spinlock from burning the CPU(s)
-        sleep 0.01
-    done
+    _task_queue_wait_for_slot "$task_name"
 
     TASK_LOG_LEVEL=0 exectask_retry "$task_name" "$task_command" "$retries" &
     TASK_QUEUE[$task_name]=$!
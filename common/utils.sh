@@ -59,6 +59,268 @@ in_set() {
     return 1
 }
 
+# Print elements belonging to the given shard, one per line
+#
+# The elements are distributed among the shards in a round-robin fashion, i.e.
+# the n-th element (counting from 0) belongs to shard (n % COUNT) + 1
+#
+# Arguments:
+#   $1    - shard index (1-based)
+#   $2    - number of shards
+#   $3-$n - elements to distribute
+shard_filter() {
+    local index="${1:?Missing shard index}"
+    local count="${2:?Missing shard count}"
+    local i=0
+    shift 2
+
+    for _elem in "$@"; do
+        if [[ $((i++ % count + 1)) -eq $index ]]; then
+            echo "$_elem"
+        fi
+    done
+}
+
+# Directory with content-addressed build artifacts (initrds, test images, ...),
+# which may be persisted across runs by agent-control.py (see --node-cache)
+CI_CACHE_DIR="${CI_CACHE_DIR:-/var/cache/systemd-centos-ci/cache}"
+# Number of entries to keep for each kind of cached artifacts
+CI_CACHE_KEEP="${CI_CACHE_KEEP:-3}"
+
+# Print a cache key derived from the given components
+#
+# Arguments:
+#   $1-$n - components (strings) the key is derived from
+ci_cache_key() {
+    printf "%s\n" "$@" | sha256sum | cut -d' ' -f1
+}
+
+# Restore a cached file
+#
+# Arguments:
+#   $1 - kind of the cached file (i.e. initrd)
+#   $2 - cache key (see ci_cache_key())
+#   $3 - destination path
+#
+# Returns:
+#   0 if the file was found in the cache and restored, 1 otherwise
+ci_cache_get() {
+    local kind="${1:?Missing kind}"
+    local key="${2:?Missing key}"
+    local dest="${3:?Missing destination}"
+    local entry="$CI_CACHE_DIR/$kind/$key/content"
+
+    if [[ ! -f "$entry" ]]; then
+        _log "Cache miss: $kind ($key)"
+        return 1
+    fi
+
+    _log "Cache hit: $kind ($key)"
+    mkdir -p "$(dirname "$dest")"
+    # Mark the entry as recently used, so it doesn't get pruned
+    touch "$CI_CACHE_DIR/$kind/$key"
+    cp --sparse=always "$entry" "$dest"
+}
+
+# Store a file in the cache
+#
+# Only $CI_CACHE_KEEP most recently used entries of each kind are kept
+#
+# Arguments:
+#   $1 - kind of the cached file (i.e. initrd)
+#   $2 - cache key (see ci_cache_key())
+#   $3 - path to the file to store
+ci_cache_put() {
+    local kind="${1:?Missing kind}"
+    local key="${2:?Missing key}"
+    local source="${3:?Missing source}"
+    local entry_dir="$CI_CACHE_DIR/$kind/$key"
+    local tmp_dir
+
+    if [[ ! -f "$source" ]]; then
+        _err "Can't cache '$source', it's not a file"
+        return 1
+    fi
+
+    mkdir -p "$CI_CACHE_DIR/$kind"
+    # Populate the entry in a temporary directory first, so we never end up
+    # with a partial entry
+    tmp_dir="$(mktemp -d "$CI_CACHE_DIR/$kind/.tmp.XXX")"
+    if ! cp --sparse=always "$source" "$tmp_dir/content"; then
+        rm -fr "$tmp_dir"
+        return 1
+    fi
+
+    rm -fr "$entry_dir"
+    mv "$tmp_dir" "$entry_dir"
+    _log "Stored $kind in cache ($key)"
+
+    # Prune the least recently used entries
+    find "$CI_CACHE_DIR/$kind" -mindepth 1 -maxdepth 1 -type d ! -name ".*" -printf "%T@ %p\n" | \
+        sort -rn | \
+        tail -n +$((CI_CACHE_KEEP + 1)) | \
+        while read -r _ dir; do
+            _log "Pruning $kind cache entry ${dir##*/}"
+            rm -fr "$dir"
+        done
+}
+
+# Location of the extracted package bundle on the node (see package_bundle_restore())
+PACKAGE_BUNDLE_DIR="${PACKAGE_BUNDLE_DIR:-/var/cache/systemd-centos-ci/package-bundle}"
+# Name of the local repository created from the package bundle
+PACKAGE_BUNDLE_REPO="ci-package-bundle"
+
+# Print the name of the package bundle for the current distribution & arch
+#
+# The same bundle can be restored only on a node with the same distribution
+# release and architecture it was created on
+package_bundle_name() {
+    (
+        # shellcheck source=/dev/null
+        . /etc/os-release
+        echo "package-bundle-$ID-$VERSION_ID-$(uname -m).tar"
+    )
+}
+
+# Create a bundle of all currently installed packages which are kept in the dnf
+# cache, i.e. packages installed with 'keepcache=1'
+#
+# The bundle is a plain tarball (the RPMs are already compressed) which contains
+# a local repository with the packages, the GPG keys imported on the node (which
+# include keys of the EPEL & Copr repositories), and a list of the installed
+# packages (NEVRAs), so it can be restored in one go on a fresh node using
+# package_bundle_restore().
+#
+# Arguments:
+#   $1 - output directory, the bundle is stored there as $(package_bundle_name)
+#
+# Returns:
+#   0 on success, 1 otherwise
+package_bundle_create() {
+    local output_dir="${1:?Missing output directory}"
+    local bundle="$output_dir/$(package_bundle_name)"
+    local work_dir rpm nevra key count=0
+
+    work_dir="$(mktemp -d /var/tmp/package-bundle.XXX)"
+    # shellcheck disable=SC2064
+    trap "rm -fr '$work_dir'" RETURN
+
+    mkdir -p "$work_dir/rpms" "$work_dir/keys" "$output_dir"
+    # Bundle only packages which are actually installed, since the cache may
+    # contain also older versions of packages updated later on
+    rpm -qa --qf "%{NEVRA}\n" | sort >"$work_dir/installed"
+    while read -r rpm; do
+        [[ -e "$work_dir/rpms/${rpm##*/}" ]] && continue
+        nevra="$(rpm -qp --nosignature --qf "%{NEVRA}" "$rpm")" || continue
+        if grep -qxF -- "$nevra" "$work_dir/installed"; then
+            cp "$rpm" "$work_dir/rpms/"
+            echo "$nevra" >>"$work_dir/packages"
+            count=$((count + 1))
+        fi
+    done < <(find /var/cache/dnf -name "*.rpm")
+
+    if [[ $count -eq 0 ]]; then
+        _err "No installed packages found in the dnf cache (was dnf run with keepcache=1?)"
+        return 1
+    fi
+
+    createrepo_c --quiet "$work_dir/rpms" || return 1
+    # Export all imported GPG keys, so the packages can be verified on a node
+    # which doesn't have the respective repositories configured yet
+    for key in $(rpm -q gpg-pubkey); do
+        rpm -q --qf "%{DESCRIPTION}" "$key" >"$work_dir/keys/$key.asc"
+    done
+
+    tar -cf "$bundle.tmp" -C "$work_dir" keys packages rpms || return 1
+    mv "$bundle.tmp" "$bundle"
+    _log "Created package bundle $bundle with $count packages ($(du -h "$bundle" | cut -f1))"
+}
+
+# Install packages from a package bundle created by package_bundle_create()
+#
+# The bundle is fetched in one go and the packages are installed from a local
+# repository, so there's no need to fetch the packages one by one from (usually
+# slow) mirrors. The packages are verified using the GPG keys shipped with the
+# node and the bundle. Packages which were not installed (i.e. because a newer
+# version is already installed) are logged.
+#
+# Arguments:
+#   $1 - URL of the bundle, or URL of a directory with bundles, in which case
+#        the bundle for the current distribution & arch is used (see
+#        package_bundle_name())
+#
+# Returns:
+#   0 on success, 1 otherwise
+package_bundle_restore() {
+    local url="${1:?Missing bundle URL}"
+    local skipped
+
+    [[ "$url" == *.tar ]] || url="${url%/}/$(package_bundle_name)"
+
+    _log "Fetching package bundle from $url"
+    rm -fr "$PACKAGE_BUNDLE_DIR"
+    mkdir -p "$PACKAGE_BUNDLE_DIR"
+    if ! curl -fsS --retry 5 "$url" | tar -xf - -C "$PACKAGE_BUNDLE_DIR"; then
+        _err "Failed to fetch the package bundle from $url"
+        return 1
+    fi
+
+    if ! rpm --import /etc/pki/rpm-gpg/* "$PACKAGE_BUNDLE_DIR"/keys/*.asc; then
+        _err "Failed to import GPG keys"
+        return 1
+    fi
+
+    # Packages which are already installed in a newer version (i.e. when the base
+    # image is newer than the bundle) are skipped, hence --skip-broken
+    if ! xargs -a "$PACKAGE_BUNDLE_DIR/packages" \
+            dnf -y --disablerepo="*" \
+                --repofrompath="$PACKAGE_BUNDLE_REPO,$PACKAGE_BUNDLE_DIR/rpms" \
+                --setopt="$PACKAGE_BUNDLE_REPO.gpgcheck=1" \
+                --skip-broken \
+                install; then
+        _err "Failed to install packages from the package bundle"
+        return 1
+    fi
+
+    skipped="$(comm -23 <(sort "$PACKAGE_BUNDLE_DIR/packages") <(rpm -qa --qf "%{NEVRA}\n" | sort))"
+    if [[ -n "$skipped" ]]; then
+        _log "Following packages from the package bundle were not installed:"
+        echo "$skipped"
+    fi
+
+    _log "Installed $(wc -l <"$PACKAGE_BUNDLE_DIR/packages") packages from the package bundle"
+}
+
+# Use ccache for subsequent (meson) builds
+#
+# Meson picks ccache up automatically once it's installed, so this only points
+# it to the given cache directory (which is carried over between nodes by
+# agent-control.py, see --build-cache) and resets the statistics, so they
+# cover just the current build.
+#
+# Arguments:
+#   $1 - path to the cache directory
+#
+# Returns:
+#   0 on success, 1 if ccache is not available
+ccache_setup() {
+    local cache_dir="${1:?}"
+
+    if ! command -v ccache >/dev/null; then
+        _err "ccache is not installed"
+        return 1
+    fi
+
+    mkdir -p "$cache_dir"
+    export CCACHE_DIR="$cache_dir"
+    # Keep the cache small enough to be transferred between the controller and the nodes
+    export CCACHE_MAXSIZE="${CCACHE_MAXSIZE:-5G}"
+    # Check the compiler by its contents, as the mtime changes with every (re)installation
+    export CCACHE_COMPILERCHECK=content
+    ccache --zero-stats
+    _log "Using ccache in $CCACHE_DIR ($(ccache --version | head -n1))"
+}
+
 # Convert a string boolean value to a corresponding bash exit code
 #
 # Arguments:
@@ -458,6 +720,168 @@ coredumpctl_collect() {
     return 1
 }
 
+# Collect coredumps (and optionally sanitizer errors) from journals of a single
+# integration test
+#
+# Meant to be called for each test as soon as it finishes (see crash_harvest_hook()),
+# so the journals are processed while other tests are still running. Journal files
+# which were already processed (and didn't change since) are recorded in the
+# $LOGDIR/.crash_harvest_scanned file and skipped, so it's cheap to call this
+# function again for the same test at the end of the testsuite. All findings are
+# recorded in $LOGDIR/.crash_findings (see crash_report_write()).
+#
+# Set $CRASH_HARVEST_SANITIZERS to 1 to check the test journal for sanitizer
+# errors as well ($JOURNALCTL_BIN can be used to override the journalctl binary).
+#
+# Arguments:
+#   $1: task name (the "_X" suffix added by exectask_retry*() is stripped when
+#       looking up the test-specific coredump filter)
+#   $2: test directory ($TESTDIR) with the test journals
+#
+# Returns:
+#   0 when no crashes were found (or the journals were already processed),
+#   1 otherwise
+crash_harvest() {
+    local task_name="${1:?Missing task name}"
+    local testdir="${2:?Missing test directory}"
+    local scanned="$LOGDIR/.crash_harvest_scanned"
+    local findings="$LOGDIR/.crash_findings"
+    local test_name="${task_name%_[0-9]}"
+    local ec=0
+    local journal key keys=() new_keys=() logfile
+
+    # Identify each journal file by its path, size, and mtime, so we process it
+    # again if it changes (e.g. when the test is re-run into the same directory)
+    while read -r journal; do
+        keys+=("$(stat --printf "%n\t%s\t%Y" "$journal")")
+    done < <(find "$testdir" -maxdepth 3 -name "*.journal" 2>/dev/null | sort)
+
+    if [[ ${#keys[@]} -eq 0 ]]; then
+        return 0
+    fi
+
+    touch "$scanned"
+    for key in "${keys[@]}"; do
+        grep -qxF -- "$key" "$scanned" || new_keys+=("$key")
+    done
+
+    if [[ ${#new_keys[@]} -eq 0 ]]; then
+        return 0
+    fi
+
+    _log "Processing ${#new_keys[@]} new/changed journal file(s) of $task_name in $testdir"
+
+    # Filter out test-specific coredumps which are usually intentional
+    # Note: run in a subshell, so we don't propagate the filter override
+    # Note2: the log is used only if the task fails, hence the _FAIL suffix
+    #        (see printresult())
+    logfile="$LOGDIR/${task_name}_coredumpctl_collect_FAIL.log"
+    if ! (
+        if [[ -v "COREDUMPCTL_EXCLUDE_MAP[test/$test_name]" ]]; then
+            export COREDUMPCTL_EXCLUDE_RX="${COREDUMPCTL_EXCLUDE_MAP[test/$test_name]}"
+        fi
+        exectask "${task_name}_coredumpctl_collect" "coredumpctl_collect '$testdir/'"
+    ); then
+        ec=1
+        sed -nr "s/^\[coredumpctl_collect\] Collecting coredumps for '(.+)'$/\1/p" "$logfile" | sort -u | while read -r exe; do
+            printf "%s\tcoredump\t%s\t%s\n" "$task_name" "$exe" "$logfile"
+        done >>"$findings"
+    fi
+
+    if [[ "${CRASH_HARVEST_SANITIZERS:-0}" -ne 0 && -f "$testdir/system.journal" ]]; then
+        logfile="$LOGDIR/${task_name}_sanitizer_errors_FAIL.log"
+        if ! exectask "${task_name}_sanitizer_errors" \
+                      "${JOURNALCTL_BIN:-journalctl} -o short-monotonic --no-hostname --file '$testdir/system.journal' | check_for_sanitizer_errors"; then
+            ec=1
+            printf "%s\tsanitizer\t%s\t%s\n" \
+                   "$task_name" "$(grep -Pom1 "Found\s+\K[0-9]+(?= sanitizer errors)" "$logfile" || echo "?")" "$logfile" >>"$findings"
+        fi
+    fi
+
+    printf "%s\n" "${new_keys[@]}" >>"$scanned"
+
+    return $ec
+}
+
+# Exit hook for integration test tasks (see $TASK_EXIT_HOOK in common/task-control.sh)
+#
+# Harvests crashes from the test journals in $TESTDIR as soon as the test
+# finishes, e.g.:
+#   TASK_EXIT_HOOK=crash_harvest_hook exectask_retry_p "TEST-01-BASIC" "make -C test/TEST-01-BASIC ..."
+#
+# Arguments:
+#   $1: task name
+#   $2: task EC
+crash_harvest_hook() {
+    local task_name="${1:?Missing task name}"
+
+    if [[ ! -v TESTDIR || ! -d "$TESTDIR" ]]; then
+        return 0
+    fi
+
+    crash_harvest "$task_name" "$TESTDIR"
+}
+
+# Escape given string for use in a JSON string
+_json_escape() {
+    local str="$1"
+
+    str="${str//\\/\\\\}"
+    str="${str//\"/\\\"}"
+    str="${str//$'\t'/\\t}"
+    str="${str//$'\n'/\\n}"
+    echo -n "$str"
+}
+
+# Write a machine-readable report of all crashes found by crash_harvest()
+#
+# Format:
+#   {
+#     "scanned_journals": N,
+#     "crashes": [
+#       {"task": "...", "type": "coredump", "executable": "...", "log": "..."},
+#       {"task": "...", "type": "sanitizer", "errors": N, "log": "..."},
+#       ...
+#     ]
+#   }
+#
+# Arguments:
+#   $1: output file
+crash_report_write() {
+    local output="${1:?Missing output file}"
+    local findings="$LOGDIR/.crash_findings"
+    local scanned=0 first=1
+    local task type detail log
+
+    [[ -f "$LOGDIR/.crash_harvest_scanned" ]] && scanned="$(wc -l <"$LOGDIR/.crash_harvest_scanned")"
+
+    {
+        echo "{"
+        echo "  \"scanned_journals\": $scanned,"
+        echo -n "  \"crashes\": ["
+        if [[ -f "$findings" ]]; then
+            while IFS=$'\t' read -r task type detail log; do
+                [[ $first -eq 0 ]] && echo -n ","
+                first=0
+                echo
+                echo -n "    {\"task\": \"$(_json_escape "$task")\", \"type\": \"$type\", "
+                if [[ "$type" == sanitizer ]]; then
+                    [[ "$detail" =~ ^[0-9]+$ ]] || detail=null
+                    echo -n "\"errors\": $detail, "
+                else
+                    echo -n "\"executable\": \"$(_json_escape "$detail")\", "
+                fi
+                echo -n "\"log\": \"$(_json_escape "${log##*/}")\"}"
+            done < <(sort "$findings")
+        fi
+        [[ $first -eq 0 ]] && echo -en "\n  "
+        echo "]"
+        echo "}"
+    } >"$output"
+
+    _log "Crash report written to $output ($(grep -c '"type"' "$output") crash(es) in $scanned journal file(s))"
+}
+
 # Print the currently used cgroups hierarchy in a "human-friendly" form:
 # unified, hybrid, legacy, or unknown.
 print_cgroup_hierarchy() {
@@ -0,0 +1,70 @@
+#!/bin/bash
+# shellcheck disable=SC2181,SC2317
+
+# Note: this script MUST be self-contained - i.e. it MUST NOT source any
+# external scripts as it is used as a bootstrap script, thus it's
+# fetched and executed without rest of this repository
+#
+# Example usage in Jenkins
+# #!/bin/sh
+#
+# set -e
+#
+# curl -q -o runner.sh https://../package-bundle-make-cache.sh
+# chmod +x runner.sh
+# ./runner.sh
+set -eu
+set -o pipefail
+
+at_exit() {
+    # Correctly collect artifacts from all cron jobs and generate a nice
+    # directory structure
+    if find . -name "artifacts_*" | grep -q "."; then
+        mkdir _artifacts_all
+        mv artifacts_* _artifacts_all
+        mv _artifacts_all artifacts_all
+
+        ./agent-control.py --generate-index artifacts_all
+    fi
+}
+
+trap at_exit EXIT
+
+ARGS=()
+PASSED=()
+FAILED=()
+EC=0
+
+git clone https://github.com/systemd/systemd-centos-ci
+cd systemd-centos-ci
+
+set +e
+
+(
+    set -e
+    BUNDLE="package_bundles/package-bundle-centos-9-x86_64"
+    echo "Updating the C9S package bundle"
+
+    # Generate a new bundle with '-new' suffix
+    ./agent-control.py --pool virt-ec2-t2-centos-9s-x86_64 --no-index --package-bundle-sync ${ARGS:+"${ARGS[@]}"}
+    # Check if it doesn't break anything
+    ./agent-control.py --pool virt-ec2-t2-centos-9s-x86_64 --no-index --package-bundle "https://artifacts.ci.centos.org/systemd/$BUNDLE-new.tar" ${ARGS:+"${ARGS[@]}"}
+    # Overwrite the production bundle with the just tested one. Since the CentOS CI
+    # artifact server supports only rsync protocol, use a single-purpose script
+    # to do that
+    utils/artifacts-copy-file.sh "$BUNDLE-new.tar" "$BUNDLE.tar"
+)
+if [[ $? -ne 0 ]]; then
+    EC=$((EC + 1))
+    FAILED+=("package-bundle-centos-9-x86_64")
+else
+    PASSED+=("package-bundle-centos-9-x86_64")
+fi
+
+echo "PASSED TASKS:"
+printf "    %s\n" "${PASSED[@]}"
+echo
+echo "FAILED TASKS:"
+printf "    %s\n" "${FAILED[@]}"
+
+exit $EC
@@ -25,7 +25,7 @@ at_exit() {
         mv artifacts_* _artifacts_all
         mv _artifacts_all artifacts_all
 
-        utils/generate-index.sh artifacts_all index.html
+        ./agent-control.py --generate-index artifacts_all
     fi
 }
 
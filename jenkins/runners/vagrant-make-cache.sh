@@ -24,7 +24,7 @@ at_exit() {
         mv artifacts_* _artifacts_all
         mv _artifacts_all artifacts_all
 
-        utils/generate-index.sh artifacts_all index.html
+        ./agent-control.py --generate-index artifacts_all
     fi
 }
 
@@ -54,6 +54,8 @@ set +e
     # artifact server supports only rsync protocol, use a single-purpose script
     # to do that
     utils/artifacts-copy-file.sh vagrant_boxes/archlinux_systemd-new vagrant_boxes/archlinux_systemd
+    # Promote the box manifest as well (for the box cache, see utils/vagrant-box-cache.py)
+    utils/artifacts-copy-file.sh vagrant_boxes/archlinux_systemd-new.manifest.json vagrant_boxes/archlinux_systemd.manifest.json
 )
 if [[ $? -ne 0 ]]; then
     EC=$((EC + 1))
@@ -72,6 +74,8 @@ fi
     # artifact server supports only rsync protocol, use a single-purpose script
     # to do that
     utils/artifacts-copy-file.sh vagrant_boxes/rawhide_selinux-new vagrant_boxes/rawhide_selinux
+    # Promote the box manifest as well (for the box cache, see utils/vagrant-box-cache.py)
+    utils/artifacts-copy-file.sh vagrant_boxes/rawhide_selinux-new.manifest.json vagrant_boxes/rawhide_selinux.manifest.json
 )
 if [[ $? -ne 0 ]]; then
     EC=$((EC + 1))
@@ -0,0 +1,816 @@
+#!/usr/bin/env python3
+# pylint: disable=line-too-long,invalid-name,missing-function-docstring,too-many-locals,too-many-statements,too-many-instance-attributes,too-few-public-methods
+"""Measure the orchestration overhead of agent-control.py
+
+Scenarios run agent-control.py's main() end to end (in-process) against
+simulated infrastructure:
+    - a stand-in Duffy API (with configurable latency and errors)
+    - an SSH/scp/rsync shim, which "executes" remote commands by sleeping for
+      a configured amount of time, simulates node reboots (the nodes stop
+      responding with an SSH banner for a while), and generates artifact trees
+      of configurable size when fetching artifacts
+    - an SSH banner listener for each node (on a loopback address), so the
+      SSH port probing works as with real nodes
+
+The time spent in the simulated remote work and node reboots is "external",
+everything else (polling and sleeping, SSH connection setup, artifact transfers,
+session cleanup, ...) is the overhead added by agent-control.py itself. The
+overhead is computed for each span from the execution trace (trace.json, see
+Tracer in agent-control.py).
+
+Usage:
+    agent-control-bench.py run [--scenario NAME]... [--repeat N] [--save FILE] [--baseline FILE] [--threshold PCT]
+        Run given scenarios (all of them by default) and report the overhead
+        per phase. With --baseline, compare the results with a previously saved
+        run (--save) and exit with EC 1 if the overhead of any phase grew more
+        than the threshold.
+
+    agent-control-bench.py list
+        List available scenarios
+
+    agent-control-bench.py duffy [--port PORT] [--config JSON]
+        Run only the stand-in Duffy API (i.e. for manual testing with
+        CICO_API_URL=http://127.0.0.1:PORT/api/v1)
+"""
+
+import argparse
+import contextlib
+import copy
+import importlib.util
+import ipaddress
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socketserver
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AGENT_CONTROL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent-control.py")
+# Environment variable with the state directory shared with the shim
+STATE_ENV = "AGENT_CONTROL_BENCH_STATE"
+# Nodes get consecutive loopback addresses starting with this one
+NODE_BASE_ADDRESS = ipaddress.IPv4Address("127.0.1.1")
+REMOTE_PATH_RX = re.compile(r"^(?P<host>127\.[0-9.]+):(?P<path>.*)$")
+# Report a regression only if the overhead grew at least this much (in seconds),
+# so we don't flag noise in short phases
+REGRESSION_MIN_DIFF = 0.5
+
+DEFAULT_CONFIG = {
+    # Simulated SSH latency (in seconds) of establishing a new (master) connection
+    # and of running a command over an existing one
+    "ssh": {"connect": 0.2, "command": 0.02},
+    # Time it takes the node to go down and come back up after a reboot (or kexec,
+    # which switches to the new kernel right away, see utils/kexec.sh)
+    "reboot": {"shutdown": 0.5, "boot": 3.0},
+    "kexec": {"shutdown": 0.0, "boot": 1.0},
+    # Artifact trees generated when fetching *logs* directories from the node
+    "artifacts": {"files": 50, "size_mib": 20, "bandwidth_mibps": 100},
+    # Stand-in Duffy API: latency of each request, number of requests failing
+    # at the beginning, random error rate, and pools which never have free nodes
+    "duffy": {"latency": 0.05, "fail_first": 0, "error_rate": 0.0, "unavailable_pools": []},
+    # Time (in seconds) the remote commands matching given regexes take
+    "work": [
+        ["agent/bootstrap[^ ]*\\.sh", 2.0],
+        ["agent/testsuite[^ ]*\\.sh", 3.0],
+        ["vagrant-ci-wrapper\\.sh", 3.0],
+        ["dnf .*upgrade", 1.0],
+    ],
+    # Task results printed by the testsuite commands (see --fail-fast)
+    "results": {"passed": 20, "failed": 0},
+}
+
+SCENARIOS = {
+    "testsuite": {
+        "help": "Bootstrap, reboot, and run the testsuite on a single node",
+        "args": [],
+        "config": {},
+    },
+    "testsuite-kexec": {
+        "help": "Same as 'testsuite', but switch to the new kernel using kexec",
+        "args": ["--kexec"],
+        "config": {},
+    },
+    "sharded": {
+        "help": "Testsuite split across three nodes",
+        "args": ["--shards", "3"],
+        "config": {},
+    },
+    "vagrant": {
+        "help": "Vagrant tests (including the hypervisor upgrade)",
+        "args": ["--vagrant", "arch"],
+        "config": {},
+    },
+    "allocation-retries": {
+        "help": "First two allocation attempts fail",
+        "args": [],
+        "config": {"duffy": {"fail_first": 2}},
+    },
+    "pool-fallback": {
+        "help": "The preferred pool has no free nodes, so the second one is used",
+        "args": ["--pool", "bench-busy,bench-pool"],
+        "config": {"duffy": {"unavailable_pools": ["bench-busy"]}},
+    },
+    "large-artifacts": {
+        "help": "Large artifact trees (2000 files, 1 GiB in total)",
+        "args": [],
+        "config": {"artifacts": {"files": 2000, "size_mib": 1024}},
+    },
+}
+
+
+def log(message):
+    print(f"[agent-control-bench] {message}", file=sys.stderr, flush=True)
+
+def merge_config(base, overrides):
+    result = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge_config(result[key], value)
+        else:
+            result[key] = copy.deepcopy(value)
+
+    return result
+
+def load_state_config():
+    with open(os.path.join(os.environ[STATE_ENV], "config.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+def record_event(kind, host, start, end, what):
+    """Record an interval of "external" time (remote work, node reboot)
+
+    The timestamps are from time.perf_counter(), which uses the system-wide
+    CLOCK_MONOTONIC on Linux, so they're comparable with the timestamps from
+    the agent-control.py's trace.
+    """
+    event = {"kind": kind, "host": host, "start": start, "end": end, "what": what}
+    # Appending a single short line with O_APPEND is atomic, so concurrent
+    # shims don't need any locking
+    with open(os.path.join(os.environ[STATE_ENV], "events.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(event) + "\n")
+
+def node_state_path(host):
+    return os.path.join(os.environ[STATE_ENV], "nodes", f"{host}.json")
+
+def node_state(host):
+    try:
+        with open(node_state_path(host), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"down_from": 0, "up_at": 0}
+
+def node_is_down(host):
+    state = node_state(host)
+    return state["down_from"] <= time.perf_counter() < state["up_at"]
+
+def reboot_node(host, config):
+    now = time.perf_counter()
+    state = {"down_from": now + config["shutdown"], "up_at": now + config["shutdown"] + config["boot"]}
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(node_state_path(host)), delete=False, encoding="utf-8") as f:
+        json.dump(state, f)
+
+    os.replace(f.name, node_state_path(host))
+    record_event("reboot", host, now, state["up_at"], "reboot")
+
+#
+# SSH/scp/rsync shim
+#
+
+def shim_connect(host, config):
+    """Simulate the SSH connection setup
+
+    Returns:
+    --------
+    False if the node is down (i.e. the connection failed)
+    """
+    if node_is_down(host):
+        time.sleep(config["ssh"]["command"])
+        return False
+
+    # The first connection (and the first one after the master connection gets
+    # closed, see BenchTransport.close()) has to do the full handshake
+    master = os.path.join(os.environ[STATE_ENV], "nodes", f"{host}.master")
+    if not os.path.exists(master):
+        time.sleep(config["ssh"]["connect"])
+        with open(master, "w", encoding="utf-8"):
+            pass
+
+    time.sleep(config["ssh"]["command"])
+    return True
+
+def shim_ssh(host, command, config):
+    if not shim_connect(host, config):
+        print(f"ssh: connect to host {host} port 22: Connection refused", file=sys.stderr)
+        return 255
+
+    # Consume the archive sent to the command (see AgentControl.upload_archive())
+    if "tar -xzf -" in command:
+        while sys.stdin.buffer.read(1024 * 1024):
+            pass
+
+    if "systemctl reboot" in command or "kexec.sh" in command:
+        reboot_node(host, config["kexec" if "kexec.sh" in command else "reboot"])
+        # The connection gets dropped by the reboot
+        return 255
+
+    duration = next((seconds for rx, seconds in config["work"] if re.search(rx, command)), 0)
+    if duration:
+        start = time.perf_counter()
+        time.sleep(duration)
+        record_event("work", host, start, time.perf_counter(), command[:100])
+
+    if re.search(r"testsuite|vagrant-ci-wrapper", command):
+        for i in range(config["results"]["passed"]):
+            print(f"[RESULT] TEST-{i:02d}-BENCH - PASS (log file: /root/testsuite-logs.bench/TEST-{i:02d}-BENCH_PASS.log)")
+        for i in range(config["results"]["failed"]):
+            print(f"[RESULT] TEST-{90 + i:02d}-BENCH - FAIL (EC: 1) (log file: /root/testsuite-logs.bench/TEST-{90 + i:02d}-BENCH_FAIL.log)")
+
+    return 0
+
+def generate_artifacts(remote_path, local_dir, config):
+    """Generate an artifact tree for the fetched remote directory
+
+    Returns:
+    --------
+    Size of the generated tree in bytes
+    """
+    # Only the *logs* directories are considered to be artifacts, other synced
+    # directories (caches, kdumps) are empty
+    name = os.path.basename(remote_path.rstrip("/")).rstrip("*")
+    if "logs" not in name:
+        return 0
+
+    target = os.path.join(local_dir, f"{name}.bench")
+    os.makedirs(target, exist_ok=True)
+    files = config["artifacts"]["files"]
+    size = config["artifacts"]["size_mib"] * 1024 * 1024 // max(files, 1)
+    passed = []
+    for i in range(files):
+        task = f"TEST-{i:02d}-BENCH"
+        passed.append(task)
+        with open(os.path.join(target, f"{task}_PASS.log"), "wb") as f:
+            # Sparse files, so generating large trees is cheap
+            f.truncate(size)
+
+    with open(os.path.join(target, ".passed_tasks"), "w", encoding="utf-8") as f:
+        f.writelines(f"{task}\n" for task in passed)
+
+    return size * files
+
+def local_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def shim_copy(source, target, config):
+    """Simulate scp/rsync between the local machine and a node"""
+    remote = REMOTE_PATH_RX.match(source) or REMOTE_PATH_RX.match(target)
+    if not remote or not shim_connect(remote.group("host"), config):
+        return 255
+
+    if REMOTE_PATH_RX.match(source):
+        size = generate_artifacts(remote.group("path"), target, config)
+    else:
+        size = local_size(source.rstrip("/"))
+
+    # The transfer is part of the overhead, so it's not recorded as an event
+    time.sleep(size / (config["artifacts"]["bandwidth_mibps"] * 1024 * 1024))
+    return 0
+
+def cmd_shim(args):
+    config = load_state_config()
+    if args.tool == "ssh":
+        return shim_ssh(args.arguments[0], args.arguments[1], config)
+
+    return shim_copy(args.arguments[0], args.arguments[1], config)
+
+#
+# Stand-in Duffy API
+#
+
+class FakeDuffy():
+    """Stand-in Duffy API (returning the models used by the Duffy 3.x client)"""
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.requests = 0
+        self.next_node = 0
+        self.random = random.Random(0)
+        handler = type("Handler", (FakeDuffyHandler,), {"duffy": self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/v1"
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-duffy", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def now():
+        return datetime.now(timezone.utc).isoformat()
+
+    def session_model(self, session):
+        return {
+            "id"         : session["id"],
+            "active"     : session["active"],
+            "created_at" : session["created_at"],
+            "retired_at" : session["retired_at"],
+            "expires_at" : None,
+            "data"       : {},
+            "tenant"     : {
+                "id"                             : 1,
+                "name"                           : "systemd",
+                "active"                         : True,
+                "is_admin"                       : False,
+                "ssh_key"                        : "ssh-ed25519 AAAA bench",
+                "node_quota"                     : None,
+                "session_lifetime"               : None,
+                "session_lifetime_max"           : None,
+                "effective_node_quota"           : 100,
+                "effective_session_lifetime"     : 21600,
+                "effective_session_lifetime_max" : 43200,
+                "created_at"                     : session["created_at"],
+                "retired_at"                     : None,
+            },
+            "nodes"      : [{
+                "id"       : i,
+                "hostname" : hostname,
+                "ipaddr"   : hostname,
+                "comment"  : None,
+                "pool"     : session["pool"],
+                "reusable" : False,
+                "data"     : {},
+                "state"    : "deployed" if session["active"] else "done",
+            } for i, hostname in enumerate(session["nodes"], start=1)],
+        }
+
+    def request_session(self, payload):
+        spec = payload["nodes_specs"][0]
+        with self.lock:
+            self.requests += 1
+            if self.requests <= self.config["fail_first"] or self.random.random() < self.config["error_rate"] or \
+               spec["pool"] in self.config["unavailable_pools"]:
+                return HTTPStatus.SERVICE_UNAVAILABLE, {"detail": f"can't reserve nodes: {spec}"}
+
+            nodes = [str(NODE_BASE_ADDRESS + self.next_node + i) for i in range(spec["quantity"])]
+            self.next_node += spec["quantity"]
+            session = {
+                "id"         : len(self.sessions) + 1,
+                "pool"       : spec["pool"],
+                "nodes"      : nodes,
+                "active"     : True,
+                "created_at" : self.now(),
+                "retired_at" : None,
+            }
+            self.sessions[session["id"]] = session
+
+        return HTTPStatus.CREATED, {"action": "post", "session": self.session_model(session)}
+
+    def update_session(self, session_id, payload):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return HTTPStatus.NOT_FOUND, {"detail": "not found"}
+            if not session["active"]:
+                return HTTPStatus.UNPROCESSABLE_ENTITY, {"detail": f"session {session_id} is retired"}
+            if payload.get("active") is False:
+                session["active"] = False
+                session["retired_at"] = self.now()
+
+        return HTTPStatus.OK, {"action": "put", "session": self.session_model(session)}
+
+    def show_session(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return HTTPStatus.NOT_FOUND, {"detail": "not found"}
+
+        return HTTPStatus.OK, {"action": "get", "session": self.session_model(session)}
+
+    def active_sessions(self):
+        with self.lock:
+            return [s for s in self.sessions.values() if s["active"]]
+
+class FakeDuffyHandler(BaseHTTPRequestHandler):
+    """Request handler of the stand-in Duffy API (bound to a FakeDuffy instance)"""
+    duffy = None
+
+    # pylint: disable=W0622
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _payload(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _session_id(self):
+        match = re.match(r"^/api/v1/sessions/([0-9]+)$", self.path)
+        return int(match.group(1)) if match else None
+
+    def do_POST(self):
+        time.sleep(self.duffy.config["latency"])
+        if self.path != "/api/v1/sessions":
+            return self._reply(HTTPStatus.NOT_FOUND, {"detail": "not found"})
+
+        return self._reply(*self.duffy.request_session(self._payload()))
+
+    def do_PUT(self):
+        time.sleep(self.duffy.config["latency"])
+        session_id = self._session_id()
+        if session_id is None:
+            return self._reply(HTTPStatus.NOT_FOUND, {"detail": "not found"})
+
+        return self._reply(*self.duffy.update_session(session_id, self._payload()))
+
+    def do_GET(self):
+        time.sleep(self.duffy.config["latency"])
+        session_id = self._session_id()
+        if session_id is None:
+            return self._reply(HTTPStatus.NOT_FOUND, {"detail": "not found"})
+
+        return self._reply(*self.duffy.show_session(session_id))
+
+#
+# SSH banner listeners
+#
+
+class BannerHandler(socketserver.BaseRequestHandler):
+    """Send an SSH banner to each client (unless the node is down)"""
+    def handle(self):
+        # A node which is down doesn't accept connections, closing the connection
+        # without a banner has the same effect on the SSH port probing
+        if not node_is_down(self.server.server_address[0]):
+            with contextlib.suppress(OSError):
+                self.request.sendall(b"SSH-2.0-OpenSSH_bench\r\n")
+
+class BannerListeners():
+    """SSH banner listeners for the simulated nodes (all on the same port)"""
+
+    def __init__(self, count):
+        self.servers = []
+        for attempt in range(10):
+            try:
+                self.port = 0
+                for i in range(count):
+                    server = socketserver.ThreadingTCPServer((str(NODE_BASE_ADDRESS + i), self.port), BannerHandler)
+                    server.daemon_threads = True
+                    self.port = server.server_address[1]
+                    self.servers.append(server)
+                break
+            except OSError:
+                # The port picked for the first node is taken on another address
+                for server in self.servers:
+                    server.server_close()
+                self.servers = []
+                if attempt == 9:
+                    raise
+
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, name=f"banner-{server.server_address[0]}", daemon=True).start()
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+        self.servers = []
+
+#
+# Scenarios
+#
+
+def load_agent_control(state_dir, port):
+    """Import agent-control.py and point its SSH transport to the shim"""
+    spec = importlib.util.spec_from_file_location("agent_control", os.path.abspath(AGENT_CONTROL))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    shim = [sys.executable, os.path.abspath(__file__), "shim"]
+
+    # pylint: disable=W0613
+    class BenchTransport(module.SSHTransport):
+        """SSH transport running the shim instead of ssh/scp/rsync"""
+        def __init__(self, host, user="root", _port=None):
+            super().__init__(host, user, port)
+
+        def ssh_command(self, command, tty=True):
+            return [*shim, "ssh", self.host, command]
+
+        def scp_command(self, source, target):
+            return [*shim, "scp", source, target]
+
+        def rsync_command(self, source, target, delete=False):
+            return [*shim, "rsync", source, target]
+
+        def close(self):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(os.path.join(state_dir, "nodes", f"{self.host}.master"))
+
+    module.SSHTransport = BenchTransport
+    return module
+
+def external_time(intervals, start, end):
+    """Get the total length of the union of given intervals clipped to [start, end]"""
+    clipped = sorted((max(s, start), min(e, end)) for s, e in intervals if e > start and s < end)
+    total = 0
+    current_start, current_end = None, None
+    for s, e in clipped:
+        if current_end is None or s > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = s, e
+        else:
+            current_end = max(current_end, e)
+
+    if current_end is not None:
+        total += current_end - current_start
+
+    return total
+
+def analyze_trace(trace_file, origin, events, wall):
+    """Compute the overhead of each span from the execution trace
+
+    Returns:
+    --------
+    Dict with the overall and per-span (aggregated by name) times
+    """
+    intervals = [(e["start"] - origin, e["end"] - origin) for e in events]
+    phases = {}
+    with open(trace_file, encoding="utf-8") as f:
+        for event in json.load(f)["traceEvents"]:
+            if event["ph"] != "X":
+                continue
+
+            start = event["ts"] / 1e6
+            end = start + event["dur"] / 1e6
+            external = external_time(intervals, start, end)
+            phase = phases.setdefault(event["name"], {"count": 0, "total": 0, "external": 0, "overhead": 0})
+            phase["count"] += 1
+            phase["total"] += end - start
+            phase["external"] += external
+            phase["overhead"] += end - start - external
+
+    external = external_time(intervals, 0, wall[1])
+    return {
+        "total"    : wall[1] - wall[0],
+        "external" : external,
+        "overhead" : wall[1] - wall[0] - external,
+        "phases"   : phases,
+    }
+
+@contextlib.contextmanager
+def redirect_output(path):
+    """Redirect stdout & stderr (including the ones of child processes) into a file"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = (os.dup(1), os.dup(2))
+    with open(path, "ab") as f:
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        os.close(saved[0])
+        os.close(saved[1])
+
+def run_scenario(name, workdir):
+    """Run a single scenario
+
+    Returns:
+    --------
+    Dict with the results (see analyze_trace()) or None if the scenario failed
+    """
+    scenario = SCENARIOS[name]
+    config = merge_config(DEFAULT_CONFIG, scenario["config"])
+    state_dir = os.path.join(workdir, "state")
+    os.makedirs(os.path.join(state_dir, "nodes"))
+    with open(os.path.join(state_dir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f)
+
+    args = scenario["args"] if "--pool" in scenario["args"] else ["--pool", "bench-pool", *scenario["args"]]
+    shards = int(args[args.index("--shards") + 1]) if "--shards" in args else 1
+    duffy = FakeDuffy(config["duffy"])
+    # Each allocation (including retries) may get new nodes, so have a few spare ones
+    listeners = BannerListeners(shards * 4)
+    journal = os.path.join(workdir, "journal")
+    env = {
+        STATE_ENV               : state_dir,
+        "CICO_API_URL"          : duffy.url,
+        "CICO_API_KEY"          : "bench",
+        "AGENT_CONTROL_JOURNAL" : journal,
+    }
+    saved_env = {k: os.environ.get(k) for k in env}
+    saved_argv = sys.argv
+    saved_cwd = os.getcwd()
+    saved_handlers = {s: signal.getsignal(s) for s in [signal.SIGTERM, signal.SIGHUP, signal.SIGINT, signal.SIGALRM]}
+    result = None
+
+    try:
+        os.environ.update(env)
+        duffy.start()
+        module = load_agent_control(state_dir, listeners.port)
+        tracer = module.TRACER = module.Tracer()
+        # The agent-control's main() stores the artifacts into the current directory
+        os.chdir(workdir)
+        sys.argv = ["agent-control.py", *args]
+        log(f"Running scenario {name}: agent-control.py {' '.join(args)}")
+
+        with redirect_output(os.path.join(workdir, "agent-control.log")):
+            # pylint: disable=W0212
+            start = time.perf_counter() - tracer._origin
+            rc = module.main()
+            end = time.perf_counter() - tracer._origin
+            # Retiring the session is detached from the job (see free_session()),
+            # but it's still a cost, so measure it separately
+            cleanup_start = time.perf_counter()
+            while os.path.isdir(journal) and any(f.endswith(".json") for f in os.listdir(journal)) \
+                  and time.perf_counter() - cleanup_start < 60:
+                time.sleep(0.1)
+            cleanup = time.perf_counter() - cleanup_start
+
+        if rc != 0:
+            log(f"Scenario {name} failed with EC {rc}, see {workdir}/agent-control.log")
+            return None
+
+        events = []
+        with contextlib.suppress(FileNotFoundError):
+            with open(os.path.join(state_dir, "events.jsonl"), encoding="utf-8") as f:
+                events = [json.loads(line) for line in f]
+
+        trace_file = next(os.path.join(workdir, d, "trace.json") for d in os.listdir(workdir) if d.startswith("artifacts_"))
+        # pylint: disable=W0212
+        result = analyze_trace(trace_file, tracer._origin, events, (start, end))
+        result["cleanup"] = cleanup
+        result["leaked_sessions"] = len(duffy.active_sessions())
+    finally:
+        signal.alarm(0)
+        for s, handler in saved_handlers.items():
+            signal.signal(s, handler)
+        os.chdir(saved_cwd)
+        sys.argv = saved_argv
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        listeners.stop()
+        duffy.stop()
+
+    return result
+
+def median_results(runs):
+    """Merge results of repeated runs of a scenario (using the median of each value)"""
+    result = {key: statistics.median(r[key] for r in runs) for key in ["total", "external", "overhead", "cleanup", "leaked_sessions"]}
+    result["phases"] = {}
+    for name in {n for r in runs for n in r["phases"]}:
+        samples = [r["phases"][name] for r in runs if name in r["phases"]]
+        result["phases"][name] = {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+    return result
+
+def report(results, baseline, threshold):
+    """Print the results (compared with the baseline, if any)
+
+    Returns:
+    --------
+    List of regressions (as strings)
+    """
+    regressions = []
+
+    def compare(scenario, name, value, base):
+        if base is None:
+            return ""
+        diff = value - base
+        if diff >= REGRESSION_MIN_DIFF and diff > base * threshold / 100:
+            regressions.append(f"{scenario}: {name}: overhead {base:.2f}s -> {value:.2f}s")
+            return f" {diff:+.2f}s REGRESSION"
+        return f" {diff:+.2f}s"
+
+    for scenario, result in results.items():
+        base = baseline.get(scenario) or {}
+        print(f"Scenario {scenario}: {SCENARIOS[scenario]['help']}")
+        if result is None:
+            print("    FAILED")
+            regressions.append(f"{scenario}: scenario failed")
+            continue
+
+        print(f"    Total {result['total']:.2f}s, external (remote work & reboots) {result['external']:.2f}s, "
+              f"overhead {result['overhead']:.2f}s{compare(scenario, 'total', result['overhead'], base.get('overhead'))}")
+        print(f"    Session cleanup (detached) {result['cleanup']:.2f}s, leaked sessions: {result['leaked_sessions']}")
+        if result["leaked_sessions"]:
+            regressions.append(f"{scenario}: {result['leaked_sessions']} leaked session(s)")
+
+        width = max(len(name) for name in result["phases"])
+        print(f"    {'Span':<{width}} {'Count':>6} {'Total [s]':>10} {'Extern [s]':>10} {'Overhead [s]':>12}")
+        for name, phase in sorted(result["phases"].items(), key=lambda p: p[1]["overhead"], reverse=True):
+            base_phase = base.get("phases", {}).get(name, {}).get("overhead")
+            print(f"    {name:<{width}} {phase['count']:>6.0f} {phase['total']:>10.2f} {phase['external']:>10.2f} "
+                  f"{phase['overhead']:>12.2f}{compare(scenario, name, phase['overhead'], base_phase)}")
+        print()
+
+    return regressions
+
+def cmd_run(args):
+    scenarios = args.scenario or list(SCENARIOS)
+    results = {}
+    for name in scenarios:
+        runs = []
+        for i in range(args.repeat):
+            workdir = tempfile.mkdtemp(prefix=f"agent-control-bench-{name}-{i}-")
+            runs.append(run_scenario(name, workdir))
+            if runs[-1] is not None and not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        results[name] = median_results(runs) if all(runs) else None
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    regressions = report(results, baseline, args.threshold)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    for regression in regressions:
+        log(f"REGRESSION: {regression}")
+
+    return 1 if regressions else 0
+
+def cmd_list(_args):
+    for name, scenario in SCENARIOS.items():
+        print(f"{name:<20} {scenario['help']}")
+
+    return 0
+
+def cmd_duffy(args):
+    config = merge_config(DEFAULT_CONFIG["duffy"], json.loads(args.config))
+    duffy = FakeDuffy(config)
+    duffy.server.server_close()
+    duffy.server = ThreadingHTTPServer(("127.0.0.1", args.port), duffy.server.RequestHandlerClass)
+    log(f"Serving the stand-in Duffy API at http://127.0.0.1:{duffy.server.server_address[1]}/api/v1")
+    with contextlib.suppress(KeyboardInterrupt):
+        duffy.server.serve_forever()
+
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the orchestration overhead of agent-control.py")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Run benchmark scenarios")
+    run.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="Scenario to run (can be used multiple times, default: all)")
+    run.add_argument("--repeat", type=int, default=1, help="Run each scenario N times and report the median (default: %(default)s)")
+    run.add_argument("--save", metavar="FILE", help="Save the results into given file (to be used as a baseline)")
+    run.add_argument("--baseline", metavar="FILE", help="Compare the results with a previously saved run")
+    run.add_argument("--threshold", metavar="PCT", type=float, default=20, help="Max allowed overhead growth against the baseline in percent (default: %(default)s)")
+    run.add_argument("--keep", action="store_true", help="Keep the working directories of all runs (failed runs are always kept)")
+    run.set_defaults(func=cmd_run)
+
+    list_parser = subparsers.add_parser("list", help="List available scenarios")
+    list_parser.set_defaults(func=cmd_list)
+
+    duffy = subparsers.add_parser("duffy", help="Run only the stand-in Duffy API")
+    duffy.add_argument("--port", type=int, default=8080, help="Port to listen on (default: %(default)s)")
+    duffy.add_argument("--config", default="{}", help="Overrides of the Duffy configuration as JSON (see DEFAULT_CONFIG)")
+    duffy.set_defaults(func=cmd_duffy)
+
+    # Internal command used by the patched SSH transport (see load_agent_control())
+    shim = subparsers.add_parser("shim")
+    shim.add_argument("tool", choices=["ssh", "scp", "rsync"])
+    shim.add_argument("arguments", nargs=2)
+    shim.set_defaults(func=cmd_shim)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# pylint: disable=line-too-long,invalid-name,missing-function-docstring,too-many-locals
+"""Sample resource usage of the node and correlate it with the task timeline
+
+The sampler periodically records CPU usage, memory usage, disk I/O, and pressure
+stall information (PSI) into a CSV file. The report then overlays the samples
+with start & end times of the tasks (the [TASK START] and [TASK END] markers in
+the task logs created by common/task-control.sh), showing when the node was
+saturated and which tasks were running at that time.
+
+Usage:
+    node-telemetry.py sample [--interval SECONDS] OUTPUT
+        Append samples to the OUTPUT CSV file until terminated
+
+    node-telemetry.py report [--samples FILE] LOGDIR
+        Write a text report (telemetry-report.txt) and a timeline chart
+        (telemetry.svg) into LOGDIR
+"""
+
+import argparse
+import csv
+import html
+import itertools
+import os
+import signal
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+from task_common import LOG_NAME_RX, read_log_ends, task_span
+
+COLUMNS = ["time", "cpu", "iowait", "memory", "swap_mb", "read_mbps", "write_mbps", "disk_util",
+           "psi_cpu", "psi_io", "psi_io_full", "psi_memory", "psi_memory_full", "load1", "running"]
+# Thresholds of the "some" PSI metrics (in %) considered as saturation, keep in sync
+# with TASK_PSI_*_MAX in common/task-control.sh
+SATURATION = {"psi_cpu": 50, "psi_io": 20, "psi_memory": 10}
+
+
+def read_cpu():
+    with open("/proc/stat", encoding="utf-8") as f:
+        # cpu user nice system idle iowait irq softirq steal ...
+        values = [int(v) for v in f.readline().split()[1:9]]
+
+    return sum(values), values[3], values[4]
+
+def read_memory():
+    meminfo = {}
+    with open("/proc/meminfo", encoding="utf-8") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            meminfo[key] = int(value.split()[0])
+
+    used = 100 * (meminfo["MemTotal"] - meminfo["MemAvailable"]) / meminfo["MemTotal"]
+    swap = (meminfo["SwapTotal"] - meminfo["SwapFree"]) / 1024
+
+    return used, swap
+
+def read_disks():
+    """Get sectors read & written (summed over all physical disks) and time spent doing I/O by each disk"""
+    read = written = 0
+    busy = {}
+    with open("/proc/diskstats", encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            # Skip partitions and virtual devices
+            if not os.path.exists(f"/sys/block/{fields[2]}/device"):
+                continue
+
+            read += int(fields[5])
+            written += int(fields[9])
+            busy[fields[2]] = int(fields[12])
+
+    return read, written, busy
+
+def read_psi():
+    """Get the total stall times (in us) of all PSI resources"""
+    totals = {}
+    for resource in ["cpu", "io", "memory"]:
+        try:
+            with open(f"/proc/pressure/{resource}", encoding="utf-8") as f:
+                for line in f:
+                    kind, *_, total = line.split()
+                    totals[f"{resource}_{kind}"] = int(total.split("=")[1])
+        except OSError:
+            pass
+
+    return totals
+
+def read_load():
+    with open("/proc/loadavg", encoding="utf-8") as f:
+        load1, _, _, running, _ = f.read().split()
+
+    # Don't count the sampler itself
+    return float(load1), int(running.split("/")[0]) - 1
+
+def cmd_sample(args):
+    # Terminate gracefully, so the last line is not cut in half
+    stop = []
+    signal.signal(signal.SIGTERM, lambda *_: stop.append(True))
+    signal.signal(signal.SIGINT, lambda *_: stop.append(True))
+
+    new_file = not os.path.exists(args.output)
+    with open(args.output, "a", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(COLUMNS)
+
+        prev = (time.monotonic(), read_cpu(), read_disks(), read_psi())
+        while not stop:
+            time.sleep(args.interval)
+            now = (time.monotonic(), read_cpu(), read_disks(), read_psi())
+            elapsed = now[0] - prev[0]
+            (total, idle, iowait), (ptotal, pidle, piowait) = now[1], prev[1]
+            cpu_delta = max(total - ptotal, 1)
+            psi = {k: min(100, (v - prev[3].get(k, v)) / elapsed / 10 ** 4) for k, v in now[3].items()}
+            memory, swap = read_memory()
+            load1, running = read_load()
+
+            writer.writerow([
+                f"{time.time():.1f}",
+                f"{100 * (cpu_delta - (idle - pidle) - (iowait - piowait)) / cpu_delta:.1f}",
+                f"{100 * (iowait - piowait) / cpu_delta:.1f}",
+                f"{memory:.1f}",
+                f"{swap:.0f}",
+                # Sectors are always 512 bytes in /proc/diskstats
+                f"{(now[2][0] - prev[2][0]) * 512 / elapsed / 2 ** 20:.1f}",
+                f"{(now[2][1] - prev[2][1]) * 512 / elapsed / 2 ** 20:.1f}",
+                # Utilization of the busiest disk
+                f"{min(100, max(((v - prev[2][2].get(k, v)) / elapsed / 10 for k, v in now[2][2].items()), default=0)):.1f}",
+                *(f"{psi.get(k, 0):.1f}" for k in ["cpu_some", "io_some", "io_full", "memory_some", "memory_full"]),
+                f"{load1:.2f}",
+                running,
+            ])
+            f.flush()
+            prev = now
+
+    return 0
+
+def load_samples(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return [{k: float(v) for k, v in row.items()} for row in csv.DictReader(f)]
+
+def load_tasks(logdir):
+    """Get start & end times (as timestamps) of all tasks from their logs
+
+    Retries of the same task are reported separately.
+    """
+    tasks = []
+    for entry in os.scandir(logdir):
+        match = LOG_NAME_RX.match(entry.name)
+        if not match or not entry.is_file():
+            continue
+
+        span = task_span(*read_log_ends(entry.path))
+        if not span:
+            continue
+
+        start, end = (d.timestamp() for d in span)
+        name = match.group("name") + (f" [try {match.group('try')}]" if match.group("try") else "")
+        tasks.append({"name": name, "start": start, "end": end, "result": match.group("result")})
+
+    return sorted(tasks, key=lambda t: t["start"])
+
+def saturation_episodes(samples):
+    """Find continuous intervals where any of the PSI metrics exceeded its threshold"""
+    episodes = []
+    for saturated, group in itertools.groupby(samples, key=lambda s: any(s[k] >= v for k, v in SATURATION.items())):
+        group = list(group)
+        if saturated:
+            episodes.append(group)
+
+    return episodes
+
+def running_tasks(tasks, start, end):
+    return [t["name"] for t in tasks if t["start"] <= end and t["end"] >= start]
+
+def write_svg(path, samples, tasks):
+    width, chart_height, row_height, margin = 1200, 200, 14, 10
+    start = min([samples[0]["time"]] + [t["start"] for t in tasks])
+    end = max([samples[-1]["time"]] + [t["end"] for t in tasks])
+    scale = (width - 2 * margin) / max(end - start, 1)
+    height = chart_height + len(tasks) * row_height + 3 * margin
+
+    def x(ts):
+        return margin + (ts - start) * scale
+
+    def y(value):
+        return margin + chart_height * (1 - value / 100)
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="10">',
+           f'<rect x="{margin}" y="{margin}" width="{width - 2 * margin}" height="{chart_height}" fill="none" stroke="#ccc"/>']
+    for key, color in [("cpu", "#1f77b4"), ("psi_io", "#d62728"), ("psi_memory", "#ff7f0e"), ("psi_cpu", "#9467bd")]:
+        points = " ".join(f"{x(s['time']):.1f},{y(s[key]):.1f}" for s in samples)
+        out.append(f'<polyline points="{points}" fill="none" stroke="{color}" stroke-width="1"><title>{key}</title></polyline>')
+    out.append(f'<text x="{margin + 4}" y="{margin + 12}">CPU % (blue), PSI cpu (purple), io (red), memory (orange) - some %</text>')
+
+    for i, task in enumerate(tasks):
+        top = chart_height + 2 * margin + i * row_height
+        color = "#2ca02c" if task["result"] == "PASS" else "#d62728"
+        out.append(f'<rect x="{x(task["start"]):.1f}" y="{top}" width="{max(1, (task["end"] - task["start"]) * scale):.1f}" '
+                   f'height="{row_height - 2}" fill="{color}" fill-opacity="0.6">'
+                   f'<title>{html.escape(task["name"])} ({task["end"] - task["start"]:.0f} s)</title></rect>')
+        out.append(f'<text x="{x(task["start"]) + 2:.1f}" y="{top + row_height - 4}">{html.escape(task["name"])}</text>')
+
+    out.append("</svg>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(out) + "\n")
+
+def cmd_report(args):
+    samples_file = args.samples or os.path.join(args.logdir, "telemetry.csv")
+    samples = load_samples(samples_file)
+    tasks = load_tasks(args.logdir)
+    if not samples:
+        print(f"No samples in {samples_file}", file=sys.stderr)
+        return 1
+
+    report = [f"Samples: {len(samples)} ({samples_file}), tasks: {len(tasks)}", ""]
+    for key in COLUMNS[1:]:
+        values = [s[key] for s in samples]
+        report.append(f"{key:<16} avg {sum(values) / len(values):8.1f}  max {max(values):8.1f}")
+
+    report += ["", f"{'Task':<48} {'Duration':>9} {'CPU avg':>8} {'PSI cpu':>8} {'PSI io':>8} {'PSI mem':>8} {'Peers':>6}"]
+    for task in tasks:
+        window = [s for s in samples if task["start"] <= s["time"] <= task["end"]]
+        peers = len(running_tasks(tasks, task["start"], task["end"])) - 1
+        if window:
+            stats = [sum(s["cpu"] for s in window) / len(window)] + [max(s[k] for s in window) for k in ["psi_cpu", "psi_io", "psi_memory"]]
+            stats = " ".join(f"{v:8.1f}" for v in stats)
+        else:
+            stats = " ".join(f"{'-':>8}" for _ in range(4))
+        report.append(f"{task['name'][:48]:<48} {task['end'] - task['start']:8.0f}s {stats} {peers:6d}  {task['result']}")
+
+    episodes = saturation_episodes(samples)
+    combinations = Counter()
+    report += ["", f"Saturation episodes (thresholds: {', '.join(f'{k} >= {v}%' for k, v in SATURATION.items())}): {len(episodes)}"]
+    for episode in episodes:
+        start, end = episode[0]["time"], episode[-1]["time"]
+        running = running_tasks(tasks, start, end)
+        combinations.update(itertools.combinations(sorted(running), 2))
+        peak = {k: max(s[k] for s in episode) for k in SATURATION}
+        report.append(f"{datetime.fromtimestamp(start).isoformat(timespec='seconds')} +{end - start:.0f}s "
+                      f"(peak {', '.join(f'{k} {v:.0f}%' for k, v in peak.items())}): {', '.join(running) or '-'}")
+
+    if combinations:
+        report += ["", "Task pairs running together most often during saturation:"]
+        report += [f"{count:4d}x {a} + {b}" for (a, b), count in combinations.most_common(10)]
+
+    with open(os.path.join(args.logdir, "telemetry-report.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(report) + "\n")
+    write_svg(os.path.join(args.logdir, "telemetry.svg"), samples, tasks)
+
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Sample resource usage of the node and correlate it with the task timeline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sample = subparsers.add_parser("sample", help="Record resource usage samples until terminated")
+    sample.add_argument("--interval", type=float, default=5, help="Sampling interval in seconds (default: %(default)s)")
+    sample.add_argument("output", help="Output CSV file")
+    sample.set_defaults(func=cmd_sample)
+
+    report = subparsers.add_parser("report", help="Overlay the samples with the task timeline")
+    report.add_argument("--samples", help="CSV file with samples (default: LOGDIR/telemetry.csv)")
+    report.add_argument("logdir", help="Directory with task logs")
+    report.set_defaults(func=cmd_report)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
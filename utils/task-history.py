@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# pylint: disable=line-too-long,invalid-name,missing-function-docstring
+"""Keep track of task runtimes and use them to schedule tasks
+
+The durations of individual tasks are extracted from the task logs created by
+common/task-control.sh (from the /bin/time -v output or from the [TASK START]
+and [TASK END] markers) and folded into a persistent history store (a simple
+JSON file). The history is then used to order the task queue using the
+longest-processing-time-first (LPT) rule, which minimizes the time the last
+long-running task spends running alone after all other slots go idle.
+
+Usage:
+    task-history.py durations LOGDIR
+        Print durations of all integration tests from LOGDIR (as "name<TAB>seconds"
+        lines). Only the last try of retried tests is considered.
+
+    task-history.py update [--flaky FLAKY_TASKS_FILE]... HISTORY_FILE DURATIONS_FILE...
+        Merge the durations from given files into the history store, together
+        with the number of retries of each task caused by known flaky failures
+        (the .flaky_tasks files created by common/task-control.sh)
+
+    task-history.py order HISTORY_FILE TASK...
+        Print given tasks ordered from the longest one to the shortest one.
+        Tasks without history are kept at the front in their original order,
+        so the order stays unchanged when there's no history at all.
+"""
+
+import argparse
+import os
+import re
+import sys
+from datetime import datetime
+
+from task_common import LOG_NAME_RX, TEST_NAME_RX, load_history, read_log_ends, save_history, task_span
+
+# Weight of the most recent duration when updating the moving average
+EWMA_WEIGHT = 0.3
+# Elapsed (wall clock) time (h:mm:ss or m:ss): 1:02:03 (or 12:34.56)
+TIME_ELAPSED_RX = re.compile(r"Elapsed \(wall clock\) time \(h:mm:ss or m:ss\): (?P<value>[0-9:.]+)")
+
+
+def parse_elapsed(value):
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+
+    return seconds
+
+def log_duration(path):
+    """Extract the task duration (in seconds) from a task log
+
+    Prefer the /bin/time -v output, since it measures only the task command
+    itself, and fall back to the [TASK START]/[TASK END] markers.
+
+    Returns:
+    --------
+    Duration in seconds or None if it couldn't be determined
+    """
+    head, tail = read_log_ends(path)
+
+    elapsed = TIME_ELAPSED_RX.findall(tail)
+    if elapsed:
+        return parse_elapsed(elapsed[-1])
+
+    span = task_span(head, tail)
+    if span:
+        return (span[1] - span[0]).total_seconds()
+
+    return None
+
+def cmd_durations(args):
+    # Keep only the last try of each test (TEST-01-BASIC_1_FAIL.log, TEST-01-BASIC_2_PASS.log, ...),
+    # so retried tests are not folded into the history once per try
+    logs = {}
+    for entry in os.scandir(args.logdir):
+        match = LOG_NAME_RX.match(entry.name)
+        if not match or not entry.is_file() or not TEST_NAME_RX.match(match.group("name")):
+            continue
+
+        name, attempt = match.group("name"), int(match.group("try") or 0)
+        if name not in logs or attempt > logs[name][0]:
+            logs[name] = (attempt, entry.path)
+
+    for name, (_, path) in sorted(logs.items()):
+        duration = log_duration(path)
+        if duration is not None:
+            print(f"{name}\t{duration:.1f}")
+
+    return 0
+
+def cmd_update(args):
+    history = load_history(args.history)
+    history.setdefault("tasks", {})
+    now = datetime.now().isoformat(timespec="seconds")
+
+    for path in args.durations:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    name, duration = line.rstrip("\n").split("\t")
+                    duration = float(duration)
+                except ValueError:
+                    continue
+
+                task = history["tasks"].setdefault(name, {"duration": duration, "runs": 0})
+                task["duration"] = round(EWMA_WEIGHT * duration + (1 - EWMA_WEIGHT) * task["duration"], 1)
+                task["runs"] += 1
+                task["updated"] = now
+
+    flakes = history.setdefault("flakes", {})
+    for path in args.flaky:
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            continue
+
+        for line in lines:
+            try:
+                name, signature = line.rstrip("\n").split("\t")
+            except ValueError:
+                continue
+
+            task = flakes.setdefault(name, {"signatures": {}})
+            task["signatures"][signature] = task["signatures"].get(signature, 0) + 1
+            task["updated"] = now
+
+    save_history(args.history, history)
+    return 0
+
+def cmd_order(args):
+    tasks = load_history(args.history).get("tasks", {})
+    unknown = [t for t in args.tasks if os.path.basename(t) not in tasks]
+    known = [t for t in args.tasks if os.path.basename(t) in tasks]
+    # sorted() is stable, so tasks with the same duration keep their original order
+    known = sorted(known, key=lambda t: tasks[os.path.basename(t)]["duration"], reverse=True)
+
+    for t in unknown + known:
+        print(t)
+
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep track of task runtimes and use them to schedule tasks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    durations = subparsers.add_parser("durations", help="Print durations of tasks from given log directory")
+    durations.add_argument("logdir", help="Directory with task logs")
+    durations.set_defaults(func=cmd_durations)
+
+    update = subparsers.add_parser("update", help="Merge task durations into the history store")
+    update.add_argument("history", help="History store (JSON)")
+    update.add_argument("durations", nargs="+", help="File(s) created by the 'durations' command")
+    update.add_argument("--flaky", action="append", default=[], help="Tasks retried because of a known flaky failure (.flaky_tasks)")
+    update.set_defaults(func=cmd_update)
+
+    order = subparsers.add_parser("order", help="Order tasks from the longest one to the shortest one")
+    order.add_argument("history", help="History store (JSON)")
+    order.add_argument("tasks", nargs="*", help="Tasks (or paths to tests) to order")
+    order.set_defaults(func=cmd_order)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# pylint: disable=line-too-long,missing-function-docstring
+"""Helpers shared by the utility scripts processing the task logs & history
+
+Task logs are the logs created by common/task-control.sh, named after the task
+with the result suffix (and the retry index, if any) and containing the
+[TASK START] and [TASK END] markers on the first and (one of) the last lines.
+The task history store is a single JSON file shared by several scripts
+(see utils/task-history.py and utils/test-impact.py), each of them keeping
+its data under its own top-level key.
+"""
+
+import json
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime
+
+# TEST-01-BASIC_PASS.log, TEST-01-BASIC_1_FAIL.log, ...
+LOG_NAME_RX = re.compile(r"^(?P<name>.+?)(?:_(?P<try>[0-9]+))?_(?P<result>PASS|FAIL)\.log$")
+# Integration tests (TEST-01-BASIC, ...), but not the helper tasks derived from
+# their names (TEST-01-BASIC_coredumpctl_collect, ...)
+TEST_NAME_RX = re.compile(r"^TEST-(?P<number>[0-9]+)-(?P<name>[^_]+)$")
+TASK_START_RX = re.compile(r"^\[TASK START\] (?P<date>.+)$", re.MULTILINE)
+TASK_END_RX = re.compile(r"^\[TASK END\] (?P<date>.+)$", re.MULTILINE)
+# Size of the log tail we look for the task markers (and other trailing output) in
+LOG_TAIL_SIZE = 64 * 1024
+
+
+def parse_date(value):
+    try:
+        return datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+
+def read_log_ends(path):
+    """Read the first line and the tail (see LOG_TAIL_SIZE) of a task log
+
+    Returns:
+    --------
+    Tuple with the head and the tail of the log
+    """
+    with open(path, "rb") as f:
+        head = f.readline().decode(errors="replace")
+        f.seek(max(0, os.fstat(f.fileno()).st_size - LOG_TAIL_SIZE))
+        tail = f.read().decode(errors="replace")
+
+    return head, tail
+
+def task_span(head, tail):
+    """Get the task start & end times from the [TASK START] and [TASK END] markers
+
+    Params:
+    -------
+    head: first line of the task log
+    tail: tail of the task log
+
+    Returns:
+    --------
+    Tuple with the start & end times (as datetime objects) or None if they
+    couldn't be determined
+    """
+    start = TASK_START_RX.search(head)
+    end = TASK_END_RX.findall(tail)
+    if not start or not end:
+        return None
+
+    start, end = parse_date(start.group("date")), parse_date(end[-1])
+    if not start or not end or start.tzinfo != end.tzinfo:
+        return None
+
+    return start, end
+
+def load_history(path):
+    """Load the task history store
+
+    Returns:
+    --------
+    Dictionary with the history, empty if the store doesn't exist (yet)
+    or is unreadable
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Failed to load task history from {path} ({e}), starting from scratch", file=sys.stderr)
+        return {}
+
+def save_history(path, history):
+    # Write the file atomically, so we don't end up with a corrupted history
+    # if we get interrupted
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, encoding="utf-8") as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+
+    os.replace(f.name, path)
+
+def read_lines(path):
+    """Get non-empty (stripped) lines of a file, or an empty list if it doesn't exist"""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# pylint: disable=line-too-long,invalid-name,missing-function-docstring,too-many-locals
+"""Map changed files to the integration tests they likely affect
+
+Each test gets a score based on:
+    - rules from a maintained mapping (see test-impact.map next to this script)
+      which map path regexes to test name globs
+    - changes to the test itself (its directory or its test/units/ scripts)
+    - changed directories matching the test name (e.g. src/udev/ -> TEST-17-UDEV)
+    - correlation of the test failures with the changed directories in previous
+      runs (stored in the task history store, see utils/task-history.py)
+
+Changes to the "core" components (see GLOBAL_RX) may affect any test, so no test
+is considered unrelated in such case.
+
+Usage:
+    test-impact.py order HISTORY_FILE CHANGED_FILES [--skip-unrelated] [--report FILE] TEST...
+        Print given tests ordered by their score (the most likely affected ones
+        first). The order of tests with the same score is kept, so the order stays
+        unchanged when there are no (relevant) changes. Explanation of the scores
+        is written into the report file (if any).
+
+    test-impact.py record HISTORY_FILE LOGDIR...
+        Record the changed files (.changed_files) and the results of tests from
+        given task-control log directories (.passed_tasks & .failed_tasks) into
+        the history store
+"""
+
+import argparse
+import fnmatch
+import os
+import re
+import sys
+from datetime import datetime
+
+from task_common import TEST_NAME_RX, load_history, read_lines, save_history
+
+DEFAULT_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-impact.map")
+# Changes in these paths can affect any test
+GLOBAL_RX = re.compile(r"^(src/(basic|core|fundamental|libsystemd|shared|systemd)/|meson[._]|test/(test-functions|TEST-01-BASIC/|units/util\.sh)|tools/)")
+# Changes in these paths don't affect any test
+IGNORE_RX = re.compile(r"^(man/|docs/|\.github/|\.[^/]+$|[^/]+\.md$|po/|NEWS$|TODO$)")
+# Path components too generic to be matched against test names
+GENERIC_COMPONENTS = {"src", "test", "units", "shared", "basic", "libsystemd", "tools", "rules.d", "test-data"}
+# Ignore runs changing more directories than this, since the correlation would be
+# mostly noise (tree-wide changes, large refactorings, ...)
+RECORD_MAX_DIRS = 20
+# Minimal number of recorded runs touching a directory to consider its failure correlation
+CORRELATION_MIN_RUNS = 3
+# Consider a test correlated with a directory only if it fails this many times more
+# often when the directory is changed than in all runs, so (generally) flaky tests
+# don't get correlated with everything
+CORRELATION_MIN_LIFT = 2
+# Key of the entry tracking all recorded runs
+ALL_RUNS = "*"
+
+SCORE_RULE = 10
+SCORE_SELF = 10
+SCORE_NAME = 5
+SCORE_CORRELATION = 10
+SCORE_GLOBAL = 1
+
+
+def changed_dir(path):
+    """Get the directory a changed file is accounted to (at most two levels deep)"""
+    return "/".join(path.split("/")[:2]) if "/" in path else path
+
+def load_map(path):
+    """Load the path -> test mapping
+
+    Each non-empty line (except comments) consists of a path regex followed by
+    one or more (whitespace-separated) test name globs.
+    """
+    rules = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].split()
+            if len(line) >= 2:
+                rules.append((re.compile(line[0]), line[1:]))
+
+    return rules
+
+def name_keywords(test):
+    """Get keywords usable for matching paths from a test name
+
+    TEST-64-UDEV-STORAGE -> {"udev", "storage"}
+    """
+    match = TEST_NAME_RX.match(test)
+    name = match.group("name") if match else test
+    return {k for k in re.split(r"[-_.]", name.lower()) if len(k) >= 4}
+
+def keyword_matches(keyword, component):
+    # Allow simple prefix matches, so src/resolve matches TEST-75-RESOLVED and
+    # src/home matches TEST-46-HOMED
+    return len(component) >= 4 and component not in GENERIC_COMPONENTS and \
+           (component.startswith(keyword) or keyword.startswith(component))
+
+def own_path(test, path):
+    """Check if the changed path belongs to the test itself"""
+    if path.startswith(f"test/{test}/"):
+        return True
+
+    match = TEST_NAME_RX.match(test)
+    if not match:
+        return False
+
+    # Test scripts & units live in test/units/ (named either testsuite-NN.* or TEST-NN-NAME.*)
+    number = match.group("number")
+    return re.match(rf"^test/units/(testsuite-{number}|TEST-{number}-[^.]+)[.-]", path) is not None
+
+def score_test(test, changed, rules, correlation):
+    """Score a test against the changed files
+
+    Returns:
+    --------
+    Tuple of the score and a list of reasons explaining it
+    """
+    score = 0
+    reasons = []
+
+    for path in changed:
+        if own_path(test, path):
+            score += SCORE_SELF
+            reasons.append(f"test itself changed ({path})")
+            break
+
+    for rx, globs in rules:
+        if not any(fnmatch.fnmatchcase(test, g) for g in globs):
+            continue
+
+        hits = [p for p in changed if rx.search(p)]
+        if hits:
+            score += SCORE_RULE
+            reasons.append(f"mapping rule '{rx.pattern}' matches {hits[0]}" + (f" (+{len(hits) - 1} more)" if len(hits) > 1 else ""))
+
+    keywords = name_keywords(test)
+    for directory in sorted({changed_dir(p) for p in changed}):
+        components = directory.lower().split("/")
+        if any(keyword_matches(k, c) for k in keywords for c in components):
+            score += SCORE_NAME
+            reasons.append(f"test name matches changed directory {directory}")
+
+    for directory, (failures, runs) in sorted(correlation.items()):
+        score += round(SCORE_CORRELATION * failures / runs)
+        reasons.append(f"failed in {failures} out of {runs} previous run(s) changing {directory}")
+
+    return score, reasons
+
+def cmd_order(args):
+    changed = [p for p in read_lines(args.changed) if not IGNORE_RX.search(p)]
+    rules = load_map(args.map)
+    impact = load_history(args.history).get("impact", {})
+    global_changes = sorted({changed_dir(p) for p in changed if GLOBAL_RX.search(p)})
+    changed_dirs = {changed_dir(p) for p in changed}
+    all_runs = impact.get(ALL_RUNS, {"runs": 0, "failures": {}})
+
+    scored = []
+    for test in args.tests:
+        name = os.path.basename(test)
+        base_rate = all_runs["failures"].get(name, 0) / all_runs["runs"] if all_runs["runs"] else 0
+        correlation = {}
+        for directory in changed_dirs:
+            entry = impact.get(directory)
+            if not entry or entry["runs"] < CORRELATION_MIN_RUNS or entry["failures"].get(name, 0) == 0:
+                continue
+
+            if entry["failures"][name] / entry["runs"] >= CORRELATION_MIN_LIFT * base_rate:
+                correlation[directory] = (entry["failures"][name], entry["runs"])
+
+        score, reasons = score_test(name, changed, rules, correlation)
+        if global_changes:
+            score += SCORE_GLOBAL
+            reasons.append(f"core component(s) changed: {', '.join(global_changes)}")
+
+        scored.append((test, score, reasons))
+
+    # Skip tests only if we know what changed and none of the changes are global
+    skip = args.skip_unrelated and changed and not global_changes
+    # sorted() is stable, so tests with the same score keep their original order
+    ordered = sorted(scored, key=lambda t: t[1], reverse=True)
+
+    report = []
+    report.append(f"Changed files: {len(changed)} (relevant), core changes: {', '.join(global_changes) or 'none'}")
+    for test, score, reasons in ordered:
+        if skip and score == 0:
+            report.append(f"{test}: SKIPPED (no relation to the changes found)")
+            continue
+
+        print(test)
+        report.append(f"{test}: score {score}")
+        report.extend(f"    - {r}" for r in reasons)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write("\n".join(report) + "\n")
+
+    return 0
+
+def cmd_record(args):
+    history = load_history(args.history)
+    impact = history.setdefault("impact", {})
+
+    for logdir in args.logdirs:
+        changed = [p for p in read_lines(os.path.join(logdir, ".changed_files")) if not IGNORE_RX.search(p)]
+        directories = {changed_dir(p) for p in changed}
+        if len(directories) > RECORD_MAX_DIRS:
+            continue
+
+        # Strip the retry index added by exectask_retry*()
+        failed = {re.sub(r"_[0-9]+$", "", t) for t in read_lines(os.path.join(logdir, ".failed_tasks"))}
+        passed = {re.sub(r"_[0-9]+$", "", t) for t in read_lines(os.path.join(logdir, ".passed_tasks"))}
+        # A test which passed after a retry is not considered failed
+        failed -= passed
+        failed = {t for t in failed if TEST_NAME_RX.match(t)}
+
+        # Runs of the main branch (without any changes) count only into the baseline
+        for directory in [ALL_RUNS, *directories]:
+            entry = impact.setdefault(directory, {"runs": 0, "failures": {}})
+            entry["runs"] += 1
+            entry["updated"] = datetime.now().isoformat(timespec="seconds")
+            for test in failed:
+                entry["failures"][test] = entry["failures"].get(test, 0) + 1
+
+    save_history(args.history, history)
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Map changed files to the integration tests they likely affect")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    order = subparsers.add_parser("order", help="Order tests by their relation to the changed files")
+    order.add_argument("history", help="History store (JSON)")
+    order.add_argument("changed", help="File with a list of changed files (one per line)")
+    order.add_argument("--map", default=DEFAULT_MAP, help="Path -> test mapping (default: %(default)s)")
+    order.add_argument("--report", help="Write an explanation of the order into given file")
+    order.add_argument("--skip-unrelated", action="store_true", help="Drop tests unrelated to the changes")
+    order.add_argument("tests", nargs="*", help="Tests (or paths to tests) to order")
+    order.set_defaults(func=cmd_order)
+
+    record = subparsers.add_parser("record", help="Record test failures together with the changed files")
+    record.add_argument("history", help="History store (JSON)")
+    record.add_argument("logdirs", nargs="+", help="Task-control log directories")
+    record.set_defaults(func=cmd_record)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# pylint: disable=line-too-long,invalid-name,missing-function-docstring,too-many-locals
+"""Content-addressed cache of Vagrant boxes
+
+A published box is split into fixed-size chunks, which are stored (compressed)
+under their SHA-256 hash next to the box on the artifact server, together with
+a manifest describing which chunks make up each file in the box (box image,
+metadata.json, Vagrantfile). Since the chunks are addressed by their content,
+chunks which didn't change between two versions of a box (or which appear in
+several boxes) are uploaded, downloaded, and stored only once.
+
+On the hypervisor the chunks are kept in a local store (see DEFAULT_CACHE_DIR),
+which is carried over between jobs by agent-control.py (see --box-cache), so
+updating a box fetches only the chunks missing from the store. All chunks are
+verified against their hash before the box is added, and corrupted chunks are
+fetched again. The box is then streamed from the store straight into
+`vagrant box add` (over a local HTTP endpoint), so it's never assembled on disk.
+
+Usage:
+    vagrant-box-cache.py publish [--chunk-size MIB] BOX OUTPUT_DIR
+        Split given box (as created by `vagrant package`) into chunks stored in
+        OUTPUT_DIR/chunks/ and write the box manifest into
+        OUTPUT_DIR/<box name>.manifest.json
+
+    vagrant-box-cache.py fetch [--cache-dir DIR] [--jobs N] BOX_URL NAME
+        Make sure the box described by the manifest at BOX_URL.manifest.json is
+        added to Vagrant as NAME, fetching only chunks missing from the local
+        store. Exits with EC 2 if there's no manifest for the box, so the caller
+        can fall back to the regular download.
+
+    vagrant-box-cache.py referenced MANIFEST...
+        Print hashes of all chunks referenced by given manifests (used to prune
+        unreferenced chunks on the artifact server, see vagrant-make-cache.sh)
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import http.server
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from datetime import datetime
+
+DEFAULT_CACHE_DIR = os.environ.get("VAGRANT_BOX_CACHE", "/var/cache/systemd-centos-ci/vagrant-boxes")
+DEFAULT_CHUNK_SIZE_MIB = 8
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+FETCH_RETRIES = 3
+EC_NO_MANIFEST = 2
+
+
+class CorruptedChunkError(Exception):
+    """A chunk in the local store doesn't match its hash"""
+
+    def __init__(self, digest):
+        super().__init__(f"Chunk {digest} in the local store is corrupted")
+        self.digest = digest
+
+def log(message):
+    print(f"[vagrant-box-cache] {message}", file=sys.stderr, flush=True)
+
+def box_id(manifest):
+    """Compute the content hash of the whole box
+
+    The hash covers only the box content, so it doesn't change when the box is
+    renamed (i.e. when the -new box gets promoted to "production").
+    """
+    content = json.dumps(manifest["files"], sort_keys=True).encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+def referenced_chunks(manifests):
+    return {d for m in manifests for e in m["files"] for d in e["chunks"]}
+
+def chunk_path(directory, digest):
+    # Spread the chunks across subdirectories, so we don't end up with tens of
+    # thousands of files in a single directory
+    return os.path.join(directory, digest[:2], digest)
+
+def write_atomically(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(path), delete=False) as f:
+        f.write(data)
+
+    os.replace(f.name, path)
+
+def cmd_publish(args):
+    chunk_size = args.chunk_size * 1024 * 1024
+    chunks_dir = os.path.join(args.output, "chunks")
+    name = os.path.basename(args.box)
+    files = []
+    new_chunks = 0
+    new_bytes = 0
+
+    # `vagrant package` creates a (usually gzipped) tarball, "r:*" handles both
+    with tarfile.open(args.box, "r:*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+
+            entry = {"name": member.name, "mode": member.mode, "size": member.size, "chunks": []}
+            fileobj = tar.extractfile(member)
+            while chunk := fileobj.read(chunk_size):
+                digest = hashlib.sha256(chunk).hexdigest()
+                entry["chunks"].append(digest)
+                path = chunk_path(chunks_dir, digest)
+                if not os.path.exists(path):
+                    data = zlib.compress(chunk, 1)
+                    write_atomically(path, data)
+                    new_chunks += 1
+                    new_bytes += len(data)
+
+            files.append(entry)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "name": name,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "chunk_size": chunk_size,
+        "files": files,
+    }
+    manifest["id"] = box_id(manifest)
+    write_atomically(os.path.join(args.output, name + MANIFEST_SUFFIX), json.dumps(manifest, indent=2).encode("utf-8"))
+
+    total = sum(len(f["chunks"]) for f in files)
+    log(f"Box {name} ({manifest['id']}): {total} chunks, {new_chunks} written ({new_bytes / 1024 ** 2:.1f} MiB compressed)")
+    return 0
+
+def download(url):
+    """Download given URL with retries
+
+    Returns:
+    --------
+    Downloaded data or None if the URL doesn't exist
+    """
+    for attempt in range(1, FETCH_RETRIES + 1):
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            if attempt == FETCH_RETRIES:
+                raise
+        except (urllib.error.URLError, OSError):
+            if attempt == FETCH_RETRIES:
+                raise
+
+        log(f"Failed to fetch {url} (attempt {attempt}/{FETCH_RETRIES}), retrying")
+        time.sleep(attempt * 5)
+
+    return None
+
+def fetch_chunk(base_url, chunks_dir, digest):
+    data = download(f"{base_url}/chunks/{digest[:2]}/{digest}")
+    if data is None:
+        raise RuntimeError(f"Chunk {digest} is missing on the server")
+
+    data = zlib.decompress(data)
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise RuntimeError(f"Chunk {digest} is corrupted on the server")
+
+    write_atomically(chunk_path(chunks_dir, digest), data)
+    return len(data)
+
+def fetch_chunks(base_url, chunks_dir, digests, jobs):
+    """Fetch given chunks into the local store in parallel
+
+    Returns:
+    --------
+    Number of fetched bytes (uncompressed)
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return sum(executor.map(lambda d: fetch_chunk(base_url, chunks_dir, d), digests))
+
+class ChunkReader(io.RawIOBase):
+    """Read a file from the chunk store chunk by chunk"""
+
+    def __init__(self, chunks_dir, digests):
+        super().__init__()
+        self.chunks_dir = chunks_dir
+        self.digests = iter(digests)
+        self.buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            digest = next(self.digests, None)
+            if digest is None:
+                return 0
+
+            with open(chunk_path(self.chunks_dir, digest), "rb") as f:
+                # Use a memoryview, so we don't copy the rest of the chunk on each read
+                self.buffer = memoryview(f.read())
+
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+def verify_store(chunks_dir, digests):
+    """Verify given chunks in the local store against their hashes
+
+    Throws:
+    -------
+    CorruptedChunkError if a chunk in the store doesn't match its hash
+    """
+    for digest in digests:
+        with open(chunk_path(chunks_dir, digest), "rb") as f:
+            if hashlib.sha256(f.read()).hexdigest() != digest:
+                raise CorruptedChunkError(digest)
+
+def write_box(manifest, chunks_dir, fileobj):
+    """Write the box (uncompressed tarball) from the chunk store into a stream"""
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        for entry in manifest["files"]:
+            info = tarfile.TarInfo(entry["name"])
+            info.size = entry["size"]
+            info.mode = entry["mode"]
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BufferedReader(ChunkReader(chunks_dir, entry["chunks"]), 1024 * 1024))
+
+class BoxServer(http.server.ThreadingHTTPServer):
+    """Serve the box straight from the chunk store on a local port
+
+    `vagrant box add` takes only a path or a URL, so this lets us feed the box
+    into it without assembling it on disk first
+    """
+
+    def __init__(self, manifest, chunks_dir):
+        super().__init__(("127.0.0.1", 0), BoxRequestHandler)
+        self.manifest = manifest
+        self.chunks_dir = chunks_dir
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/{manifest['name']}.tar"
+
+class BoxRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Stream the box of the parent BoxServer as a tarball"""
+
+    def send_box_headers(self):
+        # The size of the tarball is not known upfront, so don't use keep-alive
+        # and signal the end of the data by closing the connection
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-tar")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.send_box_headers()
+
+    def do_GET(self):
+        self.send_box_headers()
+        write_box(self.server.manifest, self.server.chunks_dir, self.wfile)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        log(f"{self.address_string()} {format % args}")
+
+def add_box(manifest, chunks_dir, name):
+    with BoxServer(manifest, chunks_dir) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            subprocess.run(["vagrant", "box", "add", "--force", "--name", name, server.url], check=True)
+        finally:
+            server.shutdown()
+            thread.join()
+
+def box_installed(name):
+    result = subprocess.run(["vagrant", "box", "list", "--machine-readable"], stdout=subprocess.PIPE, text=True, check=True)
+    # Format: timestamp,target,type,data
+    return any(line.split(",")[2:4] == ["box-name", name] for line in result.stdout.splitlines())
+
+def prune_store(cache_dir, chunks_dir):
+    """Drop chunks not referenced by any of the installed boxes"""
+    manifests = []
+    manifests_dir = os.path.join(cache_dir, "manifests")
+    for filename in os.listdir(manifests_dir):
+        with open(os.path.join(manifests_dir, filename), encoding="utf-8") as f:
+            manifests.append(json.load(f))
+
+    referenced = referenced_chunks(manifests)
+
+    pruned = 0
+    for subdir in os.listdir(chunks_dir):
+        for digest in os.listdir(os.path.join(chunks_dir, subdir)):
+            if digest not in referenced:
+                os.unlink(os.path.join(chunks_dir, subdir, digest))
+                pruned += 1
+
+    if pruned:
+        log(f"Pruned {pruned} unreferenced chunk(s) from the store")
+
+def cmd_fetch(args):
+    base_url = args.box_url.rsplit("/", 1)[0]
+    chunks_dir = os.path.join(args.cache_dir, "chunks")
+    installed_manifest = os.path.join(args.cache_dir, "manifests", args.name + MANIFEST_SUFFIX)
+    os.makedirs(os.path.dirname(installed_manifest), exist_ok=True)
+    os.makedirs(chunks_dir, exist_ok=True)
+
+    data = download(args.box_url + MANIFEST_SUFFIX)
+    if data is None:
+        log(f"No manifest found for {args.box_url}")
+        return EC_NO_MANIFEST
+
+    manifest = json.loads(data)
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("id") != box_id(manifest):
+        raise RuntimeError(f"Invalid manifest for {args.box_url}")
+
+    try:
+        with open(installed_manifest, encoding="utf-8") as f:
+            installed_id = json.load(f)["id"]
+    except (OSError, ValueError, KeyError):
+        installed_id = None
+
+    if installed_id == manifest["id"] and box_installed(args.name):
+        log(f"Box {args.name} ({manifest['id']}) is up-to-date")
+        return 0
+
+    digests = sorted(referenced_chunks([manifest]))
+    missing = [d for d in digests if not os.path.exists(chunk_path(chunks_dir, d))]
+    log(f"Box {args.name} ({manifest['id']}): {len(digests)} unique chunks, {len(missing)} missing in the local store")
+    fetched = fetch_chunks(base_url, chunks_dir, missing, args.jobs)
+    log(f"Fetched {fetched / 1024 ** 2:.1f} MiB")
+
+    # Verify the whole box before adding it (the store might have been carried
+    # over from another machine), and if we hit a corrupted chunk in the store,
+    # fetch it again, and start over
+    for attempt in range(1, FETCH_RETRIES + 1):
+        try:
+            verify_store(chunks_dir, digests)
+            break
+        except CorruptedChunkError as e:
+            if attempt == FETCH_RETRIES:
+                raise
+
+            log(f"{e}, fetching it again")
+            fetch_chunk(base_url, chunks_dir, e.digest)
+
+    add_box(manifest, chunks_dir, args.name)
+
+    write_atomically(installed_manifest, json.dumps(manifest, indent=2).encode("utf-8"))
+    prune_store(args.cache_dir, chunks_dir)
+    return 0
+
+def cmd_referenced(args):
+    manifests = []
+    for path in args.manifests:
+        with open(path, encoding="utf-8") as f:
+            manifests.append(json.load(f))
+
+    for digest in sorted(referenced_chunks(manifests)):
+        print(digest)
+
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed cache of Vagrant boxes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    publish = subparsers.add_parser("publish", help="Split a box into content-addressed chunks")
+    publish.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE_MIB, help="Chunk size in MiB (default: %(default)s)")
+    publish.add_argument("box", help="Box file")
+    publish.add_argument("output", help="Output directory")
+    publish.set_defaults(func=cmd_publish)
+
+    fetch = subparsers.add_parser("fetch", help="Fetch and add a box using the local chunk store")
+    fetch.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Local chunk store (default: %(default)s)")
+    fetch.add_argument("--jobs", type=int, default=4, help="Number of parallel downloads (default: %(default)s)")
+    fetch.add_argument("box_url", help="URL of the box (the manifest is expected at BOX_URL.manifest.json)")
+    fetch.add_argument("name", help="Name of the box in Vagrant")
+    fetch.set_defaults(func=cmd_fetch)
+
+    referenced = subparsers.add_parser("referenced", help="Print hashes of chunks referenced by given manifests")
+    referenced.add_argument("manifests", nargs="+", metavar="MANIFEST", help="Box manifest")
+    referenced.set_defaults(func=cmd_referenced)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -35,6 +35,13 @@ pacman -Q > vagrant-arch-installed-pkgs.txt
     cat /proc/version
 } > vagrant-arch-osinfo.txt
 
+# Use the ccache directory handed over by the host, if any (see vagrant-ci-wrapper.sh -c)
+if [[ -d /build/.ccache ]]; then
+    # shellcheck source=common/utils.sh
+    . "${VAGRANT_GUEST_TEST_DIR:?}/utils.sh"
+    ccache_setup /build/.ccache || :
+fi
+
 rm -fr "$BUILD_DIR"
 # Build phase
 meson setup "$BUILD_DIR" \
@@ -52,6 +59,7 @@ meson setup "$BUILD_DIR" \
       -Ddbuspolicydir=/usr/share/dbus-1/system.d \
       -Dlocalegen-path=/usr/bin/locale-gen
 ninja -C "$BUILD_DIR"
+[[ -v CCACHE_DIR ]] && ccache --show-stats | tee vagrant-arch-ccache-stats.txt
 
 # Install the universal coverage uploader
 # https://github.com/coverallsapp/coverage-reporter
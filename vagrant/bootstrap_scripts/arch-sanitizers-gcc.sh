@@ -33,6 +33,13 @@ pacman -Q > vagrant-arch-sanitizers-gcc-installed-pkgs.txt
     cat /proc/version
 } > vagrant-arch-sanitizers-gcc-osinfo.txt
 
+# Use the ccache directory handed over by the host, if any (see vagrant-ci-wrapper.sh -c)
+if [[ -d /build/.ccache ]]; then
+    # shellcheck source=common/utils.sh
+    . "${VAGRANT_GUEST_TEST_DIR:?}/utils.sh"
+    ccache_setup /build/.ccache || :
+fi
+
 rm -fr "$BUILD_DIR"
 # Build phase
 # Compile systemd with the Address Sanitizer (ASan) and Undefined Behavior
@@ -68,6 +75,7 @@ meson setup "$BUILD_DIR" \
       -Dman=false \
       -Db_sanitize=address,undefined
 ninja -C "$BUILD_DIR"
+[[ -v CCACHE_DIR ]] && ccache --show-stats | tee vagrant-arch-sanitizers-gcc-ccache-stats.txt
 
 # Manually install upstream D-Bus config file for org.freedesktop.network1
 # so systemd-networkd testsuite can use potentially new/updated methods
@@ -41,6 +41,13 @@ pacman -Q > vagrant-arch-installed-pkgs.txt
     cat /proc/version
 } > vagrant-arch-osinfo.txt
 
+# Use the ccache directory handed over by the host, if any (see vagrant-ci-wrapper.sh -c)
+if [[ -d /build/.ccache ]]; then
+    # shellcheck source=common/utils.sh
+    . "${VAGRANT_GUEST_TEST_DIR:?}/utils.sh"
+    ccache_setup /build/.ccache || :
+fi
+
 rm -fr "$BUILD_DIR"
 # Build phase
 # shellcheck disable=SC2046
@@ -62,6 +69,7 @@ meson setup "$BUILD_DIR" \
       -Dhtml=true
 ninja -C "$BUILD_DIR"
 ninja -C "$BUILD_DIR" install
+[[ -v CCACHE_DIR ]] && ccache --show-stats | tee vagrant-arch-ccache-stats.txt
 
 # Make sure the revision we just compiled is actually bootable
 (
@@ -40,6 +40,13 @@ setenforce 0
 sed -ri 's/^SELINUX=\w+$/SELINUX=permissive/' /etc/selinux/config
 cat /etc/selinux/config
 
+# Use the ccache directory handed over by the host, if any (see vagrant-ci-wrapper.sh -c)
+if [[ -d /build/.ccache ]]; then
+    # shellcheck source=common/utils.sh
+    . "${VAGRANT_GUEST_TEST_DIR:?}/utils.sh"
+    ccache_setup /build/.ccache || :
+fi
+
 # Build & install latest systemd
 rm -fr "$BUILD_DIR"
 meson setup "$BUILD_DIR" \
@@ -53,6 +60,7 @@ meson setup "$BUILD_DIR" \
       -Dtests=true \
       -Dinstall-tests=true
 ninja -C "$BUILD_DIR" install
+[[ -v CCACHE_DIR ]] && ccache --show-stats | tee vagrant-rawhide-ccache-stats.txt
 popd
 
 # Install the latest SELinux policy
@@ -19,7 +19,7 @@ pacman --needed --noconfirm -Sy archlinux-keyring
 pacman --noconfirm -Syu
 # Install build dependencies
 # Package groups: base, base-devel
-pacman --needed --noconfirm -Sy base base-devel bpf btrfs-progs acl audit bash-completion clang compiler-rt docbook-xsl \
+pacman --needed --noconfirm -Sy base base-devel bpf btrfs-progs acl audit bash-completion ccache clang compiler-rt docbook-xsl \
     ethtool gdm git gnu-efi-libs gperf intltool iptables kexec-tools kmod libbpf libcap libelf libfido2 libgcrypt libidn2 \
     libmicrohttpd libpwquality libseccomp libutil-linux libxkbcommon libxslt linux-api-headers llvm llvm-libs lvm2 lz4 \
     meson multipath-tools ninja p11-kit pam pcre2 pesign python-jinja python-lxml python-pillow qrencode quota-tools rust \
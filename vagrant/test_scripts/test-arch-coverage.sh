@@ -127,7 +127,8 @@ for t in test/TEST-??-*; do
     mkdir -p "$TESTDIR"
     rm -f "$TESTDIR/pass"
 
-    exectask_p "${t##*/}" "/bin/time -v -- make -C $t setup run && touch $TESTDIR/pass"
+    TASK_EXIT_HOOK=crash_harvest_hook \
+        exectask_p "${t##*/}" "/bin/time -v -- make -C $t setup run && touch $TESTDIR/pass"
     EXECUTED_LIST+=("$t")
 done
 
@@ -149,7 +150,8 @@ for t in "${FLAKE_LIST[@]}"; do
 
     # Suffix the $TESTDIR of each retry with an index to tell them apart
     export MANGLE_TESTDIR=1
-    exectask_retry "${t##*/}" "/bin/time -v -- make -C $t setup run && touch \$TESTDIR/pass"
+    TASK_EXIT_HOOK=crash_harvest_hook \
+        exectask_retry "${t##*/}" "/bin/time -v -- make -C $t setup run && touch \$TESTDIR/pass"
 
     # Retried tasks are suffixed with an index, so update the $EXECUTED_LIST
     # array accordingly to correctly find the respective journals
@@ -164,15 +166,9 @@ for t in "${EXECUTED_LIST[@]}"; do
     testdir="/var/tmp/systemd-test-$testname"
 
     if [[ -f "$testdir/system.journal" ]]; then
-        # Filter out test-specific coredumps which are usually intentional
-        # Note: $COREDUMPCTL_EXCLUDE_MAP resides in common/utils.sh
-        if [[ -v "COREDUMPCTL_EXCLUDE_MAP[$t]" ]]; then
-            export COREDUMPCTL_EXCLUDE_RX="${COREDUMPCTL_EXCLUDE_MAP[$t]}"
-        fi
-        # Attempt to collect coredumps from test-specific journals as well
-        exectask "${testname}_coredumpctl_collect" "coredumpctl_collect '$testdir/'"
-        # Make sure to not propagate the custom coredumpctl filter override
-        [[ -v COREDUMPCTL_EXCLUDE_RX ]] && unset -v COREDUMPCTL_EXCLUDE_RX
+        # Most of the journals were already processed by the exit hook, this
+        # picks up only those which were missed or changed since then
+        crash_harvest "${testname}" "$testdir"
 
         # Keep the journal files only if the associated test case failed
         if [[ ! -f "$testdir/pass" ]]; then
@@ -194,6 +190,8 @@ exectask "lcov_collect-build_dir-final" "lcov_collect $COVERAGE_DIR/build_dir.co
 
 # Collect coredumps using the coredumpctl utility, if any
 exectask "coredumpctl_collect" "coredumpctl_collect"
+# Write a consolidated report of all crashes found in the test journals
+crash_report_write "$LOGDIR/crash-report.json"
 
 # Merge all "coverage-info" files from the integration tests into one file
 exectask "lcov-merge-coverage" "lcov_merge everything.coverage-info $COVERAGE_DIR"
@@ -14,6 +14,9 @@ SCRIPT_DIR="$(dirname "$0")"
 export BUILD_DIR="${BUILD_DIR:-/systemd-meson-build}"
 # Consumed by coredumpctl_init()/coredumpctl_collect()
 export COREDUMPCTL_BIN="$BUILD_DIR/coredumpctl"
+# Consumed by crash_harvest(), check test journals for sanitizer errors as well
+export CRASH_HARVEST_SANITIZERS=1
+export JOURNALCTL_BIN="$BUILD_DIR/journalctl"
 
 # Following scripts are copied from the systemd-centos-ci/common directory by vagrant-builder.sh
 # shellcheck source=common/task-control.sh
@@ -181,7 +184,8 @@ if [[ $NSPAWN_EC -eq 0 ]]; then
 
         # Suffix the $TESTDIR of each retry with an index to tell them apart
         export MANGLE_TESTDIR=1
-        exectask_retry_p "${t##*/}" "/bin/time -v -- make -C $t setup run && touch \$TESTDIR/pass"
+        TASK_EXIT_HOOK=crash_harvest_hook \
+            exectask_retry_p "${t##*/}" "/bin/time -v -- make -C $t setup run && touch \$TESTDIR/pass"
 
         # Retried tasks are suffixed with an index, so update the $CHECK_LIST
         # array with all possible task names correctly find the respective journals
@@ -195,20 +199,11 @@ if [[ $NSPAWN_EC -eq 0 ]]; then
     for t in "TEST-01-BASIC_sanitizers-qemu" "${CHECK_LIST[@]}"; do
         testdir="/var/tmp/systemd-test-${t##*/}"
         if [[ -f "$testdir/system.journal" ]]; then
-            # Filter out test-specific coredumps which are usually intentional
-            # Note: $COREDUMPCTL_EXCLUDE_MAP resides in common/utils.sh
-            # Note2: since all tests in this run are using the `exectask_retry`
-            #        runner, they're always suffixed with '_X'
-            if [[ -v "COREDUMPCTL_EXCLUDE_MAP[${t%_[0-9]}]" ]]; then
-                export COREDUMPCTL_EXCLUDE_RX="${COREDUMPCTL_EXCLUDE_MAP[${t%_[0-9]}]}"
-            fi
-            # Attempt to collect coredumps from test-specific journals as well
-            exectask "${t##*/}_coredumpctl_collect" "coredumpctl_collect '$testdir/'"
-            # Make sure to not propagate the custom coredumpctl filter override
-            [[ -v COREDUMPCTL_EXCLUDE_RX ]] && unset -v COREDUMPCTL_EXCLUDE_RX
+            # Most of the journals were already processed by the exit hook, this
+            # picks up only those which were missed or changed since then
+            # Note: this checks the test journals for sanitizer errors as well
+            crash_harvest "${t##*/}" "$testdir"
 
-            # Check for sanitizer errors in test journals
-            exectask "${t##*/}_sanitizer_errors" "$BUILD_DIR/journalctl -o short-monotonic --no-hostname --file $testdir/system.journal | check_for_sanitizer_errors"
             # Keep the journal files only if the associated test case failed
             if [[ ! -f "$testdir/pass" ]]; then
                 rsync -aq "$testdir/system.journal" "$LOGDIR/${t##*/}/"
@@ -235,6 +230,8 @@ exectask "test_logs_sanitizer_errors" "_check_test_logs_for_sanitizer_errors"
 exectask "check-journal-for-sanitizer-errors" "journalctl -o short-monotonic --no-hostname -b | check_for_sanitizer_errors"
 # Collect coredumps using the coredumpctl utility, if any
 exectask "coredumpctl_collect" "coredumpctl_collect"
+# Write a consolidated report of all crashes found in the test journals
+crash_report_write "$LOGDIR/crash-report.json"
 
 # Summary
 show_task_summary
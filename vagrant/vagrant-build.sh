@@ -95,17 +95,37 @@ TEST_DIR="$(mktemp -d "$SYSTEMD_ROOT/vagrant-$DISTRO_STRING-config.XXX")"
 # Relative path (i.e just the vagrant-$DISTRO_STRING.XXX dir) used for navigation
 # in the guest VM
 RELATIVE_TEST_DIR="${TEST_DIR##*/}"
+# The same directory as seen from the guest VM (where $SYSTEMD_ROOT is mounted
+# under /build), passed to the bootstrap script by the respective Vagrantfile,
+# so it can use the shared helpers from utils.sh
+export VAGRANT_GUEST_TEST_DIR="/build/$RELATIVE_TEST_DIR"
 
 # Copy the target Vagrant file to the test dir
 cp "$VAGRANT_FILE" "$TEST_DIR/Vagrantfile"
 cp "$VAGRANT_ROOT/../common/task-control.sh" "$TEST_DIR/task-control.sh"
 cp "$VAGRANT_ROOT/../common/utils.sh" "$TEST_DIR/utils.sh"
+# Known flaky failure signatures used by exectask_retry() (see task-control.sh)
+cp "$VAGRANT_ROOT/../common/flaky-signatures.txt" "$TEST_DIR/flaky-signatures.txt"
 pushd "$TEST_DIR" || { echo >&2 "Can't pushd to $TEST_DIR"; exit 1; }
 # Copy the test script to the test dir
 # Note: -L is necessary, since some test script may be symlinks, to avoid
 #       code duplication
 cp -L "$TEST_SCRIPT" "$TEST_DIR/"
 
+# Add/update the box using the content-addressed box cache on the hypervisor
+# (carried over between jobs by agent-control.py, see --box-cache), which fetches
+# only the chunks that changed since the last time (see
+# utils/vagrant-box-cache.py). Vagrant then finds the box already added and
+# skips the download. If there's no manifest published for the box (or the
+# cache fails for whatever reason), let Vagrant download the whole box itself.
+BOX_URL="$(grep -Po -m1 '^[^#]*config\.vm\.box_url\s*=\s*"\K[^"]+(?=")' Vagrantfile | sed 's/-new$//')" || :
+if [[ -n "$BOX_URL" ]]; then
+    [[ -n "${VAGRANT_TEST_IMAGE:-}" ]] && BOX_URL="$BOX_URL-new"
+    if ! "$VAGRANT_ROOT/../utils/vagrant-box-cache.py" fetch "$BOX_URL" "${BOX_URL##*/}"; then
+        echo >&2 "Failed to fetch box '${BOX_URL##*/}' using the box cache, falling back to the regular download"
+    fi
+fi
+
 # Provision the machine
 vagrant up --no-tty --provider=libvirt
 
@@ -22,6 +22,11 @@ at_exit() {
     # Collect QEMU serial console logs (see the configuration in a respective
     # Vagrantfile)
     cp /tmp/vagrant-*-console.log "$LOGDIR"
+    # Return the ccache directory back, so it can be collected by agent-control.py
+    if [[ $USE_CCACHE -ne 0 && -d "$SYSTEMD_ROOT/.ccache" ]]; then
+        rm -fr "$CCACHE_DIR"
+        mv "$SYSTEMD_ROOT/.ccache" "$CCACHE_DIR"
+    fi
 }
 
 REPO_URL="https://github.com/systemd/systemd.git"
@@ -38,15 +43,27 @@ SCRIPT_ROOT="$(dirname "$0")"
 # distro-tag: arch
 DISTRO=""
 REMOTE_REF=""
+# Use the systemd checkout in ./systemd instead of cloning $REPO_URL
+# (see --push-sources in agent-control.py)
+LOCAL_SOURCES=0
+# Cache compiled objects in $CCACHE_DIR (see --build-cache in agent-control.py)
+USE_CCACHE=0
+CCACHE_DIR="${CCACHE_DIR:-/var/cache/systemd-centos-ci/ccache}"
 
 set -eu
 set -o pipefail
 
-while getopts "d:r:s:" opt; do
+while getopts "cd:lr:s:" opt; do
     case "$opt" in
+        c)
+            USE_CCACHE=1
+            ;;
         d)
             DISTRO="$OPTARG"
             ;;
+        l)
+            LOCAL_SOURCES=1
+            ;;
         r)
             REMOTE_REF="$OPTARG"
             ;;
@@ -57,7 +74,7 @@ while getopts "d:r:s:" opt; do
             exit 1
             ;;
         *)
-            echo "Usage: $0 -d DISTRO_TAG [-r REMOTE_REF] [-s SOURCE_REPO_URL]"
+            echo "Usage: $0 -d DISTRO_TAG [-c] [-l] [-r REMOTE_REF] [-s SOURCE_REPO_URL]"
             exit 1
     esac
 done
@@ -66,16 +83,25 @@ if [[ -z "$DISTRO" ]]; then
     echo >&2 "Missing argument: distro tag"
 fi
 
-# Fetch the upstream systemd repo
-test -e systemd && rm -rf systemd
-echo "Cloning repo: $REPO_URL"
-git clone "$REPO_URL" systemd
+if [[ $LOCAL_SOURCES -ne 0 ]]; then
+    # The repo is already checked out at the requested ref
+    echo "Using local repo: $PWD/systemd"
+else
+    # Fetch the upstream systemd repo
+    test -e systemd && rm -rf systemd
+    echo "Cloning repo: $REPO_URL"
+    git clone "$REPO_URL" systemd
+fi
 export SYSTEMD_ROOT="$PWD/systemd"
 
 trap at_exit EXIT
 
 pushd systemd || { echo >&2 "Can't pushd to systemd"; exit 1; }
-git_checkout_pr "$REMOTE_REF"
+if [[ $LOCAL_SOURCES -ne 0 ]]; then
+    git log -1
+else
+    git_checkout_pr "$REMOTE_REF"
+fi
 
 # Create a Coveralls configuration file if the Coveralls token is present
 # (the file is provided by the agent-control.py script)
@@ -89,6 +115,14 @@ service_name: CentOS CI
 EOF
     )
 fi
+
+# Hand the ccache directory over to the VM, which gets only the systemd repo
+# (as /build) shared from the host (see the bootstrap scripts in vagrant/bootstrap_scripts)
+if [[ $USE_CCACHE -ne 0 ]]; then
+    mkdir -p "$CCACHE_DIR"
+    rm -fr .ccache
+    mv "$CCACHE_DIR" .ccache
+fi
 popd
 
 # Disable SELinux on the test hosts and avoid false positives.
@@ -176,5 +176,30 @@ popd && rm -fr "$TEST_DIR"
 mkdir vagrant_boxes
 mv "$BOX_NAME" vagrant_boxes
 
-rsync -e "ssh -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no -i $DUFFY_SSH_KEY" -av "vagrant_boxes" systemd@artifacts.ci.centos.org:/srv/artifacts/systemd/
+# Split the box into content-addressed chunks + a manifest, so the CI jobs can
+# fetch only the chunks that changed (see utils/vagrant-box-cache.py)
+"$VAGRANT_ROOT/../utils/vagrant-box-cache.py" publish "vagrant_boxes/$BOX_NAME" vagrant_boxes
+
+RSYNC_SSH="ssh -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no -i $DUFFY_SSH_KEY"
+# The chunks are named by their content, so there's no need to upload (or even
+# compare) the already existing ones
+rsync -e "$RSYNC_SSH" -av --ignore-existing "vagrant_boxes/chunks" systemd@artifacts.ci.centos.org:/srv/artifacts/systemd/vagrant_boxes/
+# Upload the manifest only after all its chunks are in place
+rsync -e "$RSYNC_SSH" -av --exclude "chunks/" "vagrant_boxes" systemd@artifacts.ci.centos.org:/srv/artifacts/systemd/
+
+# Prune chunks which are no longer referenced by any box manifest on the server.
+# The server supports only rsync, so mirror the referenced chunks as empty
+# placeholder files and let rsync delete everything else (--existing together
+# with --ignore-existing makes sure nothing is actually transferred).
+# Note: chunks of the currently published boxes are referenced by their
+#       manifests until the boxes are replaced, so this never affects running jobs
+mkdir box_manifests box_chunks
+rsync -e "$RSYNC_SSH" -a --include "*.manifest.json" --exclude "*" systemd@artifacts.ci.centos.org:/srv/artifacts/systemd/vagrant_boxes/ box_manifests/
+if compgen -G "box_manifests/*.manifest.json" >/dev/null; then
+    "$VAGRANT_ROOT/../utils/vagrant-box-cache.py" referenced box_manifests/*.manifest.json | while read -r digest; do
+        mkdir -p "box_chunks/${digest:0:2}"
+        touch "box_chunks/${digest:0:2}/$digest"
+    done
+    rsync -e "$RSYNC_SSH" -rv --delete --existing --ignore-existing box_chunks/ systemd@artifacts.ci.centos.org:/srv/artifacts/systemd/vagrant_boxes/chunks/
+fi
 echo "Box URL: https://artifacts.ci.centos.org/systemd/vagrant_boxes/$BOX_NAME"